@@ -3,7 +3,7 @@ from django.utils import timezone
 from .models import (
     Contact, Template, Campaign, OutgoingMessage, 
     Tag, Rule, Workflow, FollowUp, Attachment,
-    Subscription, Payment
+    Subscription, Payment, EnqueueJob, ImportJob, Segment, AudienceSnapshot
 )
 
 @admin.register(Tag)
@@ -36,6 +36,29 @@ class OutgoingMessageAdmin(admin.ModelAdmin):
     list_filter = ('status',)
     search_fields = ('contact__phone', 'contact__name')
 
+@admin.register(Segment)
+class SegmentAdmin(admin.ModelAdmin):
+    list_display = ('__str__','filter_type','created_at')
+    list_filter = ('filter_type',)
+    search_fields = ('name',)
+
+@admin.register(AudienceSnapshot)
+class AudienceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('campaign','segment','contact_count','created_at')
+    exclude = ('data',)
+
+@admin.register(EnqueueJob)
+class EnqueueJobAdmin(admin.ModelAdmin):
+    list_display = ('campaign','status','processed','total','messages_created','created_at','finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('last_contact_id', 'claimed_by', 'lease_expires_at', 'started_at', 'updated_at', 'finished_at')
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('filename','status','processed','total','contacts_created','contacts_updated','error_count','created_at','finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('file_path', 'error_file', 'claimed_by', 'lease_expires_at', 'started_at', 'updated_at', 'finished_at')
+
 @admin.register(Rule)
 class RuleAdmin(admin.ModelAdmin):
     list_display = ('name', 'priority', 'active', 'schedule_start', 'schedule_end')
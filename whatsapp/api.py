@@ -11,7 +11,8 @@ from .serializers import (
     OutgoingMessageSerializer, TagSerializer, RuleSerializer,
     WorkflowSerializer, FollowUpSerializer, AttachmentSerializer
 )
-from .utils import process_template
+from .wakeup import notify_workers
+from .enqueue import enqueue_campaign
 
 class TagViewSet(viewsets.ModelViewSet):
     queryset = Tag.objects.annotate(contact_count=Count('contacts')).order_by('name')
@@ -28,11 +29,18 @@ class TagViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 class ContactViewSet(viewsets.ModelViewSet):
-    queryset = Contact.objects.all().order_by('name')
+    queryset = Contact.objects.prefetch_related('tags').order_by('name')
     serializer_class = ContactSerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'phone', 'group']
     
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # ?opt_in=true: solo contactos que aceptan mensajes (selector de destinatarios)
+        if self.request.query_params.get('opt_in') == 'true':
+            queryset = queryset.filter(opt_in=True)
+        return queryset
+    
     @action(detail=False, methods=['get'])
     def by_group(self, request):
         """Listar contactos agrupados por grupo"""
@@ -73,21 +81,13 @@ class CampaignViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def enqueue(self, request, pk=None):
-        """Encolar mensajes para todos los contactos opt-in"""
+        """Encolar mensajes para los contactos del segmento de la campaña"""
         try:
             campaign = self.get_object()
-            contacts = Contact.objects.filter(opt_in=True)
-            created = 0
-            for c in contacts:
-                payload = process_template(campaign.template.content, {'nombre': c.name, 'telefono': c.phone, 'grupo': c.group})
-                OutgoingMessage.objects.create(campaign=campaign, contact=c, payload=payload)
-                created += 1
-            
-            # Actualizar estadísticas
-            campaign.total_contacts = created
-            campaign.save()
+            result = enqueue_campaign(campaign, campaign.audience_segment().queryset())
+            notify_workers(campaign.pk)
             
-            return Response({'enqueued': created})
+            return Response({'enqueued': result.messages, **result.as_dict()})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -101,12 +101,13 @@ class CampaignViewSet(viewsets.ModelViewSet):
             'pending': messages.filter(status='pending').count(),
             'sent': messages.filter(status='sent').count(),
             'failed': messages.filter(status='failed').count(),
+            'dead': messages.filter(status='dead').count(),
             'success_rate': campaign.success_rate
         }
         return Response(stats)
 
 class OutgoingMessageViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = OutgoingMessage.objects.all().order_by('-created_at')
+    queryset = OutgoingMessage.objects.select_related('contact', 'campaign__template').order_by('-created_at')
     serializer_class = OutgoingMessageSerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['contact__name', 'contact__phone']
@@ -5,9 +5,10 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.utils import timezone
-from django.db import transaction
 
 from .models import Contact, Template, Campaign, OutgoingMessage
+from .enqueue import enqueue_campaign
+from .wakeup import notify_workers
 from .serializers import (
     ContactSerializer, TemplateSerializer,
     CampaignSerializer, OutgoingMessageSerializer
@@ -104,33 +105,20 @@ class CampaignViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create outgoing messages
-        messages_created = 0
-        with transaction.atomic():
-            for contact in contacts:
-                # Check if message already exists for this campaign and contact
-                if not OutgoingMessage.objects.filter(
-                    campaign=campaign,
-                    contact=contact
-                ).exists():
-                    content = campaign.template.render(contact)
-                    OutgoingMessage.objects.create(
-                        campaign=campaign,
-                        contact=contact,
-                        content=content,
-                        status='pending'
-                    )
-                    messages_created += 1
-            
-            # Update campaign status
-            if campaign.status == 'draft':
-                campaign.status = 'scheduled'
-                campaign.save()
+        # Create outgoing messages (contacts already enqueued are skipped
+        # by the unique constraint, so repeating the call is safe)
+        result = enqueue_campaign(campaign, contacts)
+        notify_workers(campaign.pk)
+        
+        # Update campaign status
+        if campaign.status == 'draft':
+            campaign.status = 'scheduled'
+            campaign.save(update_fields=['status'])
         
         return Response({
             'success': True,
-            'messages_created': messages_created,
-            'total_contacts': contacts.count()
+            'messages_created': result.messages,
+            'total_contacts': result.contacts
         })
 
     @action(detail=True, methods=['get'])
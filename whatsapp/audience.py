@@ -0,0 +1,90 @@
+"""
+Tamaño de audiencias (Segment) para los formularios de campañas.
+
+estimate_audience() cuenta el segmento con una sola consulta agregada
+(GROUP BY grupo) que da a la vez el total y el desglose por grupo, en lugar
+de un COUNT por grupo. El resultado se guarda en la caché de Django.
+
+Invalidación: las claves llevan un número de versión que se incrementa
+cuando cambian contactos o etiquetas (señales en models.py y llamadas
+explícitas tras QuerySet.update(), que no envía señales). Así no hace falta
+conocer qué claves borrar. La versión se guarda en la BD (CacheVersion) y
+no en la caché: la caché por defecto es local a cada proceso y un cambio
+hecho en otro worker de gunicorn o en run_worker no se vería.
+"""
+import hashlib
+import json
+import logging
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+
+from .models import CacheVersion
+
+logger = logging.getLogger(__name__)
+
+# Segundos que se guarda un conteo (además de la invalidación por versión)
+AUDIENCE_CACHE_SECONDS = 300
+VERSION_NAME = 'audience'
+
+
+def invalidate_audience_cache():
+    """Descarta todos los conteos guardados (cambiaron contactos o etiquetas)"""
+    if CacheVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            CacheVersion.objects.create(name=VERSION_NAME, version=2)
+    except IntegrityError:
+        # Otro proceso la creó a la vez
+        CacheVersion.objects.filter(name=VERSION_NAME).update(version=F('version') + 1)
+
+
+def estimate_audience(segment, exact=True):
+    """
+    Contactos de un segmento.
+
+    Args:
+        segment: Segment (guardado o no)
+        exact: False = en PostgreSQL usar la estimación del planificador
+               (instantánea, sin desglose por grupo). En otros motores se
+               cuenta siempre.
+
+    Returns:
+        dict {'total', 'by_group', 'exact', 'cached'}
+    """
+    exact = exact or connection.vendor != 'postgresql'
+    key = _cache_key(segment, exact)
+    data = cache.get(key)
+    if data is not None:
+        return {**data, 'cached': True}
+
+    if exact:
+        rows = segment.queryset().order_by().values('group').annotate(total=Count('pk'))
+        by_group = {row['group']: row['total'] for row in rows}
+        data = {'total': sum(by_group.values()), 'by_group': by_group, 'exact': True}
+    else:
+        data = {'total': _planner_rows(segment.queryset()), 'by_group': {}, 'exact': False}
+
+    cache.set(key, data, AUDIENCE_CACHE_SECONDS)
+    return {**data, 'cached': False}
+
+
+def _cache_key(segment, exact):
+    definition = json.dumps([
+        segment.filter_type, sorted(segment.groups), sorted(segment.tags), sorted(segment.contacts), exact,
+    ])
+    version = CacheVersion.objects.filter(name=VERSION_NAME).values_list('version', flat=True).first() or 1
+    return f'audience:{version}:{hashlib.sha1(definition.encode()).hexdigest()}'
+
+
+def _planner_rows(queryset):
+    """Filas estimadas por el planificador de PostgreSQL (EXPLAIN, no ejecuta la consulta)"""
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,199 @@
+"""
+Reclamo de mensajes pendientes para workers concurrentes.
+
+Cada worker "reclama" un lote de OutgoingMessage pasándolos de 'pending'
+a 'sending' y marcándolos con su identificador. Así varios procesos
+(en uno o varios servidores) pueden trabajar sobre la misma cola sin
+enviar dos veces el mismo mensaje.
+
+- PostgreSQL / MySQL 8: SELECT ... FOR UPDATE SKIP LOCKED. Cada worker
+  bloquea filas distintas sin esperar a los demás.
+- SQLite: un solo UPDATE ... WHERE id IN (SELECT ... LIMIT n) AND
+  status='pending'. Un SELECT seguido de UPDATE en la misma transacción
+  falla con "database is locked" en cuanto otro proceso escribe (SQLite no
+  puede subir el bloqueo de lectura a escritura y no espera el timeout);
+  una sola sentencia de escritura sí espera su turno.
+- Otros motores sin SKIP LOCKED: UPDATE condicional (status='pending') como
+  lease optimista. Si dos workers eligen la misma fila, solo uno logra
+  cambiar su estado; el otro simplemente la pierde.
+
+Cada reclamo es un lease con vencimiento (`lease_expires_at`). El worker lo
+renueva con un heartbeat mientras vive; si muere a mitad de un envío, el
+reaper devuelve sus mensajes a 'pending' (o a 'dead' si ya agotaron los
+intentos) cuando el lease vence, en lugar de dejarlos en 'sending' para
+siempre.
+"""
+import os
+import socket
+from collections import Counter
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce, Mod
+from django.utils import timezone
+
+from .models import Campaign, OutgoingMessage
+
+# Orden de envío: por orden de encolado, con cada mensaje multi-línea seguido
+# de sus líneas (el padre se crea antes que sus hijos, así que su id es menor)
+SEND_ORDER = (Coalesce('parent_message_id', 'id').asc(), 'line_number', 'id')
+
+# Duración del lease de un reclamo (el heartbeat lo renueva cada LEASE_SECONDS / 3)
+LEASE_SECONDS = int(os.getenv('WORKER_LEASE_SECONDS', '120'))
+
+
+def make_worker_id():
+    """Identificador único del proceso worker (host:pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+
+def parse_shard(value):
+    """
+    Convierte '2/4' en (2, 4). Devuelve None si no hay shard.
+
+    Raises:
+        ValueError: si el formato no es 'indice/total' con 0 <= indice < total
+    """
+    if not value:
+        return None
+    try:
+        index, total = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Shard inválido '{value}'. Formato esperado: indice/total (ej: 0/4)")
+    if total < 1 or not 0 <= index < total:
+        raise ValueError(f"Shard inválido '{value}': el índice debe estar entre 0 y {total - 1}")
+    return index, total
+
+
+def pending_queryset(campaign, shard=None, now=None):
+    """
+    Mensajes pendientes de una campaña listos para enviar (sin reintento
+    programado o con la hora de reintento ya cumplida), en orden de envío y
+    filtrados por shard.
+    """
+    now = now or timezone.now()
+    qs = OutgoingMessage.objects.filter(campaign=campaign, status='pending').filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    )
+    if shard:
+        # Se reparte por contacto para que las líneas de un mismo contacto
+        # (modo multi-línea) queden siempre en el mismo shard y en orden.
+        index, total = shard
+        qs = qs.annotate(shard_key=Mod('contact_id', total)).filter(shard_key=index)
+    return qs.order_by(*SEND_ORDER)
+
+
+def claim_messages(campaign, limit, worker_id, shard=None, lease_seconds=LEASE_SECONDS):
+    """
+    Reclama hasta `limit` mensajes pendientes de la campaña para este worker.
+
+    Returns:
+        Lista de OutgoingMessage ya marcados como 'sending' (con contact cargado)
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    claim_values = {
+        'status': 'sending',
+        'claimed_by': worker_id,
+        'claimed_at': now,
+        'lease_expires_at': now + timedelta(seconds=lease_seconds),
+        'attempts': F('attempts') + 1,
+    }
+
+    if connection.vendor == 'sqlite':
+        candidates = pending_queryset(campaign, shard, now).values('id')[:limit]
+        if not OutgoingMessage.objects.filter(id__in=candidates, status='pending').update(**claim_values):
+            return []
+        return list(
+            OutgoingMessage.objects.filter(campaign=campaign, claimed_by=worker_id, status='sending', claimed_at=now)
+            .select_related('contact')
+            .order_by(*SEND_ORDER)
+        )
+
+    with transaction.atomic():
+        candidates = pending_queryset(campaign, shard, now)
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True, of=('self',))
+        ids = list(candidates.values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+
+        # El filtro status='pending' hace de lease en motores sin SKIP LOCKED:
+        # solo el primer UPDATE sobre cada fila la cambia.
+        OutgoingMessage.objects.filter(id__in=ids, status='pending').update(**claim_values)
+
+    return list(
+        OutgoingMessage.objects.filter(id__in=ids, claimed_by=worker_id, status='sending', claimed_at=now)
+        .select_related('contact')
+        .order_by(*SEND_ORDER)
+    )
+
+
+def release_messages(worker_id, ids):
+    """Devuelve a 'pending' mensajes reclamados que este worker no llegó a enviar"""
+    if not ids:
+        return 0
+    return OutgoingMessage.objects.filter(id__in=ids, claimed_by=worker_id, status='sending').update(
+        status='pending',
+        claimed_by='',
+        claimed_at=None,
+        lease_expires_at=None,
+        attempts=F('attempts') - 1,
+    )
+
+
+def renew_leases(worker_id, lease_seconds=LEASE_SECONDS):
+    """Heartbeat: extiende el lease de todo lo que este worker tiene en 'sending'"""
+    return OutgoingMessage.objects.filter(claimed_by=worker_id, status='sending').update(
+        lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds)
+    )
+
+
+def reap_expired_leases(now=None, lease_seconds=LEASE_SECONDS):
+    """
+    Recupera mensajes 'sending' cuyo worker dejó de renovar el lease.
+
+    Los que aún tienen intentos vuelven a 'pending' (el próximo envío lleva
+    la misma clave de idempotencia, así que si el anterior sí llegó a salir
+    el servicio no lo repite). Los que agotaron `max_attempts` pasan a 'dead'.
+    También recoge filas 'sending' sin lease de versiones anteriores del worker.
+
+    Returns:
+        (reencolados, muertos)
+    """
+    now = now or timezone.now()
+    expired = Q(lease_expires_at__lt=now) | Q(
+        lease_expires_at__isnull=True,
+        claimed_at__lt=now - timedelta(seconds=lease_seconds),
+    ) | Q(lease_expires_at__isnull=True, claimed_at__isnull=True)
+
+    with transaction.atomic():
+        candidates = OutgoingMessage.objects.filter(expired, status='sending')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True, of=('self',))
+        rows = list(candidates.values_list('id', 'campaign_id', 'attempts', 'campaign__max_attempts'))
+        if not rows:
+            return 0, 0
+
+        dead_ids = [pk for pk, _, attempts, max_attempts in rows if attempts >= max_attempts]
+        retry_ids = [pk for pk, _, attempts, max_attempts in rows if attempts < max_attempts]
+        lost = Counter(campaign_id for pk, campaign_id, attempts, max_attempts in rows if attempts >= max_attempts)
+
+        released = {
+            'claimed_by': '',
+            'claimed_at': None,
+            'lease_expires_at': None,
+        }
+        requeued = OutgoingMessage.objects.filter(id__in=retry_ids, status='sending').update(
+            status='pending', **released
+        )
+        dead = OutgoingMessage.objects.filter(id__in=dead_ids, status='sending').update(
+            status='dead', last_error='Lease vencido: el worker dejó de responder', **released
+        )
+        for campaign_id, amount in lost.items():
+            Campaign.objects.filter(pk=campaign_id).update(failed_count=F('failed_count') + amount)
+
+    return requeued, dead
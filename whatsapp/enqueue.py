@@ -0,0 +1,387 @@
+"""
+Encolado de mensajes de campañas.
+
+Todas las vistas (y la API) que crean OutgoingMessage para una audiencia
+pasan por enqueue_campaign(): recorre los contactos en streaming con
+.iterator(), renderiza la plantilla por bloques y escribe cada bloque con
+bulk_create en una transacción. 100k contactos son ~100 INSERT de 1000
+filas en lugar de 100k INSERT sueltos.
+
+Con renderizado diferido (por defecto al usar la plantilla de la campaña
+en modo 'single') los mensajes se guardan sin texto y el worker lo genera
+justo antes de enviar (OutgoingMessage.render_payload). El INSERT es
+mucho más estrecho y la tabla no guarda 100k copias del mismo texto.
+Los envíos rápidos (sin plantilla) y el modo multi-línea siguen guardando
+el texto renderizado.
+
+Si todas las filas son iguales salvo el contacto (modo 'single' con
+renderizado diferido o con un texto sin variables) no hace falta pasar
+por Python: se emite un único INSERT INTO ... SELECT sobre la consulta de
+la audiencia, compilada a SQL por el ORM.
+
+OutgoingMessage es único por (campaña, contacto, línea): los contactos que
+ya tienen mensaje en la campaña se saltan (ON CONFLICT DO NOTHING / INSERT
+OR IGNORE / ignore_conflicts), así volver a encolar una campaña (doble
+clic, reintento de la API) solo escribe las filas nuevas.
+"""
+import logging
+import os
+import time
+from bisect import bisect_right
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from .models import OutgoingMessage
+from .utils import compile_template, template_constants
+
+logger = logging.getLogger(__name__)
+
+# Contactos por bloque (lectura, renderizado y bulk_create)
+ENQUEUE_CHUNK_SIZE = 1000
+# Contactos por bloque con INSERT ... SELECT (no pasan por Python)
+SET_CHUNK_SIZE = 50000
+# Filas por INSERT de mensajes hijo en modo multi-línea (bajo el límite de
+# 65535 parámetros por consulta de PostgreSQL)
+MULTILINE_INSERT_ROWS = 4000
+# Renderizado diferido al enviar cuando el texto sale de la plantilla de la campaña
+LAZY_RENDER = os.getenv('ENQUEUE_LAZY_RENDER', 'true').lower() == 'true'
+
+
+class EnqueueResult:
+    """Resumen de un encolado"""
+
+    def __init__(self, contacts=0, messages=0, seconds=0.0):
+        self.contacts = contacts
+        self.messages = messages
+        self.seconds = seconds
+
+    @property
+    def rate(self):
+        """Mensajes encolados por segundo"""
+        return self.messages / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'contacts': self.contacts,
+            'messages': self.messages,
+            'seconds': round(self.seconds, 3),
+            'rate': round(self.rate, 1),
+        }
+
+
+def enqueue_campaign(campaign, contacts, text=None, send_mode='single', attachment=None,
+                     lazy=None, chunk_size=None, after_id=0, result=None, on_chunk=None,
+                     contact_ids=None):
+    """
+    Crea los OutgoingMessage pendientes de `campaign` para `contacts`.
+
+    Args:
+        campaign: Campaign destino
+        contacts: QuerySet de Contact (audiencia ya filtrada)
+        text: Texto a renderizar (por defecto el de la plantilla de la campaña)
+        send_mode: 'single' o 'multiline' (mensaje completo + un mensaje por línea)
+        attachment: dict {'path', 'type'} del adjunto o None
+        lazy: Guardar los mensajes sin texto para renderizarlos al enviar. Por
+              defecto sí (LAZY_RENDER) cuando el texto es el de la plantilla de
+              la campaña y el modo es 'single'
+        chunk_size: Contactos por bloque (por defecto ENQUEUE_CHUNK_SIZE, o
+                    SET_CHUNK_SIZE si se usa INSERT ... SELECT)
+        after_id: Encolar solo contactos con id mayor (para reanudar)
+        result: EnqueueResult de lo encolado antes de reanudar (se sigue sumando)
+        on_chunk: función(result, last_contact_id) que se llama dentro de la
+                  transacción de cada bloque, p. ej. para guardar el progreso
+        contact_ids: Ids (ascendentes) de una audiencia congelada
+                     (AudienceSnapshot). Se encolan los de `contacts` que estén
+                     en la lista, por bloques de ids en lugar de rangos
+
+    Es idempotente: los contactos que ya tienen mensaje en la campaña cuentan
+    en result.contacts pero no se vuelven a crear (result.messages solo suma
+    los mensajes nuevos).
+
+    Los contactos se recorren por id. Cada bloque se escribe en su propia
+    transacción junto con campaign.total_contacts (contactos encolados hasta
+    ese momento), así un encolado interrumpido puede seguir desde el último
+    bloque confirmado.
+
+    Returns:
+        EnqueueResult
+    """
+    started = time.monotonic()
+    if text is None:
+        text = campaign.template.content
+    if lazy is None:
+        lazy = (LAZY_RENDER and send_mode != 'multiline'
+                and campaign.template_id is not None and text == campaign.template.content)
+    template = None if lazy else compile_template(text)
+    result = result or EnqueueResult()
+
+    if send_mode != 'multiline' and (lazy or not template.names):
+        # Mismas columnas para todos los contactos: INSERT ... SELECT por bloques de ids
+        chunk_size = chunk_size or SET_CHUNK_SIZE
+        payload = '' if lazy else text
+        if contact_ids is not None:
+            blocks = _snapshot_blocks(contacts, contact_ids, chunk_size, after_id)
+        else:
+            blocks = _range_blocks(contacts, chunk_size, after_id)
+        for block, high, count in blocks:
+            with transaction.atomic():
+                created = _insert_select(campaign, block, payload, attachment)
+                result.contacts += block.count() if count is None else count
+                result.messages += created
+                _chunk_done(campaign, result, high, on_chunk)
+    else:
+        chunk_size = chunk_size or ENQUEUE_CHUNK_SIZE
+        fields = ('id',) if lazy else ('id', 'name', 'phone', 'group', 'email')
+        if contact_ids is not None:
+            chunks = (
+                (list(block.only(*fields).order_by('pk')), high)
+                for block, high, _ in _snapshot_blocks(contacts, contact_ids, chunk_size, after_id)
+            )
+        else:
+            stream = contacts.filter(pk__gt=after_id).only(*fields).order_by('pk').iterator(chunk_size=chunk_size)
+            chunks = ((chunk, chunk[-1].pk) for chunk in iter(lambda: list(islice(stream, chunk_size)), []))
+        for chunk, high in chunks:
+            with transaction.atomic():
+                if send_mode == 'multiline':
+                    created = _create_multiline(campaign, chunk, template, attachment, chunk_size)
+                else:
+                    created = _create_single(campaign, chunk, template, attachment, chunk_size)
+                result.contacts += len(chunk)
+                result.messages += created
+                _chunk_done(campaign, result, high, on_chunk)
+
+    if campaign.total_contacts != result.contacts:
+        campaign.total_contacts = result.contacts
+        campaign.save(update_fields=['total_contacts'])
+    return _finish(campaign, result, started)
+
+
+def _range_blocks(contacts, chunk_size, after_id):
+    """(queryset, último id, contactos) de bloques consecutivos por rango de id"""
+    last_id = after_id
+    while True:
+        remaining = contacts.filter(pk__gt=last_id)
+        boundary = list(remaining.order_by('pk').values_list('pk', flat=True)[chunk_size - 1:chunk_size])
+        if boundary:
+            high, count = boundary[0], chunk_size
+        else:
+            tail = remaining.aggregate(last=Max('pk'), count=Count('pk'))
+            high, count = tail['last'], tail['count']
+        if high is None:
+            return
+        yield remaining.filter(pk__lte=high), high, count
+        if not boundary:
+            return
+        last_id = high
+
+
+def _snapshot_blocks(contacts, contact_ids, chunk_size, after_id):
+    """
+    (queryset, último id, None) de bloques de una lista de ids congelada.
+
+    El número de contactos no se conoce de antemano (puede haber bajas de
+    opt-in desde que se congeló la audiencia).
+    """
+    # Los ids van como parámetros: respetar el límite del motor (999 en SQLite)
+    max_params = connection.features.max_query_params
+    if max_params:
+        chunk_size = min(chunk_size, max_params - 100)
+    ids = contact_ids[bisect_right(contact_ids, after_id):]
+    for start in range(0, len(ids), chunk_size):
+        block = ids[start:start + chunk_size]
+        yield contacts.filter(pk__in=block), block[-1], None
+
+
+def _chunk_done(campaign, result, last_contact_id, on_chunk):
+    campaign.total_contacts = result.contacts
+    campaign.save(update_fields=['total_contacts'])
+    if on_chunk:
+        on_chunk(result, last_contact_id)
+
+
+def _finish(campaign, result, started):
+    result.seconds = time.monotonic() - started
+    logger.info(
+        'Campaña %s: %s mensajes encolados para %s contactos en %.2fs (%.0f msg/s)',
+        campaign.pk, result.messages, result.contacts, result.seconds, result.rate,
+    )
+    return result
+
+
+def _insert_select(campaign, contacts, payload, attachment):
+    """
+    Un mensaje por contacto de `contacts` con un solo INSERT ... SELECT.
+
+    Las columnas constantes van como parámetros; las que no se indican toman
+    su default de Django (o NULL), igual que con bulk_create. Los contactos
+    que ya tienen mensaje en la campaña se ignoran (restricción única).
+
+    Returns:
+        Número de filas insertadas (sin contar las ignoradas)
+    """
+    values = {
+        'campaign': campaign.pk,
+        'payload': payload,
+        'status': 'pending',
+        'line_number': 0,
+        'created_at': timezone.now(),
+        'attachment_path': attachment['path'] if attachment else None,
+        'attachment_type': attachment['type'] if attachment else None,
+    }
+    quote = connection.ops.quote_name
+    columns, selects, params = [quote('contact_id')], ['audience.id'], []
+    for field in OutgoingMessage._meta.concrete_fields:
+        if field.primary_key or field.name == 'contact':
+            continue
+        if field.name in values:
+            value = values[field.name]
+        elif field.has_default() or not field.null:
+            value = field.get_default()
+        else:
+            continue
+        columns.append(quote(field.column))
+        selects.append('%s')
+        params.append(field.get_db_prep_save(value, connection))
+
+    audience_sql, audience_params = contacts.order_by().values('pk').query.sql_with_params()
+    # INSERT OR IGNORE (SQLite), INSERT IGNORE (MySQL) o sufijo ON CONFLICT DO NOTHING (PostgreSQL)
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    on_conflict = connection.ops.on_conflict_suffix_sql(
+        OutgoingMessage._meta.concrete_fields, OnConflict.IGNORE, None, None,
+    )
+    sql = (
+        f'{insert} {quote(OutgoingMessage._meta.db_table)} ({", ".join(columns)}) '
+        f'SELECT {", ".join(selects)} FROM ({audience_sql}) audience ORDER BY audience.id {on_conflict}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + list(audience_params))
+        return cursor.rowcount
+
+
+def _existing_contacts(campaign, contacts):
+    """Ids de los contactos del bloque que ya tienen mensaje principal en la campaña"""
+    return set(
+        OutgoingMessage.objects.filter(
+            campaign=campaign, line_number=0, contact_id__in=[contact.pk for contact in contacts],
+        ).values_list('contact_id', flat=True)
+    )
+
+
+def _create_single(campaign, contacts, template, attachment, batch_size):
+    """Un mensaje por contacto (template=None: sin texto, renderizado diferido)"""
+    existing = _existing_contacts(campaign, contacts)
+    contacts = [contact for contact in contacts if contact.pk not in existing]
+    constants = template_constants()
+    messages = [
+        OutgoingMessage(
+            campaign=campaign,
+            contact=contact,
+            payload=template.render(contact.template_variables(), constants) if template else '',
+            status='pending',
+            line_number=0,
+            attachment_path=attachment['path'] if attachment else None,
+            attachment_type=attachment['type'] if attachment else None,
+        )
+        for contact in contacts
+    ]
+    # ignore_conflicts cubre a otro proceso encolando la misma campaña a la vez
+    OutgoingMessage.objects.bulk_create(messages, batch_size=batch_size, ignore_conflicts=True)
+    return len(messages)
+
+
+def _create_multiline(campaign, contacts, template, attachment, batch_size):
+    """Mensaje padre (texto completo, line_number=0) y un mensaje hijo por cada línea"""
+    existing = _existing_contacts(campaign, contacts)
+    contacts = [contact for contact in contacts if contact.pk not in existing]
+    if not contacts:
+        return 0
+    constants = template_constants()
+    rendered = {contact.pk: template.render(contact.template_variables(), constants) for contact in contacts}
+    parents = [
+        OutgoingMessage(
+            campaign=campaign,
+            contact=contact,
+            payload=rendered[contact.pk],  # Mensaje completo
+            status='pending',
+            line_number=0,
+            attachment_path=attachment['path'] if attachment else None,
+            attachment_type=attachment['type'] if attachment else None,
+        )
+        for contact in contacts
+    ]
+    parent_ids = _insert_parents(campaign, parents, batch_size)
+
+    children = []
+    for contact in contacts:
+        lines = [line.strip() for line in rendered[contact.pk].split('\n') if line.strip()]
+        for i, line in enumerate(lines, start=1):
+            children.append(OutgoingMessage(
+                campaign=campaign,
+                contact=contact,
+                payload=line,
+                status='pending',
+                line_number=i,
+                parent_message_id=parent_ids[contact.pk],
+                attachment_path=attachment['path'] if attachment and i == 1 else None,
+                attachment_type=attachment['type'] if attachment and i == 1 else None,
+            ))
+    OutgoingMessage.objects.bulk_create(children, batch_size=MULTILINE_INSERT_ROWS, ignore_conflicts=True)
+    return len(parents) + len(children)
+
+
+def _insert_parents(campaign, parents, batch_size):
+    """
+    Inserta los mensajes padre y devuelve contact_id -> id.
+
+    Con RETURNING (PostgreSQL, SQLite >= 3.35) cada INSERT ... ON CONFLICT DO
+    NOTHING devuelve los ids de las filas creadas en el mismo viaje. Los
+    contactos que otro proceso encoló a la vez (o todos, en motores sin
+    RETURNING como MySQL) se buscan por clave natural.
+    """
+    if not connection.features.can_return_rows_from_bulk_insert:
+        OutgoingMessage.objects.bulk_create(parents, batch_size=batch_size, ignore_conflicts=True)
+        return _parent_ids(campaign, parents)
+
+    fields = [field for field in OutgoingMessage._meta.concrete_fields if not field.primary_key]
+    quote = connection.ops.quote_name
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    on_conflict = connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)
+    row = f'({", ".join(["%s"] * len(fields))})'
+    # Respeta el límite de parámetros por consulta del motor (999 en SQLite)
+    rows_per_insert = min(batch_size, connection.ops.bulk_batch_size(fields, parents))
+
+    parent_ids = {}
+    with connection.cursor() as cursor:
+        for start in range(0, len(parents), rows_per_insert):
+            batch = parents[start:start + rows_per_insert]
+            params = [
+                field.get_db_prep_save(field.pre_save(parent, True), connection)
+                for parent in batch for field in fields
+            ]
+            cursor.execute(
+                f'{insert} {quote(OutgoingMessage._meta.db_table)} '
+                f'({", ".join(quote(field.column) for field in fields)}) '
+                f'VALUES {", ".join([row] * len(batch))} {on_conflict} '
+                f'RETURNING {quote("contact_id")}, {quote("id")}',
+                params,
+            )
+            parent_ids.update(cursor.fetchall())
+
+    taken = [parent for parent in parents if parent.contact_id not in parent_ids]
+    if taken:
+        parent_ids.update(_parent_ids(campaign, taken))
+    return parent_ids
+
+
+def _parent_ids(campaign, parents):
+    """contact_id -> id del mensaje padre, por clave natural (única por la restricción)"""
+    return dict(
+        OutgoingMessage.objects.filter(
+            campaign=campaign, line_number=0, parent_message__isnull=True,
+            contact_id__in=[parent.contact_id for parent in parents],
+        ).order_by('id').values_list('contact_id', 'id')
+    )
@@ -0,0 +1,488 @@
+"""
+Importación de contactos desde CSV/XLSX.
+
+Todas las entradas (mapeo de columnas, importación directa y el comando
+import_contacts) pasan por import_contacts(): el archivo se lee por
+bloques de IMPORT_CHUNK_SIZE filas y cada bloque se escribe con una
+consulta para buscar los teléfonos que ya existen y un bulk_create /
+bulk_update (o un único INSERT ... ON CONFLICT DO UPDATE donde el motor lo
+soporta) en lugar de un update_or_create por fila. Los teléfonos de cada
+bloque se normalizan de una vez (utils.limpiar_telefonos).
+
+Los archivos se leen fila por fila (módulo csv, y openpyxl en modo
+read_only para XLSX) sin pasar por pandas, así la memoria depende del tamaño
+del bloque y no del archivo. Cada celda se convierte a texto por sí sola,
+sin mirar el resto de la columna ni del bloque, así un mismo teléfono da
+siempre el mismo contacto (_phone_text).
+
+Las escrituras masivas no envían señales: al terminar se invalida la caché
+de tamaños de audiencia (audience.invalidate_audience_cache).
+"""
+import csv
+import io
+import logging
+import os
+import re
+import time
+from itertools import islice
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .audience import invalidate_audience_cache
+from .models import Contact
+from .utils import limpiar_telefonos
+
+logger = logging.getLogger(__name__)
+
+# Filas del archivo por bloque (lectura, búsqueda de teléfonos y escritura)
+IMPORT_CHUNK_SIZE = 2000
+# Detalles de errores que se guardan en ImportResult (el contador sigue sumando)
+MAX_ERROR_DETAILS = 50
+
+NAME_KEYWORDS = ['name', 'nombre', 'contacto', 'persona']
+PHONE_KEYWORDS = ['phone', 'telefono', 'tel', 'cel', 'whatsapp', 'móvil', 'movil', 'celular', 'número', 'numero']
+EMAIL_KEYWORDS = ['email', 'correo', 'mail', 'e-mail']
+GROUP_KEYWORDS = ['group', 'grupo', 'categoria', 'categoría', 'tipo']
+
+# Textos que pandas lee como vacíos (na_values por defecto de read_csv)
+NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+# Caracteres que quita limpiar_telefono
+_PHONE_SEPARATORS_RE = re.compile(r'[\s\(\)\-]')
+
+
+class ColumnMapping:
+    """
+    Columnas del archivo que corresponden a cada campo de Contact.
+
+    Args:
+        name, phone: Columnas obligatorias
+        email, group: Columnas opcionales (None = '' y 'General')
+        extra: Columnas que se guardan en notes como "columna: valor"
+        require_name: Rechazar filas sin nombre
+        fields: Campos de Contact que escribe la importación (los demás no
+                se tocan en los contactos existentes)
+    """
+
+    def __init__(self, name, phone, email=None, group=None, extra=(), require_name=True,
+                 fields=('name', 'email', 'group', 'opt_in', 'notes')):
+        self.name = name
+        self.phone = phone
+        self.email = email
+        self.group = group
+        self.extra = [column for column in extra if column]
+        self.require_name = require_name
+        self.fields = list(fields)
+
+    def as_dict(self):
+        """Para guardarlo en ImportJob.mapping (JSON)"""
+        return {
+            'name': self.name, 'phone': self.phone, 'email': self.email, 'group': self.group,
+            'extra': self.extra, 'require_name': self.require_name, 'fields': self.fields,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class ImportResult:
+    """Resumen de una importación"""
+
+    def __init__(self, rows=0, created=0, updated=0, errors=0, seconds=0.0):
+        self.rows = rows
+        self.created = created
+        self.updated = updated
+        self.errors = errors
+        self.error_details = []
+        self.chunk_errors = []  # (fila, detalle) del bloque en curso
+        self.seconds = seconds
+
+    @property
+    def rate(self):
+        """Filas procesadas por segundo"""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def add_error(self, row_number, detail):
+        self.errors += 1
+        self.chunk_errors.append((row_number, detail))
+        if len(self.error_details) < MAX_ERROR_DETAILS:
+            self.error_details.append(f'Fila {row_number}: {detail}')
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 3),
+            'rate': round(self.rate, 1),
+        }
+
+
+def detect_columns(columns, fields=('name', 'email', 'group', 'opt_in')):
+    """
+    ColumnMapping a partir de los encabezados del archivo.
+
+    Busca nombre, teléfono, email y grupo por palabras clave; si no encuentra
+    nombre o teléfono usa la primera y la segunda columna. Devuelve None si
+    el archivo tiene menos de 2 columnas y no se reconoce el teléfono.
+    """
+    columns = list(columns)
+
+    def find(keywords):
+        return next((c for c in columns if any(x in str(c).lower() for x in keywords)), None)
+
+    name = find(NAME_KEYWORDS)
+    if name is None and columns:
+        name = columns[0]
+    phone = find(PHONE_KEYWORDS)
+    if phone is None:
+        if len(columns) < 2:
+            return None
+        phone = columns[1]
+    return ColumnMapping(name, phone, email=find(EMAIL_KEYWORDS), group=find(GROUP_KEYWORDS),
+                         require_name=False, fields=fields)
+
+
+def read_rows(source, filename):
+    """
+    (encabezados, iterador de filas) del archivo, leyendo una fila a la vez.
+
+    Los encabezados se nombran como en pandas (vacíos 'Unnamed: 2',
+    repetidos 'col.1'). Cada fila es una tupla de celdas: texto en CSV, el
+    valor de la celda en XLSX; puede tener menos celdas que encabezados.
+    Las líneas en blanco de un CSV se saltan; en XLSX solo las filas vacías
+    del final (las de en medio cuentan, así la fila coincide con Excel).
+    """
+    rows = _csv_rows(source) if filename.endswith('.csv') else _xlsx_rows(source)
+    header = next(rows, None)
+    if header is None:
+        return [], rows
+    return _header_names(header), rows
+
+
+def read_columns(source, filename):
+    """Encabezados del archivo (sin leer las filas)"""
+    columns, rows = read_rows(source, filename)
+    rows.close()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return columns
+
+
+def read_preview(source, filename, rows=5):
+    """(encabezados, primeras `rows` filas como dicts) sin leer el resto del archivo"""
+    columns, reader = read_rows(source, filename)
+    try:
+        preview = [
+            {column: _cell(row, i) for i, column in enumerate(columns)}
+            for row in islice(reader, rows)
+        ]
+    finally:
+        reader.close()
+    return columns, preview
+
+
+def _csv_rows(source):
+    """Filas de un CSV (ruta o archivo abierto en binario), encabezados incluidos"""
+    if isinstance(source, (str, os.PathLike)):
+        f = open(source, newline='', encoding='utf-8-sig')
+    else:
+        f = io.TextIOWrapper(source, newline='', encoding='utf-8-sig')
+    try:
+        for row in csv.reader(f):
+            if row:
+                yield row
+    finally:
+        if isinstance(f, io.TextIOWrapper) and f.buffer is source:
+            # No cerrar el archivo del llamador
+            f.detach()
+        else:
+            f.close()
+
+
+def _xlsx_rows(source):
+    """Filas de la hoja activa de un XLSX (openpyxl read_only), encabezados incluidos"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        blank = 0
+        for row in workbook.active.iter_rows(values_only=True):
+            if all(value is None or value == '' for value in row):
+                # Solo se devuelven si después hay una fila con datos
+                blank += 1
+                continue
+            for _ in range(blank):
+                yield ()
+            blank = 0
+            yield row
+    finally:
+        workbook.close()
+
+
+def _header_names(header):
+    names = []
+    counts = {}
+    for i, value in enumerate(header):
+        if value is None or value == '':
+            name = f'Unnamed: {i}'
+        elif isinstance(value, float) and value.is_integer():
+            name = str(int(value))
+        else:
+            name = str(value)
+        # Repetidos como pandas: 'a', 'a.1', 'a.2'
+        count = counts.get(name, 0)
+        while count:
+            counts[name] = count + 1
+            name = f'{name}.{count}'
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        names.append(name)
+    return names
+
+
+def _cell(row, i):
+    return row[i] if i < len(row) else None
+
+
+def count_rows(path, filename):
+    """
+    Filas de datos del archivo (sin contar encabezados), sin interpretarlas.
+
+    CSV: saltos de línea (un campo entre comillas con saltos de línea cuenta
+    de más). XLSX: dimensiones guardadas en la hoja (None si no las tiene).
+    """
+    if filename.endswith('.csv'):
+        lines = 0
+        last = b'\n'
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            lines += 1
+        return max(lines - 1, 0)
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+    finally:
+        workbook.close()
+    return max(max_row - 1, 0) if max_row else None
+
+
+def import_contacts(source, filename, mapping, chunk_size=None, result=None, skip_rows=0, on_chunk=None):
+    """
+    Crea o actualiza (por teléfono) los contactos de un archivo CSV/XLSX.
+
+    Args:
+        source: Ruta o archivo abierto
+        filename: Nombre del archivo (la extensión decide el formato)
+        mapping: ColumnMapping
+        chunk_size: Filas por bloque (por defecto IMPORT_CHUNK_SIZE)
+        result: ImportResult al que seguir sumando
+        skip_rows: Filas de datos ya importadas (para reanudar)
+        on_chunk: función(result, filas_hechas) que se llama dentro de la
+                  transacción de cada bloque, p. ej. para guardar el progreso.
+                  result.chunk_errors tiene los errores de ese bloque
+
+    Cada bloque se escribe en su propia transacción. Un teléfono repetido en
+    el archivo se comporta como con update_or_create: la primera fila lo
+    crea y las siguientes lo actualizan.
+
+    Returns:
+        ImportResult
+    """
+    started = time.monotonic()
+    result = result or ImportResult()
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    columns, rows = read_rows(source, filename)
+    try:
+        # Las filas ya importadas se leen y se descartan
+        rows_left = islice(rows, skip_rows, None)
+        offset = skip_rows
+        while True:
+            chunk = list(islice(rows_left, chunk_size))
+            if not chunk:
+                break
+            import_chunk(columns, chunk, mapping, result, offset, on_chunk)
+            offset += len(chunk)
+    finally:
+        rows.close()
+    result.seconds += time.monotonic() - started
+    if result.created or result.updated:
+        invalidate_audience_cache()
+    logger.info('Importación de %s: %s', filename, result.as_dict())
+    return result
+
+
+def import_chunk(columns, chunk, mapping, result, offset=0, on_chunk=None):
+    """Escribe un bloque (filas de read_rows, con sus encabezados); suma en `result`"""
+    result.chunk_errors = []
+    # Solo las columnas del mapeo, como texto
+    index = {column: i for i, column in enumerate(columns)}
+    used = {mapping.name, mapping.phone, mapping.email, mapping.group, *mapping.extra}
+    values = {
+        column: [_cell_text(_cell(row, index[column])) for row in chunk]
+        for column in used if column in index
+    }
+    if values:
+        records = [dict(zip(values, cells)) for cells in zip(*values.values())]
+    else:
+        records = [{} for _ in chunk]
+
+    rows = {}
+    repeated = 0
+    # Teléfonos de todo el bloque de una vez (vectorizado)
+    if mapping.phone in values:
+        phones, invalid = limpiar_telefonos([_phone_text(text) for text in values[mapping.phone]])
+        phones = phones.where(~invalid, '').tolist()
+    else:
+        phones = [''] * len(chunk)
+    # Fila 1 del archivo = encabezados
+    for number, row, phone in zip(range(offset + 2, offset + 2 + len(records)), records, phones):
+        result.rows += 1
+        row_values = _row_values(row, phone, mapping, result, number)
+        if row_values is None:
+            continue
+        first = rows.get(row_values['phone'])
+        if first is not None:
+            # Como update_or_create: la primera fila crea el contacto y las
+            # siguientes solo cambian los campos que escribe la importación
+            repeated += 1
+            row_values = {**first, **{field: row_values[field] for field in mapping.fields}}
+        rows[row_values['phone']] = row_values
+
+    with transaction.atomic():
+        if rows:
+            created, updated = _write_contacts(rows, mapping.fields)
+            result.created += created
+            result.updated += updated + repeated
+        if on_chunk:
+            on_chunk(result, offset + len(chunk))
+
+
+def _row_values(row, phone, mapping, result, number):
+    """
+    Campos de Contact de una fila, o None (y un error en `result`) si no es válida.
+
+    `row` tiene el texto de cada columna y `phone` ya viene normalizado
+    ('' si no es válido).
+    """
+
+    def cell(column):
+        return row.get(column, '')
+
+    name = cell(mapping.name)
+    if mapping.require_name and not name:
+        result.add_error(number, 'nombre vacío')
+        return None
+
+    if not phone:
+        result.add_error(number, f"teléfono inválido '{cell(mapping.phone)}'")
+        return None
+
+    notes = []
+    for column in mapping.extra:
+        value = cell(column)
+        if value:
+            notes.append(f'{column}: {value}')
+
+    values = {
+        'phone': phone,
+        'name': name or phone,
+        'email': cell(mapping.email) if mapping.email else '',
+        'group': (cell(mapping.group) if mapping.group else '') or 'General',
+        'opt_in': True,
+        'notes': ' | '.join(notes),
+    }
+    # Un valor demasiado largo haría fallar el bloque entero en el INSERT
+    for field in ('phone', 'name', 'email', 'group'):
+        if len(values[field]) > Contact._meta.get_field(field).max_length:
+            result.add_error(number, f'{field} demasiado largo')
+            return None
+    return values
+
+
+def _phone_text(text):
+    """
+    Teléfono de una celda listo para limpiar_telefonos.
+
+    Un número escrito solo con dígitos (y separadores) pierde los ceros de
+    la izquierda, como cuando pandas leía la columna como números:
+    '0987654321' y '098-765-4321' quedan en '987654321' y se les agrega el
+    prefijo del país. La regla depende solo de la celda, no de las demás
+    filas del bloque.
+    """
+    digits = _PHONE_SEPARATORS_RE.sub('', text)
+    if digits.isascii() and digits.isdigit():
+        return digits.lstrip('0') or '0'
+    return text
+
+
+def _cell_text(value):
+    """
+    Texto de una celda.
+
+    Vacías (None y los textos de NA_VALUES) como ''. Los números de un XLSX
+    guardados como float se escriben sin decimales si son enteros.
+    """
+    if value is None or (isinstance(value, str) and value in NA_VALUES):
+        return ''
+    if isinstance(value, float):
+        if value != value:
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    value = str(value).strip()
+    return '' if value == 'nan' else value
+
+
+def _write_contacts(rows, fields):
+    """
+    Crea o actualiza los contactos de `rows` ({teléfono: campos}).
+
+    Returns:
+        (creados, actualizados)
+    """
+    existing = {}
+    max_params = connection.features.max_query_params
+    phones = list(rows)
+    step = max_params - 100 if max_params else len(phones)
+    for start in range(0, len(phones), step):
+        for contact in Contact.objects.filter(phone__in=phones[start:start + step]).only('id', 'phone', *fields):
+            existing[contact.phone] = contact
+
+    new = [Contact(**values) for phone, values in rows.items() if phone not in existing]
+    changed = []
+    for phone, contact in existing.items():
+        values = rows[phone]
+        if any(getattr(contact, field) != values[field] for field in fields):
+            for field in fields:
+                setattr(contact, field, values[field])
+            changed.append(contact)
+
+    if connection.features.supports_update_conflicts_with_target:
+        # Un solo INSERT ... ON CONFLICT (phone) DO UPDATE; además cubre
+        # teléfonos creados por otra importación desde la búsqueda anterior
+        upsert = new + [Contact(**rows[contact.phone]) for contact in changed]
+        if upsert:
+            Contact.objects.bulk_create(
+                upsert, batch_size=IMPORT_CHUNK_SIZE, update_conflicts=True,
+                unique_fields=['phone'], update_fields=fields + ['updated_at'],
+            )
+    else:
+        Contact.objects.bulk_create(new, batch_size=IMPORT_CHUNK_SIZE)
+        if changed:
+            # bulk_update no aplica auto_now
+            now = timezone.now()
+            for contact in changed:
+                contact.updated_at = now
+            Contact.objects.bulk_update(changed, fields + ['updated_at'], batch_size=500)
+    return len(new), len(existing)
@@ -0,0 +1,372 @@
+"""
+Encolado de campañas en segundo plano.
+
+Las vistas crean un EnqueueJob y responden al instante; el encolado
+(enqueue_campaign) se ejecuta en un pool de hilos del propio proceso web
+y guarda su progreso en la misma transacción que cada bloque de mensajes.
+
+Quien ejecuta un job tiene un lease (`lease_expires_at`) que un hilo
+aparte renueva mientras vive, por lento que sea cada bloque. Si el proceso
+web muere a mitad (timeout de gunicorn, reinicio...), el lease vence y
+run_worker lo reanuda desde el último contacto confirmado
+(`last_contact_id`). Con ENQUEUE_JOBS_IN_PROCESS=false los jobs
+los ejecuta solo run_worker.
+
+La audiencia se congela al lanzar (AudienceSnapshot): el job y sus
+reanudaciones recorren esa lista de ids, no vuelven a aplicar los filtros.
+
+Las importaciones de contactos (ImportJob) usan el mismo esquema: el
+archivo queda en IMPORT_STAGING_DIR, cada bloque de filas guarda en su
+transacción el número de filas confirmadas (`processed`) y una
+reanudación sigue desde ahí. Los errores por fila van a un CSV aparte
+(fila,error) en lugar de a la BD.
+"""
+import csv
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .claiming import make_worker_id
+from .enqueue import EnqueueResult, enqueue_campaign
+from .importer import ColumnMapping, ImportResult, count_rows, import_contacts
+from .models import AudienceSnapshot, Contact, EnqueueJob, ImportJob, Segment
+from .wakeup import notify_workers
+
+logger = logging.getLogger(__name__)
+
+RUN_IN_PROCESS = os.getenv('ENQUEUE_JOBS_IN_PROCESS', 'true').lower() == 'true'
+JOB_THREADS = int(os.getenv('ENQUEUE_JOB_THREADS', '2'))
+# Un job 'running' cuyo lease no se renovó en este tiempo se considera abandonado
+JOB_LEASE_SECONDS = 120
+
+_executor = None
+
+
+class LeaseLost(Exception):
+    """Otro proceso tomó el job (su lease venció): esta ejecución se abandona"""
+
+
+def job_audience(audience):
+    """
+    Contactos de EnqueueJob.audience: (queryset, ids congelados o None).
+
+    {'snapshot': id}                               -> AudienceSnapshot
+    {'filter': 'all'|'groups'|'custom', ...}       -> filtros (jobs anteriores a los snapshots)
+    """
+    audience = audience or {}
+    if audience.get('snapshot'):
+        snapshot = AudienceSnapshot.objects.get(pk=audience['snapshot'])
+        return Contact.objects.filter(opt_in=True), snapshot.contact_ids()
+    segment = Segment.from_filters(audience.get('filter', 'all'), audience.get('groups'),
+                                   contacts=audience.get('contacts'))
+    return segment.queryset(), None
+
+
+def start_enqueue_job(campaign, segment=None, text='', send_mode='single', attachment=None):
+    """
+    Congela la audiencia y lanza un job de encolado en segundo plano.
+
+    Args:
+        campaign: Campaign destino
+        segment: Segment a enviar; None = el de la campaña (o todos los opt-in)
+        text: Texto a enviar; vacío = plantilla de la campaña
+        send_mode: 'single' o 'multiline'
+        attachment: dict {'path', 'type'} o None
+
+    Returns:
+        EnqueueJob
+    """
+    snapshot = AudienceSnapshot.capture(campaign, segment or campaign.audience_segment())
+    job = EnqueueJob.objects.create(
+        campaign=campaign,
+        audience={'snapshot': snapshot.pk},
+        text=text or '',
+        send_mode=send_mode,
+        attachment_path=attachment['path'] if attachment else None,
+        attachment_type=attachment['type'] if attachment else None,
+        total=snapshot.contact_count,
+    )
+    if RUN_IN_PROCESS:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, claim_job, run_job, job.pk))
+    # Despierta también a run_worker, que puede tomar el job si este proceso no lo hace
+    notify_workers(campaign.pk)
+    return job
+
+
+def active_job(campaign):
+    """Job de encolado pendiente o en curso de la campaña (o None)"""
+    return campaign.enqueue_jobs.filter(status__in=['pending', 'running']).first()
+
+
+def claim_job(worker_id, job_id=None):
+    """
+    Reclama un job pendiente (o uno 'running' abandonado) para ejecutarlo.
+
+    Returns:
+        EnqueueJob marcado como 'running' o None
+    """
+    pk = _claim(EnqueueJob, worker_id, job_id)
+    return EnqueueJob.objects.select_related('campaign__template').get(pk=pk) if pk else None
+
+
+def _claim(model, worker_id, job_id=None):
+    """Id del job de `model` reclamado (pendiente o abandonado), o None"""
+    now = timezone.now()
+    expired = Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True)
+    claimable = Q(status='pending') | (Q(status='running') & expired)
+    candidates = model.objects.filter(claimable)
+    if job_id:
+        candidates = candidates.filter(pk=job_id)
+
+    for pk in candidates.order_by('pk').values_list('pk', flat=True)[:10]:
+        # UPDATE condicional: si otro proceso lo tomó antes, no cambia nada
+        claimed = model.objects.filter(claimable, pk=pk).update(
+            status='running',
+            claimed_by=worker_id,
+            lease_expires_at=_lease_expiry(),
+            started_at=now,
+            updated_at=now,
+            run_processed=F('processed'),
+        )
+        if claimed:
+            return pk
+    return None
+
+
+@contextmanager
+def _job_lease(model, job):
+    """
+    Renueva el lease de `job` cada JOB_LEASE_SECONDS/3 mientras dura el bloque
+    `with` (además de en cada bloque confirmado, ver on_chunk).
+    """
+    stop = threading.Event()
+
+    def heartbeat():
+        try:
+            while not stop.wait(JOB_LEASE_SECONDS / 3):
+                try:
+                    _owned(model, job).update(lease_expires_at=_lease_expiry())
+                except Exception:
+                    logger.exception('Error renovando el lease del job %s', job.pk)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=heartbeat, name=f'job-lease-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+def _owned(model, job):
+    """El job, solo si sigue en curso a nombre de quien lo reclamó"""
+    return model.objects.filter(pk=job.pk, status='running', claimed_by=job.claimed_by)
+
+
+def run_job(job):
+    """Ejecuta (o reanuda desde last_contact_id) un job ya reclamado"""
+    campaign = job.campaign
+    resumed = job.last_contact_id > 0
+    if resumed:
+        logger.info('Reanudando encolado %s de la campaña %s tras el contacto %s',
+                    job.pk, campaign.pk, job.last_contact_id)
+
+    first_chunk = [True]
+
+    def on_chunk(result, last_contact_id):
+        updated = _owned(EnqueueJob, job).update(
+            processed=result.contacts,
+            messages_created=result.messages,
+            last_contact_id=last_contact_id,
+            lease_expires_at=_lease_expiry(),
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            # Deshace el bloque: lo encola quien tiene ahora el job
+            raise LeaseLost()
+        if first_chunk[0]:
+            # El worker puede empezar a enviar sin esperar al resto
+            first_chunk[0] = False
+            notify_workers(campaign.pk)
+
+    try:
+        with _job_lease(EnqueueJob, job):
+            contacts, contact_ids = job_audience(job.audience)
+            result = enqueue_campaign(
+                campaign,
+                contacts,
+                contact_ids=contact_ids,
+                text=job.text or None,
+                send_mode=job.send_mode,
+                attachment={'path': job.attachment_path, 'type': job.attachment_type} if job.attachment_path else None,
+                after_id=job.last_contact_id,
+                result=EnqueueResult(job.processed, job.messages_created),
+                on_chunk=on_chunk,
+            )
+    except LeaseLost:
+        logger.warning('El encolado %s de la campaña %s lo continúa otro proceso', job.pk, campaign.pk)
+        return None
+    except Exception as e:
+        logger.exception('Error en el encolado %s de la campaña %s', job.pk, campaign.pk)
+        _owned(EnqueueJob, job).update(status='failed', error=str(e), updated_at=timezone.now())
+        return None
+
+    _owned(EnqueueJob, job).update(
+        status='done',
+        processed=result.contacts,
+        messages_created=result.messages,
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+    notify_workers(campaign.pk)
+    return result
+
+
+def start_import_job(path, filename, mapping):
+    """
+    Lanza la importación en segundo plano de un archivo ya guardado en staging.
+
+    Args:
+        path: Archivo (staging.staged_path); pasa a ser del job, que lo
+              borra al terminar
+        filename: Nombre original del archivo
+        mapping: importer.ColumnMapping
+
+    Returns:
+        ImportJob
+    """
+    job = ImportJob.objects.create(
+        filename=filename,
+        file_path=path,
+        mapping=mapping.as_dict(),
+        total=count_rows(path, filename) or 0,
+        error_file=os.path.splitext(path)[0] + '.errors.csv',
+    )
+    if RUN_IN_PROCESS:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, claim_import_job, run_import_job, job.pk))
+    notify_workers()
+    return job
+
+
+def active_import_job():
+    """Importación pendiente o en curso más reciente (o None)"""
+    return ImportJob.objects.filter(status__in=['pending', 'running']).first()
+
+
+def claim_import_job(worker_id, job_id=None):
+    """Como claim_job, para ImportJob"""
+    pk = _claim(ImportJob, worker_id, job_id)
+    return ImportJob.objects.get(pk=pk) if pk else None
+
+
+def run_import_job(job):
+    """Ejecuta (o reanuda desde `processed`) una importación ya reclamada"""
+    if job.processed:
+        logger.info('Reanudando importación %s (%s) tras la fila %s', job.pk, job.filename, job.processed)
+    # Errores de bloques que no llegaron a confirmarse (la fila 1 son los encabezados)
+    _trim_error_file(job.error_file, job.processed + 2)
+
+    def on_chunk(result, rows_done):
+        updated = _owned(ImportJob, job).update(
+            processed=rows_done,
+            contacts_created=result.created,
+            contacts_updated=result.updated,
+            error_count=result.errors,
+            lease_expires_at=_lease_expiry(),
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            # Deshace el bloque: lo importa quien tiene ahora el job
+            raise LeaseLost()
+        if result.chunk_errors:
+            _append_errors(job.error_file, result.chunk_errors)
+        # El archivo sigue en uso: que no lo borre la limpieza por antigüedad
+        os.utime(job.file_path, None)
+
+    try:
+        if not os.path.exists(job.file_path):
+            raise FileNotFoundError(f'El archivo {job.filename} ya no está disponible, vuelva a subirlo')
+        with _job_lease(ImportJob, job):
+            result = import_contacts(
+                job.file_path,
+                job.filename,
+                ColumnMapping.from_dict(job.mapping),
+                skip_rows=job.processed,
+                result=ImportResult(job.processed, job.contacts_created, job.contacts_updated, job.error_count),
+                on_chunk=on_chunk,
+            )
+    except LeaseLost:
+        logger.warning('La importación %s (%s) la continúa otro proceso', job.pk, job.filename)
+        return None
+    except Exception as e:
+        logger.exception('Error en la importación %s (%s)', job.pk, job.filename)
+        _owned(ImportJob, job).update(status='failed', error=str(e), updated_at=timezone.now())
+        return None
+
+    finished = _owned(ImportJob, job).update(
+        status='done',
+        processed=result.rows,
+        contacts_created=result.created,
+        contacts_updated=result.updated,
+        error_count=result.errors,
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+    if not finished:
+        # Otro proceso reanudó la importación y aún usa el archivo
+        return None
+    try:
+        os.remove(job.file_path)
+    except OSError:
+        pass
+    return result
+
+
+def _append_errors(path, errors):
+    """Agrega (fila, error) al CSV de errores del job"""
+    new = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if new:
+            writer.writerow(['fila', 'error'])
+        writer.writerows(errors)
+
+
+def _trim_error_file(path, first_row):
+    """Deja en el CSV de errores solo las filas anteriores a `first_row` (y el encabezado)"""
+    if not path or not os.path.exists(path):
+        return
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [row for row in csv.reader(f) if row and (not row[0].isdigit() or int(row[0]) < first_row)]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix='enqueue')
+    return _executor
+
+
+def _run_in_thread(claim, run, job_id):
+    try:
+        job = claim(make_worker_id(), job_id)
+        if job:
+            run(job)
+    finally:
+        # Conexión propia de este hilo
+        connection.close()
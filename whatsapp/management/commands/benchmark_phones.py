@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+import random
+import time
+from whatsapp.utils import limpiar_telefono, limpiar_telefonos
+
+# Formatos que llegan como texto en los archivos de contactos
+FORMATS = [
+    lambda n: f'+5939{n:08d}',
+    lambda n: f'09{n:08d}',
+    lambda n: f'9{n:08d}',
+    lambda n: f'(09) {n // 10000:04d}-{n % 10000:04d}',
+    lambda n: f'593 9{n // 10000:04d} {n % 10000:04d}',
+    lambda n: f'{n % 1000}',
+    lambda n: 'nan',
+    lambda n: '',
+]
+
+
+def legacy_clean(values):
+    """Normalización fila por fila de las importaciones anteriores, como referencia"""
+    phones = []
+    for value in values:
+        if value != value:  # NaN
+            value = ''
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        phone = limpiar_telefono(str(value).strip())
+        phones.append('' if not phone or phone == 'nan' or phone == '+593' else phone)
+    return phones
+
+
+class Command(BaseCommand):
+    help = 'Compara limpiar_telefono (fila por fila) con limpiar_telefonos (vectorizado), sin tocar la BD.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--numbers', type=int, default=1000000,
+                            help='Teléfonos a normalizar (por defecto: 1000000)')
+
+    def handle(self, *args, **options):
+        import pandas as pd
+
+        total = options['numbers']
+        if total < 1:
+            raise CommandError('--numbers debe ser mayor que 0')
+
+        random.seed(1234)
+        columns = [
+            # Columna de texto con formatos mezclados
+            ('Texto', pd.Series([random.choice(FORMATS)(random.randrange(10 ** 8)) for _ in range(total)])),
+            # Como lee pandas una columna de números sin '+' con alguna celda vacía
+            ('Numérica', pd.Series([float(random.randrange(9 * 10 ** 8, 10 ** 9)) if i % 50 else float('nan')
+                                    for i in range(total)])),
+        ]
+
+        self.stdout.write(f'Teléfonos: {total} por columna')
+        for label, column in columns:
+            values = column.tolist()
+            started = time.perf_counter()
+            legacy = legacy_clean(values)
+            legacy_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            phones, invalid = limpiar_telefonos(column)
+            vectorized = phones.where(~invalid, '').tolist()
+            vectorized_seconds = time.perf_counter() - started
+
+            mismatches = sum(1 for a, b in zip(legacy, vectorized) if a != b)
+            self.stdout.write(f'\n{label} ({int(invalid.sum())} inválidos)')
+            self.stdout.write(f'  Por fila:    {legacy_seconds:.3f}s ({total / legacy_seconds:,.0f} tel/s)')
+            self.stdout.write(f'  Vectorizado: {vectorized_seconds:.3f}s ({total / vectorized_seconds:,.0f} tel/s)')
+            self.stdout.write(self.style.SUCCESS(f'  Mejora:      x{legacy_seconds / vectorized_seconds:.1f}'))
+            if mismatches:
+                self.stdout.write(self.style.WARNING(f'  ⚠️  {mismatches} teléfonos distintos'))
+            else:
+                self.stdout.write(self.style.SUCCESS('  ✓ Resultados idénticos'))
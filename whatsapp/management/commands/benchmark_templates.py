@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime
+import random
+import time
+from whatsapp.utils import compile_template, template_constants, process_template
+
+DEFAULT_TEMPLATE = (
+    '{saludo} {nombre} 👋\n'
+    'Te escribimos del grupo {grupo} ({telefono}).\n'
+    'Recuerda la reunión de hoy {fecha} a las {hora}. ¡Te esperamos!'
+)
+
+
+def legacy_process_template(template_text, contacto):
+    """process_template anterior (seis str.replace por mensaje), como referencia"""
+    saludo_choices = ['Dios te bendiga', 'Bendiciones', 'Hola']
+    replacements = {
+        'nombre': contacto.get('nombre', ''),
+        'telefono': contacto.get('telefono', ''),
+        'grupo': contacto.get('grupo', ''),
+        'fecha': datetime.now().strftime('%d/%m/%Y'),
+        'hora': datetime.now().strftime('%H:%M'),
+        'saludo': random.choice(saludo_choices)
+    }
+    out = template_text
+    for k, v in replacements.items():
+        out = out.replace(f'{{{k}}}', str(v))
+    return out
+
+
+class Command(BaseCommand):
+    help = 'Compara el renderizado de plantillas anterior con el compilado (sin tocar la BD).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contacts', type=int, default=100000,
+                            help='Mensajes a renderizar (por defecto: 100000)')
+        parser.add_argument('--template', type=str, default=DEFAULT_TEMPLATE,
+                            help='Texto de la plantilla a usar')
+        parser.add_argument('--batch', type=int, default=1000,
+                            help='Mensajes por bloque para fecha/hora compartidas (por defecto: 1000)')
+
+    def handle(self, *args, **options):
+        total = options['contacts']
+        text = options['template']
+        batch = max(1, options['batch'])
+        if total < 1:
+            raise CommandError('--contacts debe ser mayor que 0')
+
+        contacts = [
+            {'nombre': f'Contacto {i}', 'telefono': f'+5939{i:08d}', 'grupo': f'Grupo {i % 7}'}
+            for i in range(total)
+        ]
+
+        # Misma semilla en cada ejecución: {saludo} sale igual y se pueden comparar
+        random.seed(1234)
+        started = time.perf_counter()
+        legacy = [legacy_process_template(text, c) for c in contacts]
+        legacy_seconds = time.perf_counter() - started
+
+        random.seed(1234)
+        started = time.perf_counter()
+        process_template(text, contacts[0])  # compila (queda en caché)
+        random.seed(1234)
+        compiled_template = compile_template(text)
+        compiled = []
+        for start in range(0, total, batch):
+            constants = template_constants()
+            compiled.extend(compiled_template.render(c, constants) for c in contacts[start:start + batch])
+        compiled_seconds = time.perf_counter() - started
+
+        mismatches = sum(1 for a, b in zip(legacy, compiled) if a != b)
+        self.stdout.write(f'Mensajes:   {total}')
+        self.stdout.write(f'Anterior:   {legacy_seconds:.3f}s ({total / legacy_seconds:,.0f} msg/s)')
+        self.stdout.write(f'Compilada:  {compiled_seconds:.3f}s ({total / compiled_seconds:,.0f} msg/s)')
+        self.stdout.write(self.style.SUCCESS(f'Mejora:     x{legacy_seconds / compiled_seconds:.1f}'))
+        if mismatches:
+            # Solo esperable si el minuto cambió durante la prueba ({hora})
+            self.stdout.write(self.style.WARNING(f'⚠️  {mismatches} mensajes distintos'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✓ Resultados idénticos'))
@@ -0,0 +1,167 @@
+from django.core.management.base import BaseCommand
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+import itertools
+import json
+import random
+import threading
+import time
+
+# Misma clasificación de errores que server.js (ERROR_STATUS)
+ERROR_STATUS = {'permanent': 422, 'transient': 500, 'not_connected': 503}
+
+
+def _error(code, error):
+    return {'success': False, 'code': code, 'status': ERROR_STATUS[code], 'error': error}
+
+
+class FakeWhatsAppState:
+    """Estado compartido del servicio simulado"""
+
+    def __init__(self, latency, fail_rate, ready, permanent_fail_rate=0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.permanent_fail_rate = permanent_fail_rate
+        self.ready = ready
+        self.ids = itertools.count(1)
+        self.sent_by_key = {}  # idempotencyKey -> resultado
+        self.requests = 0
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def send(self, item):
+        """
+        Envía (simula) un mensaje respetando idempotencyKey. Los fallos llevan
+        `code` y `status` como en server.js.
+        """
+        key = item.get('idempotencyKey')
+        with self.lock:
+            if key and key in self.sent_by_key:
+                return {'success': True, 'duplicate': True, **self.sent_by_key[key]}
+
+        time.sleep(self.latency)
+        if not self.ready:
+            return _error('not_connected', 'WhatsApp no está conectado')
+        roll = random.random()
+        if roll < self.permanent_fail_rate:
+            return _error('permanent', 'Número sin WhatsApp (simulado)')
+        if roll < self.permanent_fail_rate + self.fail_rate:
+            return _error('transient', 'Fallo simulado')
+
+        with self.lock:
+            result = {'messageId': f'fake-{next(self.ids)}', 'timestamp': int(time.time())}
+            if key:
+                self.sent_by_key[key] = result
+            self.sent += 1
+        return {'success': True, 'duplicate': False, **result}
+
+
+class FakeWhatsAppHandler(BaseHTTPRequestHandler):
+    """Mismos endpoints y respuestas que whatsapp_service/server.js"""
+    protocol_version = 'HTTP/1.1'  # keep-alive, como Express
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        state = self.state
+        if self.path == '/health':
+            return self._json(200, {
+                'status': 'ready' if state.ready else 'initializing',
+                'qr': None,
+                'features': ['send-batch', 'idempotency'],
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+            })
+        if self.path == '/qr':
+            return self._json(200, {'status': 'ready', 'message': 'Ya estás conectado'})
+        if self.path == '/info':
+            return self._json(200, {'success': True, 'info': {
+                'pushname': 'Servicio simulado', 'platform': 'fake',
+                'sent': state.sent, 'requests': state.requests,
+            }})
+        return self._json(404, {'success': False, 'error': 'Not found'})
+
+    def do_POST(self):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._json(400, {'success': False, 'error': 'JSON inválido'})
+
+        if self.path == '/logout':
+            state.ready = False
+            return self._json(200, {'success': True, 'message': 'Sesión cerrada'})
+        if self.path not in ('/send', '/send-media', '/send-batch', '/check-number'):
+            return self._json(404, {'success': False, 'error': 'Not found'})
+        if not state.ready:
+            return self._json(503, {'success': False, 'error': 'WhatsApp no está conectado'})
+
+        if self.path == '/check-number':
+            return self._json(200, {'success': True, 'exists': True, 'phone': body.get('phone')})
+
+        if self.path == '/send-batch':
+            items = body.get('messages')
+            if not isinstance(items, list) or not items:
+                return self._json(400, {'success': False, 'error': 'Se requiere "messages" con al menos un mensaje'})
+            results = []
+            for item in items:
+                if not item.get('phone') or not (item.get('message') or item.get('mediaPath')):
+                    results.append({'success': False, 'code': 'invalid', 'status': 400,
+                                    'error': 'Se requieren "phone" y "message" o "mediaPath"'})
+                else:
+                    results.append(state.send(item))
+            return self._json(200, {'success': True, 'results': results})
+
+        if not body.get('phone') or not (body.get('message') or body.get('mediaPath')):
+            return self._json(400, {'success': False, 'error': 'Se requieren "phone" y "message"'})
+        result = state.send(body)
+        # Como en server.js: 422 permanente, 500 temporal, 503 sin conexión
+        return self._json(result.pop('status', 200), result)
+
+    def _json(self, status, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class Command(BaseCommand):
+    help = ('Servicio WhatsApp simulado (mismos endpoints que whatsapp_service/server.js) '
+            'para probar el worker con USE_REAL_WHATSAPP=true sin WhatsApp Web.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=3000, help='Puerto (por defecto: 3000)')
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Segundos que tarda cada mensaje (por defecto: 0.05)')
+        parser.add_argument('--fail-rate', type=float, default=0.0,
+                            help='Fracción de envíos con fallo temporal, HTTP 500 (0-1, por defecto: 0)')
+        parser.add_argument('--permanent-fail-rate', type=float, default=0.0,
+                            help='Fracción de envíos con fallo permanente, HTTP 422 (0-1, por defecto: 0)')
+        parser.add_argument('--not-ready', action='store_true',
+                            help='Responder 503 como si WhatsApp no estuviera conectado')
+
+    def handle(self, *args, **options):
+        state = FakeWhatsAppState(options['latency'], options['fail_rate'], not options['not_ready'],
+                                  permanent_fail_rate=options['permanent_fail_rate'])
+        handler = type('Handler', (FakeWhatsAppHandler,), {'state': state})
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), handler)
+        server.daemon_threads = True
+
+        self.stdout.write(self.style.SUCCESS(
+            f'🧪 Servicio WhatsApp simulado en http://127.0.0.1:{options["port"]} '
+            f'(latencia {options["latency"]}s por mensaje)'
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(
+                f'\n⏹️  Detenido: {state.sent} mensajes en {state.requests} peticiones.'
+            ))
+        finally:
+            server.server_close()
@@ -1,112 +1,575 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import math
+import multiprocessing
+import multiprocessing.connection
+import signal
 import time
 from whatsapp.models import OutgoingMessage, Campaign
-from whatsapp.send_adapter import send_message
+from whatsapp.send_engine import SyncSendEngine, AsyncSendEngine
+from whatsapp.send_adapter import breaker
+from whatsapp.claiming import (
+    LEASE_SECONDS, make_worker_id, parse_shard, claim_messages, release_messages,
+    renew_leases, reap_expired_leases,
+)
+from whatsapp.rate_limit import CampaignRateLimiter, campaign_rate
+from whatsapp.scheduler import CampaignScheduler
+from whatsapp.writeback import StatusBuffer
+from whatsapp.retry import apply_failure
+from whatsapp.wakeup import WakeupListener
+from whatsapp.utils import template_constants
+from whatsapp.jobs import claim_import_job, claim_job, run_import_job, run_job
+from django.db import connections, DatabaseError
+from django.db.models import Min, Q
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Espera máxima por resultados de envío antes de revisar campañas otra vez
+IDLE_POLL_SECONDS = 2
+# Sin nada que hacer se espera un aviso de notify_workers(); esto es solo la red de seguridad
+IDLE_MAX_WAIT_SECONDS = 30
+# Duración máxima del turno de una campaña antes de dar paso a las demás
+TURN_SLICE_SECONDS = 1.0
+# Se reclaman mensajes para cubrir este tiempo de envío (a la velocidad medida,
+# sin pasar de la configurada en la campaña)
+CLAIM_LOOKAHEAD_SECONDS = 30
+# Envíos recientes con los que se mide la velocidad real de cada campaña
+THROUGHPUT_SAMPLES = 20
+# Cada cuánto se buscan leases vencidos de workers caídos
+REAP_INTERVAL_SECONDS = 60
+# Cada cuánto se buscan jobs de encolado/importación pendientes o abandonados
+JOB_POLL_SECONDS = 5
+# Espera tras un error de BD (p. ej. "database is locked" en SQLite); se duplica hasta el máximo
+DB_ERROR_BACKOFF_SECONDS = 1
+DB_ERROR_MAX_BACKOFF_SECONDS = 30
+# Con --workers, espera antes de relanzar un proceso hijo que terminó
+CHILD_RESTART_SECONDS = 5
+# Al detenerse, espera máxima a que cada hijo termine lo que tiene en vuelo
+CHILD_STOP_SECONDS = 60
+
+
+def _stop_on_sigterm():
+    """SIGTERM (systemd, kill, timeout) detiene el worker igual que Ctrl+C"""
+    def handler(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handler)
+
+
+def _ignore_stop_signals():
+    """Ya deteniéndose: una segunda señal no debe cortar la limpieza"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def _run_child(options):
+    """Punto de entrada de cada proceso hijo lanzado con --workers"""
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('run_worker', workers=1, shard=options['shard'], burst=options['burst'],
+                 rate_share=options['rate_share'], use_async=options['use_async'],
+                 max_in_flight=options['max_in_flight'], flush_size=options['flush_size'],
+                 flush_interval=options['flush_interval'], lease_seconds=options['lease_seconds'],
+                 send_batch=options['send_batch'])
+
+
 class Command(BaseCommand):
     help = 'Worker que procesa OutgoingMessage pendientes con configuración de velocidad y pausas.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Número de procesos worker a lanzar en este servidor (por defecto: 1)'
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            default='',
+            help='Procesar solo una parte de la cola, formato indice/total (ej: 0/4). '
+                 'Útil para repartir el trabajo entre varios servidores.'
+        )
+        parser.add_argument(
+            '--burst',
+            type=int,
+            default=1,
+            help='Mensajes que una campaña puede enviar seguidos antes de aplicar send_speed (por defecto: 1)'
+        )
+        parser.add_argument(
+            '--rate-share',
+            type=float,
+            default=None,
+            help='Fracción de send_speed que aplica este proceso. '
+                 'Por defecto 1/(workers × total de shards) para que el conjunto respete la velocidad.'
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='use_async',
+            help='Enviar con el motor asyncio: varios mensajes en vuelo sin esperar cada respuesta HTTP'
+        )
+        parser.add_argument(
+            '--max-in-flight',
+            type=int,
+            default=None,
+            help='Con --async, máximo de envíos simultáneos (por defecto según el backend, '
+                 'ver WHATSAPP_WEBJS_MAX_IN_FLIGHT / WHATSAPP_SIMULATED_MAX_IN_FLIGHT)'
+        )
+        parser.add_argument(
+            '--send-batch',
+            type=int,
+            default=1,
+            help='Mensajes por petición al servicio WhatsApp (/send-batch). Agrupa lo que '
+                 'send_speed y --burst permiten enviar a la vez (por defecto: 1, sin lotes)'
+        )
+        parser.add_argument(
+            '--flush-size',
+            type=int,
+            default=100,
+            help='Resultados de envío acumulados antes de escribirlos en la BD (por defecto: 100)'
+        )
+        parser.add_argument(
+            '--flush-interval',
+            type=float,
+            default=2.0,
+            help='Segundos máximos que un resultado espera antes de escribirse (por defecto: 2)'
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=LEASE_SECONDS,
+            help='Duración del lease de los mensajes reclamados. Si el worker no lo renueva '
+                 f'(heartbeat) otro worker los recupera (por defecto: {LEASE_SECONDS}, ver WORKER_LEASE_SECONDS)'
+        )
+
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('🚀 Worker iniciado...'))
+        try:
+            self.shard = parse_shard(options['shard'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['rate_share'] is None:
+            processes = options['workers'] * (self.shard[1] if self.shard else 1)
+            options['rate_share'] = 1.0 / processes
+
+        _stop_on_sigterm()
+        if options['workers'] > 1:
+            return self._spawn_workers(options)
+
+        # Un token bucket por campaña: respeta send_speed sin sumar el tiempo de BD/HTTP
+        self.limiter = CampaignRateLimiter(share=options['rate_share'], burst=options['burst'])
+
+        # Próxima hora elegible por campaña: las pausas de una no frenan a las demás
+        self.scheduler = CampaignScheduler()
+
+        # Motor de envío: secuencial o asyncio con mensajes en vuelo
+        send_batch = max(1, options['send_batch'])
+        if options['use_async']:
+            self.engine = AsyncSendEngine(max_in_flight=options['max_in_flight'], batch_size=send_batch)
+            mode_info = f' [async, máx. {self.engine.max_in_flight} en vuelo]'
+        else:
+            self.engine = SyncSendEngine(batch_size=send_batch)
+            mode_info = ''
+        if send_batch > 1:
+            mode_info += f' [lotes de hasta {send_batch}]'
+
+        # Resultados de envío: se escriben en bloque (bulk_update + contadores con F())
+        self.buffer = StatusBuffer(max_size=options['flush_size'], max_age=options['flush_interval'])
+
+        self.worker_id = make_worker_id()
+        self.lease_seconds = max(3, options['lease_seconds'])
+        self.next_heartbeat = 0
+        self.next_reap = 0
+        self.wakeup = WakeupListener()
+        self.outage = False
+        # Carril de jobs de encolado e importación: un hilo aparte para no frenar los envíos
+        self.job_lane = ThreadPoolExecutor(max_workers=1, thread_name_prefix='enqueue-job')
+        self.job_future = None
+        self.next_job_poll = 0
+        self.claimed = {}  # campaign_id -> deque de mensajes reclamados aún sin enviar
+        self.throughput = {}  # campaign_id -> deque con los instantes de los últimos resultados
+        # Sin medidas de velocidad se reclama solo lo que el motor puede enviar de una vez
+        self.claim_start = max(options['burst'], send_batch * getattr(self.engine, 'max_in_flight', 1))
+        self.sending = {}  # message_id -> (campaign, msg) enviados al motor, sin resultado aún
+        shard_info = f' (shard {self.shard[0]}/{self.shard[1]})' if self.shard else ''
+        self.stdout.write(self.style.SUCCESS(f'🚀 Worker {self.worker_id} iniciado{shard_info}{mode_info}...'))
         self.stdout.write('Esperando mensajes pendientes...\n')
-        
+
         try:
+            db_errors = 0
             while True:
-                # Obtener campañas activas (sending)
-                active_campaigns = Campaign.objects.filter(status='sending')
-                
-                if not active_campaigns.exists():
-                    time.sleep(2)
-                    continue
-                
-                for campaign in active_campaigns:
-                    # Procesar mensajes de esta campaña
-                    pending = OutgoingMessage.objects.filter(
-                        campaign=campaign,
-                        status='pending'
-                    ).order_by('created_at', 'line_number')[:campaign.batch_size]
-                    
-                    if not pending.exists():
-                        # No hay más mensajes pendientes, marcar campaña como completada
-                        campaign.status = 'completed'
-                        campaign.save()
-                        self.stdout.write(self.style.SUCCESS(
-                            f'✅ Campaña "{campaign.name}" completada!'
-                        ))
-                        continue
-                    
-                    # Procesar bloque de mensajes
-                    batch_count = 0
-                    for msg in pending:
-                        try:
-                            msg.status = 'sending'
-                            msg.attempts += 1
-                            msg.save()
-                            
-                            # Enviar mensaje (con adjunto si existe)
-                            success, info = send_message(
-                                msg.contact.phone, 
-                                msg.payload,
-                                attachment_path=msg.attachment_path,
-                                attachment_type=msg.attachment_type
-                            )
-                            
-                            if success:
-                                msg.status = 'sent'
-                                msg.sent_at = timezone.now()
-                                msg.last_error = ''
-                                campaign.sent_count += 1
-                                
-                                # Indicar si es multi-línea
-                                line_info = f" [Línea {msg.line_number}]" if msg.line_number > 0 else ""
-                                attach_info = f" 📎 {msg.attachment_type}" if msg.attachment_path else ""
-                                
-                                self.stdout.write(self.style.SUCCESS(
-                                    f'✓ {msg.contact.name} ({msg.contact.phone}){line_info}{attach_info}'
-                                ))
-                            else:
-                                msg.status = 'failed'
-                                msg.last_error = info
-                                campaign.failed_count += 1
-                                self.stdout.write(self.style.ERROR(
-                                    f'✗ {msg.contact.name}: {info}'
-                                ))
-                            
-                            msg.save()
-                            campaign.save()
-                            
-                            batch_count += 1
-                            
-                            # Delay entre mensajes según configuración
-                            # Si es multi-línea del mismo contacto, delay más corto
-                            if msg.line_number > 0:
-                                time.sleep(min(campaign.delay_between_messages, 2.0))  # Máximo 2 segundos entre líneas
-                            else:
-                                time.sleep(campaign.delay_between_messages)
-                            
-                        except Exception as e:
-                            msg.status = 'failed'
-                            msg.last_error = str(e)
-                            msg.save()
-                            campaign.failed_count += 1
-                            campaign.save()
-                            self.stdout.write(self.style.ERROR(
-                                f'✗ Error: {str(e)}'
-                            ))
-                    
-                    # Pausa entre bloques si procesamos el tamaño completo del batch
-                    if batch_count >= campaign.batch_size:
-                        self.stdout.write(self.style.WARNING(
-                            f'⏸️  Pausa de {campaign.delay_between_batches}s entre bloques...'
-                        ))
-                        time.sleep(campaign.delay_between_batches)
-                    else:
-                        # Si el batch fue más pequeño, esperar menos
-                        time.sleep(2)
-                
+                try:
+                    self._loop()
+                    db_errors = 0
+                except DatabaseError:
+                    # La BD no responde o está bloqueada: esperar y reintentar en lugar de morir
+                    db_errors += 1
+                    backoff = min(DB_ERROR_BACKOFF_SECONDS * 2 ** (db_errors - 1), DB_ERROR_MAX_BACKOFF_SECONDS)
+                    logger.exception('Error de base de datos en el worker, reintento en %ss', backoff)
+                    time.sleep(backoff)
         except KeyboardInterrupt:
+            _ignore_stop_signals()
+            # Registrar lo que ya estaba en vuelo
+            for key, success, info in self.engine.close():
+                self._record(key, success, info)
+            self.buffer.flush()
+            # Devolver a la cola lo reclamado que no se llegó a enviar
+            claimed_ids = [msg.id for queue in self.claimed.values() for msg in queue]
+            released = release_messages(self.worker_id, claimed_ids)
+            if released:
+                self.stdout.write(f'↩️  {released} mensajes devueltos a la cola.')
             self.stdout.write(self.style.WARNING('\n⏹️  Worker detenido por el usuario.'))
+        finally:
+            self.wakeup.close()
+            self.job_lane.shutdown(wait=False)
+
+    def _loop(self):
+        """Una vuelta del worker: campañas activas, leases, jobs y turnos de envío"""
+        # Obtener campañas activas (sending)
+        active_campaigns = {
+            c.pk: c for c in Campaign.objects.filter(status='sending').select_related('template')
+        }
+        self._drop_inactive(active_campaigns)
+        self.scheduler.sync(active_campaigns.keys())
+        self._maintain_leases()
+        self._poll_jobs()
+
+        if not active_campaigns and not self.sending:
+            self._flush()
+            self.wakeup.wait(IDLE_MAX_WAIT_SECONDS)
+            return
+
+        if self._service_down():
+            return
+
+        for campaign_id in self.scheduler.ready():
+            campaign = active_campaigns[campaign_id]
+            try:
+                self._run_turn(campaign)
+            except DatabaseError:
+                # Solo se pierde este turno: la campaña vuelve a intentarlo más tarde
+                logger.exception('Error de base de datos en el turno de "%s"', campaign.name)
+                self.scheduler.defer(campaign.pk, DB_ERROR_BACKOFF_SECONDS)
+
+        wait = self.scheduler.seconds_until_next()
+        if self.engine.in_flight or not self.engine.has_capacity():
+            # Esperar resultados (revisando nuevas campañas cada tanto)
+            self._collect(timeout=min(wait or IDLE_POLL_SECONDS, IDLE_POLL_SECONDS))
+        else:
+            # Nada en vuelo: dormir hasta que una campaña vuelva a ser
+            # elegible o llegue un aviso de mensajes nuevos
+            self._collect()
+            self._flush()
+            self.wakeup.wait(min(wait if wait is not None else IDLE_MAX_WAIT_SECONDS,
+                                 IDLE_MAX_WAIT_SECONDS))
+
+    def _maintain_leases(self):
+        """Heartbeat de los leases propios y recuperación de los de workers caídos"""
+        self._heartbeat()
+        now = time.monotonic()
+        try:
+            if now >= self.next_reap:
+                self.next_reap = now + REAP_INTERVAL_SECONDS
+                requeued, dead = reap_expired_leases(lease_seconds=self.lease_seconds)
+                if requeued or dead:
+                    self.stdout.write(self.style.WARNING(
+                        f'♻️  Leases vencidos: {requeued} mensajes devueltos a la cola, {dead} sin intentos (dead)'
+                    ))
+        except DatabaseError:
+            logger.exception('Error recuperando leases vencidos')
+
+    def _heartbeat(self):
+        """Renueva los leases propios cada lease_seconds/3 (también en mitad de un turno)"""
+        now = time.monotonic()
+        if now < self.next_heartbeat or not (self.claimed or self.sending or len(self.buffer)):
+            return
+        try:
+            renew_leases(self.worker_id, self.lease_seconds)
+            self.next_heartbeat = now + self.lease_seconds / 3
+        except DatabaseError:
+            logger.exception('Error renovando leases')
+
+    def _poll_jobs(self):
+        """Toma un job de encolado (o de importación) pendiente o abandonado si el carril está libre"""
+        now = time.monotonic()
+        if now < self.next_job_poll or (self.job_future and not self.job_future.done()):
+            return
+        self.next_job_poll = now + JOB_POLL_SECONDS
+        try:
+            job = claim_job(self.worker_id)
+            import_job = None if job else claim_import_job(self.worker_id)
+        except DatabaseError:
+            logger.exception('Error buscando jobs de encolado')
+            return
+        if job:
+            self.stdout.write(self.style.WARNING(
+                f'📥 Encolando "{job.campaign.name}" ({job.processed}/{job.total} contactos ya encolados)...'
+            ))
+            self.job_future = self.job_lane.submit(self._run_job, job)
+        elif import_job:
+            self.stdout.write(self.style.WARNING(
+                f'📇 Importando "{import_job.filename}" ({import_job.processed}/{import_job.total} filas ya importadas)...'
+            ))
+            self.job_future = self.job_lane.submit(self._run_import_job, import_job)
+
+    def _run_job(self, job):
+        try:
+            result = run_job(job)
+            if result:
+                self.stdout.write(self.style.SUCCESS(
+                    f'📥 "{job.campaign.name}": {result.messages} mensajes encolados ({result.rate:.0f}/s)'
+                ))
+        finally:
+            connections.close_all()
+
+    def _run_import_job(self, job):
+        try:
+            result = run_import_job(job)
+            if result:
+                self.stdout.write(self.style.SUCCESS(
+                    f'📇 "{job.filename}": {result.created} nuevos, {result.updated} actualizados, '
+                    f'{result.errors} errores'
+                ))
+        finally:
+            connections.close_all()
+
+    def _service_down(self):
+        """
+        Con el circuito del servicio WhatsApp abierto no se reclama ni se envía
+        en ninguna campaña: solo se recogen los envíos en vuelo hasta la
+        próxima comprobación de /health. Devuelve True mientras dure el corte.
+        """
+        if not breaker.is_open():
+            if self.outage:
+                self.outage = False
+                self.stdout.write(self.style.SUCCESS('🔌 Servicio WhatsApp disponible, se reanudan los envíos.'))
+            return False
+
+        if not self.outage:
+            self.outage = True
+            self.stdout.write(self.style.ERROR(
+                '🔌 Servicio WhatsApp no disponible: envíos en pausa hasta que /health responda.'
+            ))
+        self._collect(timeout=min(breaker.seconds_until_probe() or IDLE_POLL_SECONDS, IDLE_POLL_SECONDS))
+        self._flush()
+        return True
+
+    def _drop_inactive(self, active_campaigns):
+        """Devuelve a la cola lo reclamado de campañas pausadas/canceladas"""
+        for campaign_id in list(self.claimed):
+            if campaign_id not in active_campaigns:
+                release_messages(self.worker_id, [msg.id for msg in self.claimed[campaign_id]])
+                del self.claimed[campaign_id]
+                self.throughput.pop(campaign_id, None)
+                self.limiter.forget(campaign_id)
+
+    def _run_turn(self, campaign):
+        """
+        Turno de una campaña: envía lo que permitan su token bucket y su bloque
+        actual, y la reprograma para cuando vuelva a tener cupo. Nunca duerme y
+        no dura más de TURN_SLICE_SECONDS: con envíos lentos (modo secuencial)
+        la campaña pasa al final de la cola para que las demás tengan su turno.
+        """
+        queue = self.claimed.setdefault(campaign.pk, deque())
+        constants = template_constants()  # fecha/hora comunes a los mensajes del turno
+        turn_ends = time.monotonic() + TURN_SLICE_SECONDS
+
+        while True:
+            if time.monotonic() >= turn_ends:
+                self.scheduler.defer(campaign.pk, 0)
+                return
+
+            wait = self.limiter.time_until_available(campaign)
+            if wait > 0:
+                self.scheduler.defer(campaign.pk, wait)
+                return
+
+            if not self.engine.has_capacity():
+                return
+
+            if not queue:
+                queue.extend(self._claim(campaign))
+                if not queue:
+                    self._finish_if_done(campaign)
+                    return
+
+            msg = queue.popleft()
+            msg.campaign = campaign
+            self.sending[msg.id] = (campaign, msg)
+            # Sin payload se renderiza ahora; un error solo hace fallar este mensaje
+            try:
+                payload = msg.render_payload(constants)
+            except Exception as e:
+                logger.exception('Error generando el mensaje %s', msg.id)
+                self._record(msg.id, False, f'Error al generar el mensaje: {e}')
+                continue
+
+            self.limiter.try_acquire(campaign)
+            # Enviar mensaje (con adjunto si existe)
+            self.engine.submit(
+                msg.id,
+                msg.contact.phone,
+                payload,
+                attachment_path=msg.attachment_path,
+                attachment_type=msg.attachment_type,
+                idempotency_key=f'msg-{msg.id}'
+            )
+            # Registrar lo ya terminado sin esperar al final del turno (respeta --flush-interval)
+            self._collect(send_partial=False)
+            self._heartbeat()
+
+            # Pausa entre bloques al completar el tamaño del batch
+            if self.scheduler.record_sent(campaign):
+                self.stdout.write(self.style.WARNING(
+                    f'⏸️  "{campaign.name}": pausa de {campaign.delay_between_batches}s entre bloques...'
+                ))
+                return
+
+    def _claim(self, campaign):
+        """
+        Reclama mensajes para los próximos segundos de envío (sin pasar del bloque
+        actual). Se usa la velocidad medida: con envíos más lentos que send_speed
+        no se acaparan mensajes que otros workers podrían enviar.
+        """
+        rate = self._measured_rate(campaign.pk)
+        if rate is None:
+            lookahead = self.claim_start
+        else:
+            configured = campaign_rate(campaign)
+            if configured:
+                rate = min(rate, configured * self.limiter.share)
+            lookahead = math.ceil(rate * CLAIM_LOOKAHEAD_SECONDS)
+        limit = max(1, min(self.scheduler.batch_remaining(campaign), lookahead))
+        return claim_messages(campaign, limit, self.worker_id, self.shard, self.lease_seconds)
+
+    def _measured_rate(self, campaign_id):
+        """Mensajes/s que este worker envía realmente en la campaña (None sin datos suficientes)"""
+        samples = self.throughput.get(campaign_id)
+        if not samples or len(samples) < 2:
+            return None
+        span = samples[-1] - samples[0]
+        return (len(samples) - 1) / span if span > 0 else None
+
+    def _finish_if_done(self, campaign):
+        """Sin pendientes: completar la campaña o esperar a lo que tengan otros workers"""
+        # Los resultados aún en memoria figuran como 'sending' en la BD
+        self._flush()
+        unfinished = campaign.messages.filter(status__in=['pending', 'sending'])
+        if campaign.enqueue_jobs.filter(status__in=['pending', 'running']).exists():
+            # Aún se están creando mensajes
+            self.scheduler.defer(campaign.pk, IDLE_POLL_SECONDS)
+            return
+        if unfinished.exists():
+            delay = IDLE_POLL_SECONDS
+            # Si solo quedan reintentos programados, volver cuando toque el primero
+            if not unfinished.filter(Q(status='sending') | Q(next_attempt_at__isnull=True)).exists():
+                retry_at = unfinished.aggregate(first=Min('next_attempt_at'))['first']
+                delay = max(delay, (retry_at - timezone.now()).total_seconds())
+            self.scheduler.defer(campaign.pk, delay)
+            return
+
+        completed = Campaign.objects.filter(pk=campaign.pk, status='sending').update(status='completed')
+        self.scheduler.forget(campaign.pk)
+        self.claimed.pop(campaign.pk, None)
+        self.throughput.pop(campaign.pk, None)
+        self.limiter.forget(campaign.pk)
+        if completed:
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ Campaña "{campaign.name}" completada!'
+            ))
+
+    def _collect(self, timeout=0, send_partial=True):
+        """
+        Registra los envíos terminados (esperando hasta `timeout` s al primero).
+        Con send_partial=False no se envía antes de tiempo un lote incompleto.
+        """
+        for key, success, info in self.engine.results(timeout=timeout, send_partial=send_partial):
+            self._record(key, success, info)
+        if self.buffer.should_flush():
+            self._flush()
+
+    def _flush(self):
+        """Escribe los resultados acumulados (si falla la BD se reintenta en el próximo ciclo)"""
+        try:
+            self.buffer.flush()
+        except DatabaseError:
+            logger.exception('Error escribiendo %s resultados de envío', len(self.buffer))
+
+    def _record(self, message_id, success, info):
+        """Anota el resultado de un envío (se escribe en el próximo volcado del buffer)"""
+        campaign, msg = self.sending.pop(message_id)
+        self.throughput.setdefault(campaign.pk, deque(maxlen=THROUGHPUT_SAMPLES)).append(time.monotonic())
+        if success:
+            msg.status = 'sent'
+            msg.sent_at = timezone.now()
+            msg.last_error = ''
+            msg.next_attempt_at = None
+            counter = 'sent_count'
+
+            # Indicar si es multi-línea
+            line_info = f" [Línea {msg.line_number}]" if msg.line_number > 0 else ""
+            attach_info = f" 📎 {msg.attachment_type}" if msg.attachment_path else ""
+
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ {msg.contact.name} ({msg.contact.phone}){line_info}{attach_info}'
+            ))
+        else:
+            # Fallo temporal: reintento con backoff; si no, 'failed' o 'dead'
+            counter = apply_failure(msg, info, campaign.max_attempts)
+            if msg.status == 'pending':
+                self.stdout.write(self.style.WARNING(
+                    f'↻ {msg.contact.name}: {info} (reintento {msg.attempts + 1}/{campaign.max_attempts} '
+                    f'a las {timezone.localtime(msg.next_attempt_at):%H:%M:%S})'
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(
+                    f'✗ {msg.contact.name}: {info}'
+                ))
+
+        self.buffer.add(msg, counter)
+
+    def _spawn_workers(self, options):
+        """
+        Lanza N procesos worker independientes que comparten la cola y los
+        relanza si alguno termina (sus mensajes los recupera el reaper).
+        """
+        total = options['workers']
+        self.stdout.write(self.style.SUCCESS(f'🚀 Lanzando {total} workers...'))
+
+        # Cada hijo abre sus propias conexiones a la BD
+        connections.close_all()
+        children = [self._start_child(options, i) for i in range(total)]
+
+        try:
+            while True:
+                multiprocessing.connection.wait([child.sentinel for child in children])
+                time.sleep(CHILD_RESTART_SECONDS)
+                for i, child in enumerate(children):
+                    if not child.is_alive():
+                        child.join()
+                        self.stdout.write(self.style.ERROR(
+                            f'⚠️  {child.name} terminó (código {child.exitcode}), relanzando...'
+                        ))
+                        children[i] = self._start_child(options, i)
+        except KeyboardInterrupt:
+            # Ctrl+C llega a todo el grupo, pero SIGTERM (systemd, kill) solo a este
+            # proceso: se reenvía para que cada hijo devuelva lo suyo a la cola
+            _ignore_stop_signals()
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+            for child in children:
+                child.join(CHILD_STOP_SECONDS)
+                if child.is_alive():
+                    child.kill()
+                    child.join()
+            self.stdout.write(self.style.WARNING('\n⏹️  Workers detenidos por el usuario.'))
+
+    def _start_child(self, options, index):
+        child = multiprocessing.Process(target=_run_child, args=(options,), name=f'run_worker-{index}')
+        child.start()
+        return child
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-17 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0007_subscription_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingmessage',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outgoingmessage',
+            name='claimed_by',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='outgoingmessage',
+            index=models.Index(fields=['campaign', 'status'], name='outmsg_campaign_status_idx'),
+        ),
+    ]
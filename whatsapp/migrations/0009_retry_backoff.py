@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-17 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0008_outgoingmessage_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='max_attempts',
+            field=models.IntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='outgoingmessage',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='outgoingmessage',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed'), ('dead', 'dead'), ('cancelled', 'cancelled')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 06:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0009_retry_backoff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outgoingmessage',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0010_outgoingmessage_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outgoingmessage',
+            name='payload',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-17 06:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0011_lazy_payload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnqueueJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En curso'), ('done', 'Terminado'), ('failed', 'Fallido')], default='pending', max_length=20)),
+                ('audience', models.JSONField(blank=True, default=dict)),
+                ('text', models.TextField(blank=True, default='')),
+                ('send_mode', models.CharField(default='single', max_length=20)),
+                ('attachment_path', models.CharField(blank=True, max_length=500, null=True)),
+                ('attachment_type', models.CharField(blank=True, max_length=50, null=True)),
+                ('total', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('messages_created', models.IntegerField(default=0)),
+                ('last_contact_id', models.IntegerField(default=0)),
+                ('run_processed', models.IntegerField(default=0)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=100)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enqueue_jobs', to='whatsapp.campaign')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
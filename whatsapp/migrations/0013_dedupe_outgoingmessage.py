@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.db.models import Count
+
+# Al quedarse con un mensaje de cada duplicado se prefiere el más avanzado
+# (uno ya enviado no debe volver a la cola por borrar su copia 'sent')
+STATUS_RANK = {'sent': 0, 'sending': 1, 'failed': 2, 'dead': 3, 'pending': 4, 'cancelled': 5}
+
+
+def dedupe_messages(apps, schema_editor):
+    """Deja un solo OutgoingMessage por (campaña, contacto, línea)"""
+    OutgoingMessage = apps.get_model('whatsapp', 'OutgoingMessage')
+    duplicated = list(
+        OutgoingMessage.objects.values('campaign_id', 'contact_id', 'line_number')
+        .annotate(copies=Count('id')).filter(copies__gt=1).order_by()
+    )
+    for key in duplicated:
+        rows = sorted(
+            OutgoingMessage.objects.filter(
+                campaign_id=key['campaign_id'], contact_id=key['contact_id'], line_number=key['line_number'],
+            ).values_list('id', 'status'),
+            key=lambda row: (STATUS_RANK.get(row[1], len(STATUS_RANK)), row[0]),
+        )
+        keep = rows[0][0]
+        drop = [row[0] for row in rows[1:]]
+        # Las líneas de un padre duplicado pasan al que se conserva (si no, se borrarían en cascada)
+        OutgoingMessage.objects.filter(parent_message_id__in=drop).update(parent_message_id=keep)
+        OutgoingMessage.objects.filter(id__in=drop).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0012_enqueuejob'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_messages, migrations.RunPython.noop),
+    ]
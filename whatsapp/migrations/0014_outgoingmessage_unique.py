@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-17 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0013_dedupe_outgoingmessage'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='outgoingmessage',
+            constraint=models.UniqueConstraint(fields=('campaign', 'contact', 'line_number'), name='outmsg_unique_contact_line'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-17 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0015_segment_audiencesnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('running', 'En curso'), ('done', 'Terminado'), ('failed', 'Fallido')], default='pending', max_length=20)),
+                ('filename', models.CharField(max_length=255)),
+                ('file_path', models.CharField(max_length=500)),
+                ('mapping', models.JSONField(default=dict)),
+                ('total', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('contacts_created', models.IntegerField(default=0)),
+                ('contacts_updated', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('error_file', models.CharField(blank=True, default='', max_length=500)),
+                ('run_processed', models.IntegerField(default=0)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=100)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -1,8 +1,14 @@
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
+from array import array
+from itertools import accumulate
 import json
+import sys
+import zlib
 
 class Subscription(models.Model):
     """Sistema de suscripciones y licencias"""
@@ -184,6 +190,15 @@ class Contact(models.Model):
     def __str__(self):
         return f"{self.name} ({self.phone})"
     
+    def template_variables(self):
+        """Variables de plantilla del contacto ({nombre}, {telefono}, ...)"""
+        return {
+            'nombre': self.name,
+            'telefono': self.phone,
+            'grupo': self.group,
+            'email': self.email,
+        }
+    
     class Meta:
         ordering = ['name']
 
@@ -215,12 +230,82 @@ class Template(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+class Segment(models.Model):
+    """
+    Audiencia guardada: definición de filtros compilada a una sola consulta.
+    
+    Las etiquetas se filtran con EXISTS sobre la tabla intermedia en lugar de
+    un JOIN + distinct(), así la consulta sirve igual para contar, encolar o
+    congelar la audiencia (AudienceSnapshot).
+    """
+    FILTER_CHOICES = [
+        ('all', 'Todos los contactos'),
+        ('groups', 'Por grupos'),
+        ('tags', 'Por etiquetas'),
+        ('custom', 'Selección manual'),
+    ]
+    name = models.CharField(max_length=200, blank=True, default='')
+    filter_type = models.CharField(max_length=20, choices=FILTER_CHOICES, default='all')
+    groups = models.JSONField(default=list, blank=True)  # nombres de grupo
+    tags = models.JSONField(default=list, blank=True)  # ids de Tag (cualquiera de ellas)
+    contacts = models.JSONField(default=list, blank=True)  # ids de Contact (selección manual)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.name or f"Segmento {self.pk} ({self.get_filter_type_display()})"
+    
+    @classmethod
+    def from_filters(cls, filter_type='all', groups=None, tags=None, contacts=None, name=''):
+        """
+        Segmento (sin guardar) a partir de los filtros de un formulario.
+        Un filtro sin valores seleccionados equivale a 'all'.
+        """
+        groups = [group for group in groups or [] if group]
+        tags = [int(pk) for pk in tags or [] if str(pk).isdigit()]
+        contacts = [int(pk) for pk in contacts or [] if str(pk).isdigit()]
+        if filter_type == 'groups' and groups:
+            return cls(name=name, filter_type='groups', groups=groups)
+        if filter_type == 'tags' and tags:
+            return cls(name=name, filter_type='tags', tags=tags)
+        if filter_type == 'custom' and contacts:
+            return cls(name=name, filter_type='custom', contacts=contacts)
+        return cls(name=name, filter_type='all')
+    
+    def queryset(self):
+        """Contactos opt-in del segmento (una sola consulta, sin distinct)"""
+        contacts = Contact.objects.filter(opt_in=True)
+        if self.filter_type == 'groups':
+            contacts = contacts.filter(group__in=self.groups)
+        elif self.filter_type == 'tags':
+            contacts = contacts.filter(models.Exists(
+                Contact.tags.through.objects.filter(contact_id=models.OuterRef('pk'), tag_id__in=self.tags)
+            ))
+        elif self.filter_type == 'custom':
+            contacts = contacts.filter(pk__in=self.contacts)
+        return contacts
+    
+    class Meta:
+        ordering = ['-created_at']
+
+class CacheVersion(models.Model):
+    """
+    Versión de un grupo de claves de caché (ver audience.py). Vive en la BD
+    para que todos los procesos (web y run_worker) vean el mismo número
+    aunque cada uno tenga su propia caché en memoria.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveIntegerField(default=1)
+    
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
 class Campaign(models.Model):
     name = models.CharField(max_length=200)
     template = models.ForeignKey(Template, on_delete=models.PROTECT, null=True, blank=True)  # null para envíos rápidos
     created_at = models.DateTimeField(auto_now_add=True)
     scheduled_for = models.DateTimeField(null=True, blank=True)
     created_by = models.CharField(max_length=150, default='admin')
+    segment = models.ForeignKey(Segment, on_delete=models.SET_NULL, null=True, blank=True, related_name='campaigns')  # null = todos los opt-in
     
     # Estadísticas
     total_contacts = models.IntegerField(default=0)
@@ -232,6 +317,7 @@ class Campaign(models.Model):
     batch_size = models.IntegerField(default=50)  # mensajes por bloque
     delay_between_batches = models.IntegerField(default=60)  # segundos entre bloques
     delay_between_messages = models.FloatField(default=6.0)  # segundos entre mensajes
+    max_attempts = models.IntegerField(default=3)  # intentos por mensaje ante fallos temporales
     
     # Estado del envío
     status = models.CharField(max_length=20, default='draft', choices=[
@@ -246,6 +332,10 @@ class Campaign(models.Model):
     def __str__(self):
         return self.name
     
+    def audience_segment(self):
+        """Segmento de la campaña (sin segmento: todos los contactos opt-in)"""
+        return self.segment or Segment(filter_type='all')
+    
     @property
     def success_rate(self):
         if self.total_contacts == 0:
@@ -255,14 +345,67 @@ class Campaign(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+class AudienceSnapshot(models.Model):
+    """
+    Audiencia congelada al lanzar una campaña: los ids de los contactos del
+    segmento en ese momento. Los encolados (y sus reanudaciones) recorren esta
+    lista en lugar de volver a ejecutar los filtros.
+    
+    Los ids se guardan ordenados como diferencias sucesivas (int64
+    little-endian) comprimidas con zlib: 100k contactos consecutivos ocupan
+    unos cientos de bytes.
+    """
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='audience_snapshots')
+    segment = models.ForeignKey(Segment, on_delete=models.SET_NULL, null=True, blank=True, related_name='snapshots')
+    contact_count = models.IntegerField(default=0)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Audiencia de {self.campaign} ({self.contact_count} contactos)"
+    
+    @classmethod
+    def capture(cls, campaign, segment):
+        """Congela los contactos actuales de `segment` para `campaign`"""
+        ids = list(segment.queryset().order_by('pk').values_list('pk', flat=True))
+        return cls.objects.create(
+            campaign=campaign,
+            segment=segment if segment.pk else None,
+            contact_count=len(ids),
+            data=cls.pack_ids(ids),
+        )
+    
+    def contact_ids(self):
+        """Ids de los contactos, en orden ascendente"""
+        return self.unpack_ids(self.data)
+    
+    @staticmethod
+    def pack_ids(ids):
+        deltas = array('q', (pk - prev for prev, pk in zip([0] + ids, ids)))
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+        return zlib.compress(deltas.tobytes())
+    
+    @staticmethod
+    def unpack_ids(data):
+        deltas = array('q')
+        deltas.frombytes(zlib.decompress(bytes(data)))
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+        return list(accumulate(deltas))
+    
+    class Meta:
+        ordering = ['-created_at']
+
 class OutgoingMessage(models.Model):
-    STATUS_CHOICES = [('pending','pending'), ('sending','sending'), ('sent','sent'), ('failed','failed'), ('cancelled','cancelled')]
+    STATUS_CHOICES = [('pending','pending'), ('sending','sending'), ('sent','sent'), ('failed','failed'), ('dead','dead'), ('cancelled','cancelled')]
     campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='messages')
     contact = models.ForeignKey(Contact, on_delete=models.CASCADE)
-    payload = models.TextField()
+    payload = models.TextField(blank=True, default='')  # vacío = se renderiza al enviar (ver render_payload)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     attempts = models.IntegerField(default=0)
     last_error = models.TextField(blank=True, null=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)  # reintento programado (backoff)
     created_at = models.DateTimeField(auto_now_add=True)
     sent_at = models.DateTimeField(null=True, blank=True)
     
@@ -274,12 +417,174 @@ class OutgoingMessage(models.Model):
     # Para envíos multi-línea (cada línea como mensaje separado)
     line_number = models.IntegerField(default=0)  # 0 = mensaje único, 1,2,3... = líneas separadas
     parent_message = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='line_messages')
+    
+    # Reclamo por parte de un worker (permite varios procesos en paralelo)
+    claimed_by = models.CharField(max_length=100, blank=True, default='')  # host:pid del worker
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # el worker la renueva mientras vive
 
     def __str__(self):
         return f"{self.contact.phone} - {self.status}"
     
+    def render_payload(self, constants=None):
+        """
+        Texto a enviar. Los mensajes encolados con renderizado diferido no
+        guardan el texto: se genera aquí con la plantilla actual de la campaña
+        y los datos actuales del contacto.
+        """
+        if self.payload or not self.campaign.template_id:
+            return self.payload
+        from .utils import process_template
+        return process_template(self.campaign.template.content, self.contact.template_variables(), constants)
+    
     class Meta:
         ordering = ['-created_at', 'line_number']
+        indexes = [
+            models.Index(fields=['campaign', 'status'], name='outmsg_campaign_status_idx'),
+        ]
+        constraints = [
+            # Volver a encolar una campaña no duplica mensajes (ver enqueue.py)
+            models.UniqueConstraint(fields=['campaign', 'contact', 'line_number'], name='outmsg_unique_contact_line'),
+        ]
+
+class EnqueueJob(models.Model):
+    """Encolado de una campaña en segundo plano (ver whatsapp/jobs.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('running', 'En curso'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ]
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='enqueue_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    # Qué encolar
+    audience = models.JSONField(default=dict, blank=True)  # {'snapshot': id} (o filtros: {'filter': 'all'|'groups'|'custom', ...})
+    text = models.TextField(blank=True, default='')  # vacío = plantilla de la campaña
+    send_mode = models.CharField(max_length=20, default='single')  # single o multiline
+    attachment_path = models.CharField(max_length=500, blank=True, null=True)
+    attachment_type = models.CharField(max_length=50, blank=True, null=True)
+    
+    # Progreso (se guarda en la misma transacción que cada bloque de mensajes)
+    total = models.IntegerField(default=0)  # contactos de la audiencia al crear el job
+    processed = models.IntegerField(default=0)  # contactos ya encolados
+    messages_created = models.IntegerField(default=0)
+    last_contact_id = models.IntegerField(default=0)  # cursor para reanudar
+    run_processed = models.IntegerField(default=0)  # processed al empezar la ejecución actual
+    
+    claimed_by = models.CharField(max_length=100, blank=True, default='')  # host:pid que lo ejecuta
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # quien lo ejecuta lo renueva mientras vive
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # cambia con cada bloque
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Encolado {self.campaign} ({self.status})"
+    
+    @property
+    def is_active(self):
+        return self.status in ('pending', 'running')
+    
+    def progress(self):
+        """Progreso para la UI/API: porcentaje, contactos por segundo y ETA"""
+        rate = 0.0
+        if self.started_at and self.processed > self.run_processed:
+            elapsed = (self.updated_at - self.started_at).total_seconds()
+            if elapsed > 0:
+                rate = (self.processed - self.run_processed) / elapsed
+        remaining = max(0, self.total - self.processed)
+        eta = None
+        if self.status == 'done':
+            eta = 0
+        elif rate:
+            eta = round(remaining / rate)
+        return {
+            'id': self.pk,
+            'campaign': self.campaign_id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'messages': self.messages_created,
+            'percent': round(self.processed / self.total * 100, 1) if self.total else (100.0 if self.status == 'done' else 0.0),
+            'rate': round(rate, 1),
+            'eta_seconds': eta,
+            'error': self.error,
+        }
+    
+    class Meta:
+        ordering = ['-created_at']
+
+class ImportJob(models.Model):
+    """Importación de contactos desde un archivo en segundo plano (ver whatsapp/jobs.py)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('running', 'En curso'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    # Qué importar
+    filename = models.CharField(max_length=255)  # nombre original (la extensión decide el formato)
+    file_path = models.CharField(max_length=500)  # copia en IMPORT_STAGING_DIR (ver staging.py)
+    mapping = models.JSONField(default=dict)  # importer.ColumnMapping.as_dict()
+    
+    # Progreso (se guarda en la misma transacción que cada bloque de contactos)
+    total = models.IntegerField(default=0)  # filas estimadas del archivo
+    processed = models.IntegerField(default=0)  # filas ya confirmadas: cursor para reanudar
+    contacts_created = models.IntegerField(default=0)
+    contacts_updated = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    error_file = models.CharField(max_length=500, blank=True, default='')  # CSV fila,error
+    run_processed = models.IntegerField(default=0)  # processed al empezar la ejecución actual
+    
+    claimed_by = models.CharField(max_length=100, blank=True, default='')  # host:pid que lo ejecuta
+    lease_expires_at = models.DateTimeField(null=True, blank=True)  # quien lo ejecuta lo renueva mientras vive
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # cambia con cada bloque
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Importación {self.filename} ({self.status})"
+    
+    @property
+    def is_active(self):
+        return self.status in ('pending', 'running')
+    
+    def progress(self):
+        """Progreso para la UI/API: filas por segundo, creados, actualizados y errores"""
+        rate = 0.0
+        if self.started_at and self.processed > self.run_processed:
+            elapsed = (self.updated_at - self.started_at).total_seconds()
+            if elapsed > 0:
+                rate = (self.processed - self.run_processed) / elapsed
+        total = max(self.total, self.processed)
+        eta = None
+        if self.status == 'done':
+            eta = 0
+        elif rate:
+            eta = round((total - self.processed) / rate)
+        return {
+            'id': self.pk,
+            'filename': self.filename,
+            'status': self.status,
+            'total': total,
+            'processed': self.processed,
+            'created': self.contacts_created,
+            'updated': self.contacts_updated,
+            'errors': self.error_count,
+            'percent': round(self.processed / total * 100, 1) if total else (100.0 if self.status == 'done' else 0.0),
+            'rate': round(rate, 1),
+            'eta_seconds': eta,
+            'error': self.error,
+        }
+    
+    class Meta:
+        ordering = ['-created_at']
 
 class Rule(models.Model):
     """Reglas de respuestas automáticas"""
@@ -431,3 +736,12 @@ class Attachment(models.Model):
     
     class Meta:
         ordering = ['-uploaded_at']
+
+
+# Los conteos de audiencia en caché dependen de contactos y etiquetas (ver audience.py)
+@receiver([post_save, post_delete], sender=Contact)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver(m2m_changed, sender=Contact.tags.through)
+def invalidate_audience_estimates(sender, **kwargs):
+    from .audience import invalidate_audience_cache
+    invalidate_audience_cache()
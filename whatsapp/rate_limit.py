@@ -0,0 +1,111 @@
+"""
+Limitador de velocidad de envío por campaña (token bucket).
+
+Cada campaña tiene un "cubo" que se rellena a `send_speed` mensajes por
+minuto y admite una ráfaga de hasta `burst` mensajes. El worker consume
+un token antes de cada envío y solo espera el tiempo que falta para el
+siguiente token, de modo que el tiempo gastado en la BD o en la llamada
+HTTP ya cuenta como parte de la pausa y la velocidad real coincide con
+la configurada.
+"""
+import time
+
+
+class TokenBucket:
+    """Token bucket clásico sobre un reloj monótono"""
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        """
+        Args:
+            rate: Tokens por segundo (None = sin límite)
+            capacity: Máximo de tokens acumulables (ráfaga permitida)
+            clock: Función de reloj (inyectable para pruebas)
+        """
+        self.clock = clock
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = clock()
+
+    def configure(self, rate, capacity):
+        """Cambia velocidad/ráfaga conservando los tokens acumulados"""
+        self._refill()
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self):
+        now = self.clock()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Consume tokens si hay suficientes. Devuelve True si se consumieron."""
+        if not self.rate:
+            return True
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def time_until_available(self, tokens=1):
+        """Segundos que faltan para disponer de `tokens` (0 si ya están)"""
+        if not self.rate:
+            return 0.0
+        self._refill()
+        missing = tokens - self.tokens
+        return max(0.0, missing / self.rate)
+
+
+def campaign_rate(campaign):
+    """
+    Velocidad de la campaña en mensajes por segundo.
+
+    Usa `send_speed` (mensajes/minuto). Si no está configurado, se deriva de
+    `delay_between_messages`. None significa sin límite.
+    """
+    if campaign.send_speed and campaign.send_speed > 0:
+        return campaign.send_speed / 60.0
+    if campaign.delay_between_messages and campaign.delay_between_messages > 0:
+        return 1.0 / campaign.delay_between_messages
+    return None
+
+
+class CampaignRateLimiter:
+    """Registro de token buckets, uno por campaña"""
+
+    def __init__(self, share=1.0, burst=1, clock=time.monotonic):
+        """
+        Args:
+            share: Fracción de la velocidad que corresponde a este proceso
+                   (con N workers en paralelo cada uno aplica 1/N)
+            burst: Mensajes que se pueden enviar seguidos sin pausa
+        """
+        self.share = share
+        self.burst = burst
+        self.clock = clock
+        self.buckets = {}
+
+    def bucket_for(self, campaign):
+        """Devuelve el bucket de la campaña, ajustado a su configuración actual"""
+        rate = campaign_rate(campaign)
+        if rate is not None:
+            rate *= self.share
+        bucket = self.buckets.get(campaign.pk)
+        if bucket is None:
+            bucket = self.buckets[campaign.pk] = TokenBucket(rate, self.burst, clock=self.clock)
+        elif bucket.rate != rate:
+            bucket.configure(rate, self.burst)
+        return bucket
+
+    def try_acquire(self, campaign):
+        return self.bucket_for(campaign).try_acquire()
+
+    def time_until_available(self, campaign):
+        return self.bucket_for(campaign).time_until_available()
+
+    def forget(self, campaign_id):
+        """Libera el bucket de una campaña que ya no está activa"""
+        self.buckets.pop(campaign_id, None)
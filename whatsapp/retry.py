@@ -0,0 +1,64 @@
+"""
+Política de reintentos de envío.
+
+Un fallo temporal (servicio caído, WhatsApp sin conectar, timeout, HTTP 5xx)
+no marca el mensaje como fallido: vuelve a 'pending' con `next_attempt_at`
+en el futuro, calculado con backoff exponencial y jitter. Cuando se agotan
+los `max_attempts` de la campaña pasa a 'dead' (dead-letter). Los errores
+permanentes siguen marcándose como 'failed' de inmediato.
+
+Con el circuito abierto (ERROR_CIRCUIT_OPEN) el mensaje ni siquiera llegó
+al servicio: vuelve a la cola para cuando toque comprobar /health y no
+gasta un intento, así un corte del servicio no lleva mensajes a 'dead'.
+"""
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .send_adapter import ERROR_CIRCUIT_OPEN, breaker, is_transient_error
+
+# Backoff: 30s, 60s, 120s... hasta 1 hora
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+
+def backoff_delay(attempts, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS, rand=random.random):
+    """
+    Segundos de espera antes del siguiente intento.
+
+    Exponencial sobre el número de intentos ya hechos, con jitter entre el
+    50% y el 100% del valor para que los reintentos de muchos mensajes no
+    lleguen todos a la vez al servicio.
+    """
+    delay = min(cap, base * 2 ** max(0, attempts - 1))
+    return delay / 2 + rand() * delay / 2
+
+
+def apply_failure(msg, info, max_attempts, now=None):
+    """
+    Actualiza `msg` tras un envío fallido según la política de reintentos.
+
+    Returns:
+        Contador de la campaña a incrementar ('failed_count') o None si el
+        mensaje queda programado para reintento
+    """
+    now = now or timezone.now()
+    msg.last_error = info
+    if str(info).startswith(ERROR_CIRCUIT_OPEN):
+        # El reclamo ya sumó el intento: se devuelve
+        msg.status = 'pending'
+        msg.claimed_by = ''
+        msg.attempts = max(0, msg.attempts - 1)
+        msg.next_attempt_at = now + timedelta(seconds=breaker.seconds_until_probe())
+        return None
+
+    if is_transient_error(info) and msg.attempts < max_attempts:
+        msg.status = 'pending'
+        msg.claimed_by = ''
+        msg.next_attempt_at = now + timedelta(seconds=backoff_delay(msg.attempts))
+        return None
+
+    msg.status = 'dead' if is_transient_error(info) else 'failed'
+    msg.next_attempt_at = None
+    return 'failed_count'
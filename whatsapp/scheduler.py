@@ -0,0 +1,70 @@
+"""
+Planificador de campañas para el worker.
+
+En lugar de dormir con time.sleep() cuando una campaña llega al final de
+un bloque (o cuando su token bucket está vacío), el worker apunta la
+"próxima hora elegible" de esa campaña y pasa a la siguiente que esté
+lista. Así las pausas de una campaña no frenan a las demás.
+"""
+import heapq
+import time
+
+
+class CampaignScheduler:
+    """Lleva la próxima hora elegible y el progreso de bloque de cada campaña"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.next_eligible = {}  # campaign_id -> instante (reloj monótono)
+        self.batch_sent = {}     # campaign_id -> mensajes enviados en el bloque actual
+
+    def sync(self, campaign_ids):
+        """Registra campañas nuevas (elegibles ya) y olvida las que dejaron de estar activas"""
+        now = self.clock()
+        for campaign_id in list(self.next_eligible):
+            if campaign_id not in campaign_ids:
+                self.forget(campaign_id)
+        for campaign_id in campaign_ids:
+            self.next_eligible.setdefault(campaign_id, now)
+            self.batch_sent.setdefault(campaign_id, 0)
+
+    def forget(self, campaign_id):
+        self.next_eligible.pop(campaign_id, None)
+        self.batch_sent.pop(campaign_id, None)
+
+    def ready(self):
+        """IDs de campañas elegibles ahora, de la que más tiempo lleva esperando a la que menos"""
+        now = self.clock()
+        heap = [(at, cid) for cid, at in self.next_eligible.items() if at <= now]
+        heapq.heapify(heap)
+        return [heapq.heappop(heap)[1] for _ in range(len(heap))]
+
+    def seconds_until_next(self):
+        """Segundos hasta que alguna campaña vuelva a ser elegible (None si no hay campañas)"""
+        if not self.next_eligible:
+            return None
+        return max(0.0, min(self.next_eligible.values()) - self.clock())
+
+    def defer(self, campaign_id, seconds):
+        """La campaña no vuelve a ser elegible hasta dentro de `seconds`"""
+        self.next_eligible[campaign_id] = self.clock() + max(0.0, seconds)
+
+    def batch_remaining(self, campaign):
+        """Mensajes que aún caben en el bloque actual de la campaña"""
+        return max(0, campaign.batch_size - self.batch_sent.get(campaign.pk, 0))
+
+    def record_sent(self, campaign, count=1):
+        """
+        Suma mensajes enviados al bloque actual.
+
+        Returns:
+            True si el bloque se completó (la campaña queda en pausa
+            `delay_between_batches` segundos)
+        """
+        sent = self.batch_sent.get(campaign.pk, 0) + count
+        if sent >= campaign.batch_size:
+            self.batch_sent[campaign.pk] = 0
+            self.defer(campaign.pk, campaign.delay_between_batches)
+            return True
+        self.batch_sent[campaign.pk] = sent
+        return False
@@ -1,7 +1,10 @@
+import asyncio
+import threading
 import time
 import logging
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -10,7 +13,148 @@ logger = logging.getLogger(__name__)
 WHATSAPP_SERVICE_URL = os.getenv('WHATSAPP_SERVICE_URL', 'http://localhost:3000')
 USE_REAL_WHATSAPP = os.getenv('USE_REAL_WHATSAPP', 'false').lower() == 'true'
 
-def send_message(phone, text, attachment_path=None, attachment_type=None):
+# Máximo de envíos simultáneos (en vuelo) por backend en el modo asíncrono
+MAX_IN_FLIGHT = {
+    'webjs': int(os.getenv('WHATSAPP_WEBJS_MAX_IN_FLIGHT', '8')),
+    'simulated': int(os.getenv('WHATSAPP_SIMULATED_MAX_IN_FLIGHT', '50')),
+}
+
+# Timeouts HTTP (conexión, lectura) en segundos. La conexión falla rápido si el
+# servicio está caído; la lectura cubre lo que tarda WhatsApp en confirmar.
+CONNECT_TIMEOUT = float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', '3'))
+SEND_TIMEOUT = (CONNECT_TIMEOUT, float(os.getenv('WHATSAPP_READ_TIMEOUT', '15')))
+MEDIA_TIMEOUT = (CONNECT_TIMEOUT, float(os.getenv('WHATSAPP_MEDIA_READ_TIMEOUT', '30')))
+STATUS_TIMEOUT = (CONNECT_TIMEOUT, 5)
+
+# Envío por lotes (/send-batch): mensajes por petición y tiempo extra de
+# lectura por mensaje (el servicio los envía uno tras otro)
+MAX_BATCH_SIZE = int(os.getenv('WHATSAPP_MAX_BATCH_SIZE', '50'))
+BATCH_ITEM_READ_TIMEOUT = 2
+
+_session = None
+_session_pool_size = 0
+_session_pid = None
+_session_lock = threading.Lock()
+_batch_supported = None
+
+# Latencia simulada por mensaje (segundos)
+SIMULATED_LATENCY = 0.5
+
+# Errores temporales: el mismo mensaje puede salir bien más tarde
+ERROR_NOT_CONNECTED = "WhatsApp no está conectado. Escanea el QR code."
+ERROR_UNREACHABLE = "No se pudo conectar al servicio WhatsApp"
+ERROR_TIMEOUT = "Timeout al enviar mensaje a WhatsApp"
+ERROR_CIRCUIT_OPEN = "Servicio WhatsApp no disponible (circuito abierto)"
+# El servicio responde 422 a los errores permanentes (número sin WhatsApp,
+# archivo inexistente) y 500 a los temporales, tanto en /send y /send-media
+# como en cada resultado de /send-batch: 'HTTP 4xx' es permanente, 'HTTP 5xx' temporal
+TRANSIENT_ERROR_PREFIXES = (ERROR_NOT_CONNECTED, ERROR_UNREACHABLE, ERROR_TIMEOUT, ERROR_CIRCUIT_OPEN, 'HTTP 5')
+
+# Circuit breaker: fallos seguidos (servicio caído o 503) que abren el circuito
+# y espera inicial/máxima entre comprobaciones de /health mientras está abierto
+BREAKER_THRESHOLD = int(os.getenv('WHATSAPP_BREAKER_THRESHOLD', '5'))
+BREAKER_PROBE_SECONDS = 5
+BREAKER_PROBE_MAX_SECONDS = 120
+
+class CircuitBreaker:
+    """
+    Deja de llamar al servicio WhatsApp mientras está caído o sin sesión.
+
+    Tras `threshold` fallos seguidos de conexión o 503 el circuito se abre:
+    los envíos fallan al instante con ERROR_CIRCUIT_OPEN (error temporal, el
+    mensaje se reintenta más tarde) y run_worker deja de reclamar mensajes.
+    Mientras está abierto se consulta /health con backoff exponencial; cuando
+    el servicio responde 'ready' el circuito se cierra y se reanuda el envío.
+    """
+
+    def __init__(self, probe, threshold=BREAKER_THRESHOLD, probe_seconds=BREAKER_PROBE_SECONDS,
+                 max_probe_seconds=BREAKER_PROBE_MAX_SECONDS, clock=time.monotonic):
+        self.probe = probe
+        self.threshold = threshold
+        self.probe_seconds = probe_seconds
+        self.max_probe_seconds = max_probe_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened = False
+        self.backoff = probe_seconds
+        self.next_probe = 0
+        self._lock = threading.Lock()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if not self.opened and self.failures >= self.threshold:
+                self.opened = True
+                self.backoff = self.probe_seconds
+                self.next_probe = self.clock() + self.backoff
+                logger.warning(f"[WhatsApp] ⚡ Circuito abierto tras {self.failures} fallos seguidos")
+
+    def is_open(self):
+        """True si hay que evitar el servicio. Comprueba /health cuando toca."""
+        with self._lock:
+            if not self.opened or self.clock() < self.next_probe:
+                return self.opened
+            # Solo un hilo hace la comprobación; el resto sigue viendo el circuito abierto
+            self.next_probe = self.clock() + self.backoff
+
+        ready = False
+        try:
+            ready = self.probe()
+        except Exception:
+            pass
+
+        with self._lock:
+            if ready:
+                self.opened = False
+                self.failures = 0
+                logger.info("[WhatsApp] ⚡ Servicio disponible, circuito cerrado")
+            else:
+                self.backoff = min(self.max_probe_seconds, self.backoff * 2)
+                self.next_probe = self.clock() + self.backoff
+            return self.opened
+
+    def seconds_until_probe(self):
+        """Segundos hasta la próxima comprobación de /health (0 si está cerrado)"""
+        if not self.opened:
+            return 0.0
+        return max(0.0, self.next_probe - self.clock())
+
+def _service_ready():
+    response = get_session().get(f"{WHATSAPP_SERVICE_URL}/health", timeout=STATUS_TIMEOUT)
+    return response.status_code == 200 and response.json().get('status') == 'ready'
+
+breaker = CircuitBreaker(probe=_service_ready)
+
+def get_backend():
+    """Nombre del backend de envío activo"""
+    return 'webjs' if USE_REAL_WHATSAPP else 'simulated'
+
+def get_session(pool_size=None):
+    """
+    Sesión HTTP compartida con el servicio WhatsApp.
+
+    Reutiliza conexiones keep-alive en lugar de abrir una conexión TCP por
+    petición. El pool admite `pool_size` conexiones simultáneas (por defecto
+    MAX_IN_FLIGHT de webjs); si se pide uno mayor, el pool se amplía. Cada
+    proceso crea su propia sesión (no se comparten sockets tras un fork).
+    """
+    global _session, _session_pool_size, _session_pid
+    pool_size = max(pool_size or 0, MAX_IN_FLIGHT['webjs'])
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session, _session_pool_size, _session_pid = requests.Session(), 0, os.getpid()
+        if pool_size > _session_pool_size:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pool_size = pool_size
+        return _session
+
+def send_message(phone, text, attachment_path=None, attachment_type=None, idempotency_key=None):
     """
     Adapter para envío de mensajes vía WhatsApp Web.js o simulado.
     
@@ -19,20 +163,94 @@ def send_message(phone, text, attachment_path=None, attachment_type=None):
         text: Texto del mensaje
         attachment_path: Ruta al archivo adjunto (opcional)
         attachment_type: Tipo de adjunto: image, video, audio, document (opcional)
+        idempotency_key: Clave única del mensaje. Si el servicio ya envió un
+            mensaje con esa clave devuelve el resultado anterior sin reenviarlo
     
     Returns:
         (success: bool, info: str)
     """
     if USE_REAL_WHATSAPP:
-        return _send_via_whatsapp_webjs(phone, text, attachment_path, attachment_type)
+        return _send_via_whatsapp_webjs(phone, text, attachment_path, attachment_type, idempotency_key)
     else:
         return _send_simulated(phone, text, attachment_path, attachment_type)
 
+async def send_message_async(phone, text, attachment_path=None, attachment_type=None,
+                             idempotency_key=None, executor=None):
+    """
+    Versión asyncio de send_message.
+    
+    El envío real (requests, bloqueante) se ejecuta en `executor` para no
+    detener el event loop; el simulado espera con asyncio.sleep.
+    
+    Returns:
+        (success: bool, info: str)
+    """
+    if USE_REAL_WHATSAPP:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, _send_via_whatsapp_webjs, phone, text, attachment_path, attachment_type, idempotency_key
+        )
+    await asyncio.sleep(SIMULATED_LATENCY)
+    return _simulated_result(phone, text, attachment_path, attachment_type)
+
+def supports_batch():
+    """True si el backend acepta varios mensajes por petición (/send-batch)"""
+    global _batch_supported
+    if not USE_REAL_WHATSAPP:
+        return True
+    if _batch_supported is None:
+        try:
+            response = get_session().get(f"{WHATSAPP_SERVICE_URL}/health", timeout=STATUS_TIMEOUT)
+            _batch_supported = 'send-batch' in response.json().get('features', [])
+        except Exception:
+            # Servicio no disponible: se vuelve a preguntar en la próxima llamada
+            return False
+    return _batch_supported
+
+def send_messages(batch):
+    """
+    Envía varios mensajes en una sola petición al servicio.
+    
+    Args:
+        batch: Lista de dicts con phone, text y opcionalmente attachment_path,
+               attachment_type e idempotency_key (mismos campos que send_message)
+    
+    Returns:
+        Lista de (success: bool, info: str) en el mismo orden que `batch`.
+        Si el servicio no soporta /send-batch se envían uno a uno.
+    """
+    if not batch:
+        return []
+    if not USE_REAL_WHATSAPP:
+        time.sleep(SIMULATED_LATENCY)
+        return [_simulated_result(m['phone'], m['text'], m.get('attachment_path'), m.get('attachment_type'))
+                for m in batch]
+    if not supports_batch():
+        return [send_message(**m) for m in batch]
+    return _send_batch_via_whatsapp_webjs(batch)
+
+async def send_messages_async(batch, executor=None):
+    """Versión asyncio de send_messages (la petición HTTP corre en `executor`)"""
+    if not batch:
+        return []
+    if USE_REAL_WHATSAPP:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, send_messages, batch)
+    await asyncio.sleep(SIMULATED_LATENCY)
+    return [_simulated_result(m['phone'], m['text'], m.get('attachment_path'), m.get('attachment_type'))
+            for m in batch]
+
+def is_transient_error(info):
+    """True si el error devuelto por send_message es temporal y vale la pena reintentar"""
+    return bool(info) and str(info).startswith(TRANSIENT_ERROR_PREFIXES)
+
 def _send_simulated(phone, text, attachment_path=None, attachment_type=None):
     """Simulación de envío (desarrollo/testing)"""
+    time.sleep(SIMULATED_LATENCY)
+    return _simulated_result(phone, text, attachment_path, attachment_type)
+
+def _simulated_result(phone, text, attachment_path=None, attachment_type=None):
     try:
-        time.sleep(0.5)
-        
         attachment_info = ""
         if attachment_path:
             attachment_info = f" + {attachment_type or 'file'}: {attachment_path}"
@@ -42,81 +260,151 @@ def _send_simulated(phone, text, attachment_path=None, attachment_type=None):
     except Exception as e:
         return False, str(e)
 
-def _send_via_whatsapp_webjs(phone, text, attachment_path=None, attachment_type=None):
+def _send_via_whatsapp_webjs(phone, text, attachment_path=None, attachment_type=None, idempotency_key=None):
     """Envío real vía WhatsApp Web.js"""
     try:
-        # Limpiar formato de teléfono (quitar + y espacios)
-        clean_phone = phone.replace('+', '').replace(' ', '').replace('-', '')
-        
+        item = _service_item(phone, text, attachment_path, attachment_type, idempotency_key)
         if attachment_path:
             # Enviar con archivo adjunto
-            url = f"{WHATSAPP_SERVICE_URL}/send-media"
-            
-            # Convertir ruta relativa a absoluta
-            if not os.path.isabs(attachment_path):
-                attachment_path = os.path.join(settings.MEDIA_ROOT, attachment_path)
-            
-            payload = {
-                'phone': clean_phone,
-                'message': text,
-                'mediaPath': attachment_path,
-                'mediaType': attachment_type
-            }
-            
-            response = requests.post(url, json=payload, timeout=30)
-            
+            data, error_msg = _post_to_service('/send-media', item, MEDIA_TIMEOUT)
         else:
             # Enviar solo texto
-            url = f"{WHATSAPP_SERVICE_URL}/send"
-            payload = {
-                'phone': clean_phone,
-                'message': text
-            }
-            
-            response = requests.post(url, json=payload, timeout=15)
+            data, error_msg = _post_to_service('/send', item, SEND_TIMEOUT)
+        if error_msg:
+            return False, error_msg
+        return _parse_send_result(data, phone, text, idempotency_key)
+    except Exception as e:
+        error_msg = f"Error inesperado: {str(e)}"
+        logger.error(f"[WhatsApp] ✗ {error_msg}")
+        return False, error_msg
+
+def _send_batch_via_whatsapp_webjs(batch):
+    """Envío real de varios mensajes por petición a /send-batch"""
+    results = []
+    for start in range(0, len(batch), MAX_BATCH_SIZE):
+        chunk = batch[start:start + MAX_BATCH_SIZE]
+        try:
+            items = [
+                _service_item(m['phone'], m['text'], m.get('attachment_path'), m.get('attachment_type'),
+                              m.get('idempotency_key'))
+                for m in chunk
+            ]
+            timeout = (CONNECT_TIMEOUT, MEDIA_TIMEOUT[1] + BATCH_ITEM_READ_TIMEOUT * len(chunk))
+            data, error_msg = _post_to_service('/send-batch', {'messages': items}, timeout)
+        except Exception as e:
+            data, error_msg = None, f"Error inesperado: {str(e)}"
+            logger.error(f"[WhatsApp] ✗ {error_msg}")
+
+        if error_msg:
+            # La petición entera falló: el mismo error para todo el lote
+            results.extend((False, error_msg) for _ in chunk)
+            continue
+
+        item_results = data.get('results') or []
+        for m, item_data in zip(chunk, item_results):
+            if item_data.get('code') == 'not_connected':
+                results.append((False, ERROR_NOT_CONNECTED))
+            elif not item_data.get('success') and item_data.get('status'):
+                # Mismo texto que si el mensaje se hubiera enviado solo por /send
+                error_msg = _http_error(item_data['status'], item_data.get('error', 'Unknown error'))
+                logger.error(f"[WhatsApp] ✗ {error_msg}")
+                results.append((False, error_msg))
+            else:
+                results.append(_parse_send_result(item_data, m['phone'], m['text'], m.get('idempotency_key')))
+        # Respuesta incompleta: lo que falta se reintenta (misma clave de idempotencia)
+        results.extend((False, "HTTP 502: respuesta de lote incompleta") for _ in chunk[len(item_results):])
+    return results
+
+def _service_item(phone, text, attachment_path=None, attachment_type=None, idempotency_key=None):
+    """Cuerpo JSON de un mensaje para el servicio WhatsApp Web.js"""
+    # Limpiar formato de teléfono (quitar + y espacios)
+    item = {
+        'phone': phone.replace('+', '').replace(' ', '').replace('-', ''),
+        'message': text,
+    }
+    if attachment_path:
+        # Convertir ruta relativa a absoluta
+        if not os.path.isabs(attachment_path):
+            attachment_path = os.path.join(settings.MEDIA_ROOT, attachment_path)
+        item['mediaPath'] = attachment_path
+        item['mediaType'] = attachment_type
+    if idempotency_key:
+        item['idempotencyKey'] = idempotency_key
+    return item
+
+def _post_to_service(path, payload, timeout):
+    """
+    POST al servicio WhatsApp Web.js.
+    
+    Returns:
+        (data, None) si respondió HTTP 200, o (None, error_msg) si no
+    """
+    if breaker.is_open():
+        return None, ERROR_CIRCUIT_OPEN
+    try:
+        response = get_session().post(f"{WHATSAPP_SERVICE_URL}{path}", json=payload, timeout=timeout)
         
         # Verificar respuesta
         if response.status_code == 200:
-            data = response.json()
-            if data.get('success'):
-                message_id = data.get('messageId', 'unknown')
-                logger.info(f"[WhatsApp] ✓ Enviado a {phone}: {text[:60]}...")
-                return True, message_id
-            else:
-                error_msg = data.get('error', 'Unknown error')
-                logger.error(f"[WhatsApp] ✗ Error: {error_msg}")
-                return False, error_msg
+            breaker.record_success()
+            return response.json(), None
         
         elif response.status_code == 503:
-            error_msg = "WhatsApp no está conectado. Escanea el QR code."
+            breaker.record_failure()
+            error_msg = ERROR_NOT_CONNECTED
             logger.warning(f"[WhatsApp] ⚠ {error_msg}")
-            return False, error_msg
+            return None, error_msg
         
         else:
-            error_msg = f"HTTP {response.status_code}: {response.text}"
+            breaker.record_success()
+            error_msg = _http_error(response.status_code, _response_error(response))
             logger.error(f"[WhatsApp] ✗ {error_msg}")
-            return False, error_msg
+            return None, error_msg
             
     except requests.exceptions.ConnectionError:
-        error_msg = f"No se pudo conectar al servicio WhatsApp en {WHATSAPP_SERVICE_URL}"
+        breaker.record_failure()
+        error_msg = f"{ERROR_UNREACHABLE} en {WHATSAPP_SERVICE_URL}"
         logger.error(f"[WhatsApp] ✗ {error_msg}")
-        return False, error_msg
+        return None, error_msg
         
     except requests.exceptions.Timeout:
-        error_msg = "Timeout al enviar mensaje a WhatsApp"
-        logger.error(f"[WhatsApp] ✗ {error_msg}")
-        return False, error_msg
-        
-    except Exception as e:
-        error_msg = f"Error inesperado: {str(e)}"
+        error_msg = ERROR_TIMEOUT
         logger.error(f"[WhatsApp] ✗ {error_msg}")
+        return None, error_msg
+
+def _http_error(status_code, error):
+    """Texto de error de una respuesta del servicio (is_transient_error lo clasifica por el código)"""
+    return f"HTTP {status_code}: {error}"
+
+def _response_error(response):
+    """Campo 'error' del JSON de la respuesta, o el cuerpo tal cual"""
+    try:
+        data = response.json()
+    except ValueError:
+        return response.text
+    if isinstance(data, dict) and data.get('error'):
+        return data['error']
+    return response.text
+
+def _parse_send_result(data, phone, text, idempotency_key=None):
+    """Convierte la respuesta del servicio para un mensaje en (success, info)"""
+    if data.get('success'):
+        message_id = data.get('messageId', 'unknown')
+        if data.get('duplicate'):
+            logger.info(f"[WhatsApp] = Ya enviado antes a {phone} ({idempotency_key}), no se reenvía")
+        else:
+            logger.info(f"[WhatsApp] ✓ Enviado a {phone}: {text[:60]}...")
+        return True, message_id
+    else:
+        error_msg = data.get('error', 'Unknown error')
+        logger.error(f"[WhatsApp] ✗ Error: {error_msg}")
         return False, error_msg
 
 def check_whatsapp_status():
     """Verificar si el servicio WhatsApp está conectado y listo"""
     try:
         # Primero verificar salud del servicio
-        response = requests.get(f"{WHATSAPP_SERVICE_URL}/health", timeout=5)
+        response = get_session().get(f"{WHATSAPP_SERVICE_URL}/health", timeout=STATUS_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
             status_info = {
@@ -129,7 +417,7 @@ def check_whatsapp_status():
             # Si no está conectado, intentar obtener QR
             if data.get('status') != 'ready':
                 try:
-                    qr_response = requests.get(f"{WHATSAPP_SERVICE_URL}/qr", timeout=5)
+                    qr_response = get_session().get(f"{WHATSAPP_SERVICE_URL}/qr", timeout=STATUS_TIMEOUT)
                     if qr_response.status_code == 200:
                         qr_data = qr_response.json()
                         if qr_data.get('qr'):
@@ -150,7 +438,7 @@ def check_whatsapp_status():
 def get_qr_code():
     """Obtener QR code para autenticación"""
     try:
-        response = requests.get(f"{WHATSAPP_SERVICE_URL}/qr", timeout=5)
+        response = get_session().get(f"{WHATSAPP_SERVICE_URL}/qr", timeout=STATUS_TIMEOUT)
         if response.status_code == 200:
             return response.json()
     except:
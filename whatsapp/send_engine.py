@@ -0,0 +1,219 @@
+"""
+Motores de envío usados por run_worker.
+
+Ambos exponen la misma interfaz para que el worker no distinga el modo:
+
+    engine.has_capacity()          -> ¿se puede enviar otro mensaje ya?
+    engine.submit(key, phone, ...) -> inicia el envío
+    engine.results(timeout)        -> [(key, success, info), ...] terminados
+
+- SyncSendEngine: envía dentro de submit(), como el worker clásico.
+- AsyncSendEngine: event loop asyncio en un hilo propio con un límite de
+  mensajes en vuelo por backend. Un timeout de 15-30 s en un envío ya no
+  bloquea al resto; el rendimiento queda limitado por la velocidad del
+  proveedor y no por la latencia de cada petición HTTP.
+
+Los mensajes de un mismo teléfono se envían siempre en orden (importante
+para los envíos multi-línea).
+
+Con batch_size > 1 ambos motores agrupan los mensajes recibidos y los
+envían con send_adapter.send_messages (una petición a /send-batch por
+lote). Un lote sale al llenarse o al pedir resultados con results()
+(salvo con send_partial=False, que solo recoge lo ya terminado).
+"""
+import asyncio
+import contextlib
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import send_adapter
+
+
+def _batch_item(phone, text, attachment_path, attachment_type, idempotency_key):
+    return {
+        'phone': phone,
+        'text': text,
+        'attachment_path': attachment_path,
+        'attachment_type': attachment_type,
+        'idempotency_key': idempotency_key,
+    }
+
+
+class SyncSendEngine:
+    """Envío secuencial: cada submit() (o cada lote) espera la respuesta del proveedor"""
+
+    def __init__(self, batch_size=1):
+        self.batch_size = max(1, batch_size)
+        self._done = []
+        self._batch = []  # [(key, item)] pendientes de enviar en lote
+
+    @property
+    def in_flight(self):
+        return 0
+
+    def has_capacity(self):
+        return True
+
+    def submit(self, key, phone, text, attachment_path=None, attachment_type=None, idempotency_key=None):
+        if self.batch_size > 1:
+            self._batch.append((key, _batch_item(phone, text, attachment_path, attachment_type, idempotency_key)))
+            if len(self._batch) >= self.batch_size:
+                self._send_batch()
+            return
+        try:
+            success, info = send_adapter.send_message(
+                phone, text, attachment_path=attachment_path, attachment_type=attachment_type,
+                idempotency_key=idempotency_key
+            )
+        except Exception as e:
+            success, info = False, str(e)
+        self._done.append((key, success, info))
+
+    def _send_batch(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        try:
+            results = send_adapter.send_messages([item for _, item in batch])
+        except Exception as e:
+            results = [(False, str(e))] * len(batch)
+        self._done.extend((key, success, info) for (key, _), (success, info) in zip(batch, results))
+
+    def results(self, timeout=0, send_partial=True):
+        if send_partial:
+            self._send_batch()
+        done, self._done = self._done, []
+        if not done and timeout:
+            time.sleep(timeout)
+        return done
+
+    def close(self, timeout=None):
+        return self.results()
+
+
+class AsyncSendEngine:
+    """Envío concurrente con asyncio y un máximo de mensajes en vuelo por backend"""
+
+    def __init__(self, max_in_flight=None, batch_size=1):
+        """
+        Args:
+            max_in_flight: Límite de envíos simultáneos. None = el configurado
+                           para el backend activo en send_adapter.MAX_IN_FLIGHT
+            batch_size: Mensajes por petición (1 = sin lotes). Un lote en
+                        vuelo ocupa un solo lugar del límite de peticiones
+        """
+        self.backend = send_adapter.get_backend()
+        self.batch_size = max(1, batch_size)
+        self._batch = []
+        self.max_in_flight = max_in_flight or send_adapter.MAX_IN_FLIGHT.get(self.backend, 8)
+        # Una conexión keep-alive por envío en vuelo
+        send_adapter.get_session(pool_size=self.max_in_flight)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._done = queue.Queue()
+        self._semaphores = {}
+        self._phone_locks = {}  # phone -> [asyncio.Lock, usuarios]
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='send')
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='send-engine', daemon=True)
+        self._thread.start()
+
+    def has_capacity(self):
+        return self.in_flight < self.max_in_flight * self.batch_size
+
+    def submit(self, key, phone, text, attachment_path=None, attachment_type=None, idempotency_key=None):
+        with self._lock:
+            self.in_flight += 1
+        if self.batch_size > 1:
+            self._batch.append((key, _batch_item(phone, text, attachment_path, attachment_type, idempotency_key)))
+            if len(self._batch) >= self.batch_size:
+                self._dispatch_batch()
+            return
+        asyncio.run_coroutine_threadsafe(
+            self._send(key, phone, text, attachment_path, attachment_type, idempotency_key), self._loop
+        )
+
+    def _dispatch_batch(self):
+        batch, self._batch = self._batch, []
+        if batch:
+            asyncio.run_coroutine_threadsafe(self._send_batch(batch), self._loop)
+
+    def results(self, timeout=0, send_partial=True):
+        """Resultados terminados. Espera hasta `timeout` s a que llegue el primero."""
+        if send_partial:
+            self._dispatch_batch()
+        done = []
+        try:
+            if timeout and self.in_flight:
+                done.append(self._done.get(timeout=timeout))
+            while True:
+                done.append(self._done.get_nowait())
+        except queue.Empty:
+            pass
+        if not done and timeout and not self.in_flight:
+            time.sleep(timeout)
+        return done
+
+    def close(self, timeout=30):
+        """Espera (hasta `timeout` s) a los envíos en curso y detiene el event loop"""
+        done = []
+        deadline = time.monotonic() + (timeout or 0)
+        while self.in_flight and time.monotonic() < deadline:
+            done.extend(self.results(timeout=min(1.0, deadline - time.monotonic())))
+        done.extend(self.results())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
+        return done
+
+    def _semaphore(self):
+        semaphore = self._semaphores.get(self.backend)
+        if semaphore is None:
+            semaphore = self._semaphores[self.backend] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+
+    @contextlib.asynccontextmanager
+    async def _phones_locked(self, phones):
+        """Bloquea los teléfonos dados (en orden fijo, sin interbloqueos)"""
+        entries = [self._phone_locks.setdefault(phone, [asyncio.Lock(), 0]) for phone in sorted(phones)]
+        for entry in entries:
+            entry[1] += 1
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                for entry in entries:
+                    await stack.enter_async_context(entry[0])
+                yield
+        finally:
+            for phone, entry in zip(sorted(phones), entries):
+                entry[1] -= 1
+                if not entry[1]:
+                    self._phone_locks.pop(phone, None)
+
+    async def _send(self, key, phone, text, attachment_path, attachment_type, idempotency_key):
+        try:
+            async with self._phones_locked([phone]), self._semaphore():
+                success, info = await send_adapter.send_message_async(
+                    phone, text, attachment_path, attachment_type,
+                    idempotency_key=idempotency_key, executor=self._executor
+                )
+        except Exception as e:
+            success, info = False, str(e)
+
+        self._done.put((key, success, info))
+        with self._lock:
+            self.in_flight -= 1
+
+    async def _send_batch(self, batch):
+        items = [item for _, item in batch]
+        try:
+            async with self._phones_locked({item['phone'] for item in items}), self._semaphore():
+                results = await send_adapter.send_messages_async(items, executor=self._executor)
+        except Exception as e:
+            results = [(False, str(e))] * len(batch)
+
+        for (key, _), (success, info) in zip(batch, results):
+            self._done.put((key, success, info))
+        with self._lock:
+            self.in_flight -= len(batch)
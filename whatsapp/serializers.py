@@ -44,6 +44,7 @@ class OutgoingMessageSerializer(serializers.ModelSerializer):
     contact_name = serializers.CharField(source='contact.name', read_only=True)
     contact_phone = serializers.CharField(source='contact.phone', read_only=True)
     campaign_name = serializers.CharField(source='campaign.name', read_only=True)
+    text = serializers.CharField(source='render_payload', read_only=True)  # payload o texto renderizado
     
     class Meta:
         model = OutgoingMessage
@@ -0,0 +1,89 @@
+"""
+Archivos subidos para importar, guardados en disco entre pasos.
+
+La importación con mapeo de columnas necesita el archivo en dos peticiones
+(vista previa y luego importar). En lugar de guardarlo en la sesión (en
+base64, dentro de la fila de sesión en cada petición) se copia a
+IMPORT_STAGING_DIR con un token aleatorio como nombre y la sesión solo
+guarda el token.
+
+Los archivos que nadie reclama se borran pasado IMPORT_STAGING_TTL
+segundos (cleanup_staged() se llama en cada subida). Con varios servidores
+web IMPORT_STAGING_DIR tiene que ser un directorio compartido.
+"""
+import logging
+import os
+import re
+import secrets
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+STAGING_DIR = os.getenv(
+    'IMPORT_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'whatsapp_imports')
+)
+STAGING_TTL = int(os.getenv('IMPORT_STAGING_TTL', str(6 * 3600)))
+_TOKEN_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def stage_upload(upload):
+    """
+    Guarda un archivo subido (UploadedFile) en el directorio de staging.
+
+    Returns:
+        token del archivo (para staged_path / discard_upload)
+    """
+    cleanup_staged()
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    token = secrets.token_urlsafe(18)
+    path = _path(token, upload.name)
+    with open(path, 'wb') as out:
+        for chunk in upload.chunks():
+            out.write(chunk)
+    return token
+
+
+def staged_path(token, filename):
+    """Ruta del archivo del token, o None si no existe (caducó o token inválido)"""
+    if not token or not _TOKEN_RE.match(token):
+        return None
+    path = _path(token, filename)
+    return path if os.path.exists(path) else None
+
+
+def discard_upload(token, filename):
+    """Borra el archivo del token (si existe)"""
+    path = staged_path(token, filename)
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cleanup_staged(ttl=None):
+    """Borra los archivos con más de `ttl` segundos (por defecto IMPORT_STAGING_TTL)"""
+    ttl = STAGING_TTL if ttl is None else ttl
+    limit = time.time() - ttl
+    try:
+        entries = list(os.scandir(STAGING_DIR))
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < limit:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info('Importaciones: %s archivos caducados borrados', removed)
+    return removed
+
+
+def _path(token, filename):
+    # La extensión decide el formato al leerlo (csv / xlsx)
+    extension = os.path.splitext(filename or '')[1].lower()
+    return os.path.join(STAGING_DIR, token + extension)
@@ -0,0 +1,260 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+from django.utils import timezone
+
+from .claiming import claim_messages, reap_expired_leases, release_messages
+from .enqueue import enqueue_campaign
+from .models import Campaign, Contact, OutgoingMessage, Template
+from .retry import apply_failure
+from .send_adapter import ERROR_CIRCUIT_OPEN, ERROR_NOT_CONNECTED
+from .utils import _texto_celda, limpiar_telefono, limpiar_telefonos
+from .writeback import StatusBuffer
+
+
+def crear_contactos(cantidad, **extra):
+    return Contact.objects.bulk_create([
+        Contact(name=f'Contacto {i}', phone=f'+5939{i:08d}', **extra) for i in range(cantidad)
+    ])
+
+
+def crear_campania(**extra):
+    template = Template.objects.create(name='Plantilla', content='Hola {nombre}')
+    return Campaign.objects.create(name='Campaña', template=template, status='sending', **extra)
+
+
+def crear_mensajes(campaign, contactos, **extra):
+    return OutgoingMessage.objects.bulk_create([
+        OutgoingMessage(campaign=campaign, contact=contact, payload=f'Hola {contact.name}', **extra)
+        for contact in contactos
+    ])
+
+
+class ClaimingTests(TestCase):
+    def setUp(self):
+        self.campaign = crear_campania(max_attempts=2)
+        self.messages = crear_mensajes(self.campaign, crear_contactos(5))
+
+    def test_claim_marca_sending_y_suma_intento(self):
+        claimed = claim_messages(self.campaign, 3, 'w1', lease_seconds=60)
+
+        self.assertEqual([m.id for m in claimed], [m.id for m in self.messages[:3]])
+        for msg in claimed:
+            self.assertEqual(msg.status, 'sending')
+            self.assertEqual(msg.claimed_by, 'w1')
+            self.assertEqual(msg.attempts, 1)
+            self.assertIsNotNone(msg.lease_expires_at)
+
+    def test_dos_workers_no_reclaman_el_mismo_mensaje(self):
+        first = claim_messages(self.campaign, 3, 'w1')
+        second = claim_messages(self.campaign, 3, 'w2')
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({m.id for m in first} & {m.id for m in second})
+        self.assertEqual(claim_messages(self.campaign, 3, 'w3'), [])
+
+    def test_no_reclama_reintentos_programados(self):
+        OutgoingMessage.objects.filter(pk=self.messages[0].pk).update(
+            next_attempt_at=timezone.now() + timedelta(minutes=5)
+        )
+        claimed = claim_messages(self.campaign, 10, 'w1')
+        self.assertNotIn(self.messages[0].pk, [m.id for m in claimed])
+
+    def test_release_devuelve_el_intento(self):
+        claimed = claim_messages(self.campaign, 2, 'w1')
+        self.assertEqual(release_messages('otro', [m.id for m in claimed]), 0)
+        self.assertEqual(release_messages('w1', [m.id for m in claimed]), 2)
+
+        msg = OutgoingMessage.objects.get(pk=claimed[0].id)
+        self.assertEqual((msg.status, msg.claimed_by, msg.attempts), ('pending', '', 0))
+
+    def test_reaper_ignora_leases_vigentes(self):
+        claim_messages(self.campaign, 5, 'w1', lease_seconds=60)
+        self.assertEqual(reap_expired_leases(), (0, 0))
+
+    def test_reaper_reencola_o_manda_a_dead(self):
+        claimed = claim_messages(self.campaign, 5, 'w1', lease_seconds=60)
+        # Uno ya agotó sus intentos (max_attempts=2)
+        OutgoingMessage.objects.filter(pk=claimed[0].id).update(attempts=2)
+
+        requeued, dead = reap_expired_leases(now=timezone.now() + timedelta(seconds=61))
+
+        self.assertEqual((requeued, dead), (4, 1))
+        dead_msg = OutgoingMessage.objects.get(pk=claimed[0].id)
+        self.assertEqual(dead_msg.status, 'dead')
+        self.assertEqual(OutgoingMessage.objects.filter(status='pending', claimed_by='').count(), 4)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.failed_count, 1)
+        # Lo reencolado se puede volver a reclamar
+        self.assertEqual(len(claim_messages(self.campaign, 10, 'w2')), 4)
+
+
+class StatusBufferTests(TestCase):
+    def setUp(self):
+        self.campaign = crear_campania()
+        self.messages = crear_mensajes(self.campaign, crear_contactos(4), status='sending', attempts=1)
+
+    def test_flush_guarda_estados_y_suma_contadores(self):
+        buffer = StatusBuffer(max_size=100)
+        sent, also_sent, failed, retry = self.messages
+        for msg in (sent, also_sent):
+            msg.status = 'sent'
+            msg.sent_at = timezone.now()
+            buffer.add(msg, 'sent_count')
+        failed.status = 'failed'
+        buffer.add(failed, 'failed_count')
+        retry.status = 'pending'
+        buffer.add(retry)
+
+        self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.flush(), 0)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.sent_count, self.campaign.failed_count), (2, 1))
+        statuses = dict(OutgoingMessage.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[m.id] for m in self.messages], ['sent', 'sent', 'failed', 'pending'])
+
+    def test_buffers_de_varios_workers_se_suman(self):
+        for msg in self.messages:
+            msg.status = 'sent'
+        first, second = StatusBuffer(), StatusBuffer()
+        for msg in self.messages[:3]:
+            first.add(msg, 'sent_count')
+        second.add(self.messages[3], 'sent_count')
+
+        first.flush()
+        second.flush()
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.sent_count, 4)
+
+    def test_should_flush_por_tamanio_y_por_antiguedad(self):
+        now = [0.0]
+        buffer = StatusBuffer(max_size=2, max_age=5, clock=lambda: now[0])
+        self.assertFalse(buffer.should_flush())
+
+        buffer.add(self.messages[0], 'sent_count')
+        self.assertFalse(buffer.should_flush())
+        now[0] = 5
+        self.assertTrue(buffer.should_flush())
+
+        now[0] = 0
+        buffer.add(self.messages[1], 'sent_count')
+        self.assertTrue(buffer.should_flush())
+
+
+class ApplyFailureTests(TestCase):
+    def setUp(self):
+        self.campaign = crear_campania()
+        self.msg = crear_mensajes(self.campaign, crear_contactos(1), status='sending',
+                                  attempts=1, claimed_by='w1')[0]
+
+    def test_fallo_temporal_se_reintenta(self):
+        now = timezone.now()
+        counter = apply_failure(self.msg, 'HTTP 500: Fallo simulado', max_attempts=3, now=now)
+
+        self.assertIsNone(counter)
+        self.assertEqual((self.msg.status, self.msg.claimed_by, self.msg.attempts), ('pending', '', 1))
+        self.assertGreater(self.msg.next_attempt_at, now)
+
+    def test_fallo_temporal_sin_intentos_va_a_dead(self):
+        self.msg.attempts = 3
+        counter = apply_failure(self.msg, ERROR_NOT_CONNECTED, max_attempts=3)
+
+        self.assertEqual(counter, 'failed_count')
+        self.assertEqual(self.msg.status, 'dead')
+        self.assertIsNone(self.msg.next_attempt_at)
+
+    def test_fallo_permanente_no_se_reintenta(self):
+        counter = apply_failure(self.msg, 'HTTP 422: Número sin WhatsApp', max_attempts=3)
+
+        self.assertEqual(counter, 'failed_count')
+        self.assertEqual(self.msg.status, 'failed')
+        self.assertEqual(self.msg.last_error, 'HTTP 422: Número sin WhatsApp')
+
+    def test_circuito_abierto_no_gasta_intento(self):
+        now = timezone.now()
+        counter = apply_failure(self.msg, ERROR_CIRCUIT_OPEN, max_attempts=1, now=now)
+
+        self.assertIsNone(counter)
+        self.assertEqual((self.msg.status, self.msg.attempts), ('pending', 0))
+        self.assertGreaterEqual(self.msg.next_attempt_at, now)
+
+
+class EnqueueCampaignTests(TestCase):
+    def setUp(self):
+        self.contacts = crear_contactos(7)
+        self.campaign = crear_campania()
+
+    def test_encolar_dos_veces_no_duplica(self):
+        first = enqueue_campaign(self.campaign, Contact.objects.all(), chunk_size=3)
+        second = enqueue_campaign(self.campaign, Contact.objects.all(), chunk_size=3)
+
+        self.assertEqual((first.contacts, first.messages), (7, 7))
+        self.assertEqual((second.contacts, second.messages), (7, 0))
+        self.assertEqual(self.campaign.messages.count(), 7)
+
+    def test_reanudar_tras_un_bloque(self):
+        contacts = Contact.objects.order_by('id')
+        enqueue_campaign(self.campaign, contacts.filter(id__lte=self.contacts[2].id))
+        result = enqueue_campaign(self.campaign, contacts, chunk_size=2)
+
+        self.assertEqual(result.messages, 4)
+        self.assertEqual(self.campaign.messages.count(), 7)
+
+    def test_texto_por_contacto_no_duplica(self):
+        for _ in range(2):
+            enqueue_campaign(self.campaign, Contact.objects.all(), text='Hola {nombre}', lazy=False)
+
+        self.assertEqual(self.campaign.messages.count(), 7)
+        self.assertEqual(self.campaign.messages.get(contact=self.contacts[0]).payload, 'Hola Contacto 0')
+
+    def test_multilinea_no_duplica_lineas(self):
+        text = 'Línea 1 {nombre}\nLínea 2'
+        first = enqueue_campaign(self.campaign, Contact.objects.all(), text=text, send_mode='multiline')
+        second = enqueue_campaign(self.campaign, Contact.objects.all(), text=text, send_mode='multiline')
+
+        self.assertEqual(first.messages, 7 * 3)
+        self.assertEqual(second.messages, 0)
+        self.assertEqual(self.campaign.messages.filter(line_number=0).count(), 7)
+        self.assertEqual(self.campaign.messages.count(), 7 * 3)
+
+
+class LimpiarTelefonosTests(TestCase):
+    TEXTOS = [
+        '0991234567', '991234567', '+593991234567', '593991234567', '(099) 123-4567',
+        ' 099 123 4567 ', '099-123-4567\t', '12345', '', 'nan', '+593', '0', '00593991234567',
+        'abc', '099123456789012', '+1 (555) 010-9999', 'teléfono', '٠٩٩١٢٣٤٥٦٧', 'x' * 60,
+    ]
+
+    def assertEquivalente(self, values):
+        phones, invalid = limpiar_telefonos(values)
+        expected = [
+            limpiar_telefono(_texto_celda(value)) if not pd.isna(value) else ''
+            for value in pd.Series(values).tolist()
+        ]
+        self.assertEqual(phones.tolist(), expected)
+        self.assertEqual(invalid.tolist(), [phone in ('', 'nan', '+593') for phone in expected])
+
+    def test_textos(self):
+        self.assertEquivalente(self.TEXTOS)
+
+    def test_textos_con_vacios(self):
+        self.assertEquivalente(self.TEXTOS + [None, np.nan])
+
+    def test_columna_entera(self):
+        self.assertEquivalente(pd.Series([991234567, 593991234567, 12, 0, 9912345678], dtype='int64'))
+
+    def test_columna_float_con_vacios(self):
+        self.assertEquivalente(pd.Series([991234567.0, np.nan, 593991234567.0, 1.5]))
+
+    def test_columna_mixta(self):
+        self.assertEquivalente(pd.Series(['0991234567', 991234567, 991234567.0, None], dtype=object))
+
+    def test_otro_prefijo(self):
+        phones, _ = limpiar_telefonos(['991234567', '0991234567'], default_country='+57')
+        self.assertEqual(phones.tolist(), [limpiar_telefono('991234567', '+57'), '0991234567'])
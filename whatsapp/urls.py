@@ -28,6 +28,10 @@ urlpatterns = [
     path('campaigns/quick-send/', views.quick_send, name='quick_send'),
     path('campaigns/<int:pk>/', views.campaign_detail, name='campaign_detail'),
     path('campaigns/<int:pk>/send/', views.campaign_send, name='campaign_send'),
+    path('enqueue-jobs/<int:pk>/progress/', views.enqueue_job_progress, name='enqueue_job_progress'),
+    path('import-jobs/<int:pk>/progress/', views.import_job_progress, name='import_job_progress'),
+    path('import-jobs/<int:pk>/errors/', views.import_job_errors, name='import_job_errors'),
+    path('audience/estimate/', views.audience_estimate, name='audience_estimate'),
     
     # Tags
     path('tags/', views.tags_list, name='tags_list'),
@@ -1,5 +1,6 @@
 import re
 from datetime import datetime
+from functools import lru_cache
 import random
 
 def limpiar_telefono(phone, default_country='+593'):
@@ -12,21 +13,205 @@ def limpiar_telefono(phone, default_country='+593'):
         return default_country + s[-9:]
     return s
 
+# Caracteres que quita limpiar_telefono (\s de re en ASCII, paréntesis y guion)
+_PHONE_STRIP_CHARS = b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f ()-'
+# Textos más largos se limpian fila por fila (no son teléfonos y agrandarían la matriz)
+_PHONE_MAX_WIDTH = 40
+
+def _texto_celda(value):
+    """Texto de una celda que no es str (float enteros sin '.0')"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def limpiar_telefonos(values, default_country='+593'):
+    """
+    limpiar_telefono() sobre una columna entera, sin bucle por fila.
+
+    Los textos se pasan a una matriz numpy de bytes (una fila por teléfono)
+    y el quitar caracteres, el prefijo de país y los últimos 9 dígitos se
+    hacen con operaciones de matriz. Las filas no ASCII (o muy largas) usan
+    limpiar_telefono.
+
+    Args:
+        values: Series de pandas, o cualquier secuencia que acepte pd.Series,
+                tal como la lee pandas: NaN y None cuentan como vacíos y los
+                float enteros (columna numérica con alguna celda vacía) se
+                leen sin el '.0'
+        default_country: Prefijo para los números locales
+
+    Returns:
+        (Series de teléfonos, Series booleana: True = inválido). Cada
+        teléfono es igual a limpiar_telefono(texto); inválidos son '',
+        'nan' y el prefijo solo.
+    """
+    import numpy as np
+    import pandas as pd
+
+    values = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        return _telefonos_numericos(values, default_country)
+    present = values.notna()
+    cells = values if present.all() else values.astype(object).where(present, '')
+    texts = [value if value.__class__ is str else _texto_celda(value) for value in cells.tolist()]
+    rows = len(texts)
+
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=rows)
+    slow = (lengths > _PHONE_MAX_WIDTH) | ~np.fromiter(map(str.isascii, texts), dtype=bool, count=rows)
+    fast = texts
+    if slow.any():
+        fast = [text if not skip else '' for text, skip in zip(texts, slow.tolist())]
+        lengths[slow] = 0
+    width = max(int(lengths.max(initial=0)), 1)
+    codes = np.array(fast, dtype=f'S{width}').view(np.uint8).reshape(rows, width)
+    # numpy pierde los '\0' finales: esas filas también van por limpiar_telefono
+    slow |= np.count_nonzero(codes, axis=1) != lengths
+
+    # Quitar espacios, paréntesis y guiones (solo en las filas que los tienen)
+    strip = np.zeros(256, dtype=bool)
+    strip[list(_PHONE_STRIP_CHARS)] = True
+    removed = strip[codes]
+    dirty = np.flatnonzero(removed.any(axis=1))
+    if len(dirty):
+        order = np.argsort(removed[dirty], axis=1, kind='stable')
+        compacted = np.take_along_axis(codes[dirty], order, axis=1)
+        compacted[np.take_along_axis(removed[dirty], order, axis=1)] = 0
+        codes[dirty] = compacted
+    lengths = np.count_nonzero(codes, axis=1)
+
+    # Número local: prefijo + últimos 9 dígitos
+    first = codes[:, 0]
+    local = np.flatnonzero((first != ord('+')) & (first != ord('0')) & (lengths >= 9))
+    prefix = np.frombuffer(default_country.encode(), dtype=np.uint8)
+    out = np.zeros((rows, max(width, len(prefix) + 9)), dtype=np.uint8)
+    out[:, :width] = codes
+    if len(local):
+        last = np.take_along_axis(codes[local], lengths[local, None] - 9 + np.arange(9), axis=1)
+        out[local] = 0
+        out[local, :len(prefix)] = prefix
+        out[local, len(prefix):len(prefix) + 9] = last
+
+    cleaned = out.view(f'S{out.shape[1]}').ravel()
+    invalid = (cleaned == b'') | (cleaned == b'nan') | (cleaned == default_country.encode())
+    # Solo se crean textos nuevos para las filas que cambian
+    phones = np.array(texts, dtype=object)
+    changed = np.union1d(dirty, local)
+    phones[changed] = cleaned[changed].astype(str)
+    for i in np.flatnonzero(slow):
+        phones[i] = limpiar_telefono(texts[i])
+        invalid[i] = phones[i] in ('', 'nan', default_country)
+    return pd.Series(phones, index=values.index), pd.Series(invalid, index=values.index)
+
+def _telefonos_numericos(values, default_country):
+    """
+    limpiar_telefonos() de una columna numérica (pandas lee así los
+    teléfonos sin '+'): un entero de 9 o más dígitos es el prefijo más sus
+    últimos 9 dígitos, que salen de aritmética entera sin pasar por texto.
+    """
+    import numpy as np
+    import pandas as pd
+
+    numbers = values.to_numpy(dtype=float, na_value=np.nan) if values.hasnans else values.to_numpy()
+    rows = len(numbers)
+    phones = np.full(rows, '', dtype=object)
+    invalid = np.ones(rows, dtype=bool)
+    if pd.api.types.is_float_dtype(numbers.dtype):
+        present = ~np.isnan(numbers)
+        integral = present & (numbers == np.floor(numbers)) & (np.abs(numbers) < 2 ** 62)
+        others = np.flatnonzero(present & ~integral)
+        for i in others:
+            phones[i] = limpiar_telefono(_texto_celda(float(numbers[i])))
+            invalid[i] = phones[i] in ('', 'nan', default_country)
+        integers = np.zeros(rows, dtype=np.int64)
+        integers[integral] = numbers[integral]
+    else:
+        integral = np.ones(rows, dtype=bool)
+        integers = numbers.astype(np.int64)
+
+    local = integral & (integers >= 10 ** 8)
+    for i in np.flatnonzero(integral & ~local):
+        phones[i] = limpiar_telefono(str(integers[i]))
+        invalid[i] = phones[i] in ('', 'nan', default_country)
+    if local.any():
+        prefix = np.frombuffer(default_country.encode(), dtype=np.uint8)
+        codes = np.empty((np.count_nonzero(local), len(prefix) + 9), dtype=np.uint8)
+        codes[:, :len(prefix)] = prefix
+        rest = integers[local] % 10 ** 9
+        for column in range(codes.shape[1] - 1, len(prefix) - 1, -1):
+            codes[:, column] = rest % 10 + ord('0')
+            rest //= 10
+        phones[local] = codes.view(f'S{codes.shape[1]}').ravel().astype(str)
+        invalid[local] = False
+    return pd.Series(phones, index=values.index), pd.Series(invalid, index=values.index)
+
 def extraer_variables(text):
     import re
     return list(set(re.findall(r'\{(\w+)\}', text)))
 
-def process_template(template_text, contacto):
-    saludo_choices = ['Dios te bendiga', 'Bendiciones', 'Hola']
-    replacements = {
-        'nombre': contacto.get('nombre', ''),
-        'telefono': contacto.get('telefono', ''),
-        'grupo': contacto.get('grupo', ''),
-        'fecha': datetime.now().strftime('%d/%m/%Y'),
-        'hora': datetime.now().strftime('%H:%M'),
-        'saludo': random.choice(saludo_choices)
+# Variables que reemplaza process_template (cualquier otra {variable} queda tal cual)
+TEMPLATE_VARIABLES = ('nombre', 'telefono', 'grupo', 'fecha', 'hora', 'saludo')
+SALUDO_CHOICES = ['Dios te bendiga', 'Bendiciones', 'Hola']
+_PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+
+class CompiledTemplate:
+    """
+    Plantilla analizada una sola vez.
+
+    Los textos fijos y las variables {var} se convierten en una cadena de
+    formato de Python, así renderizar es una única llamada a format() en
+    lugar de un str.replace por variable sobre el texto completo.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.names = []
+        parts = []
+        pos = 0
+        for match in _PLACEHOLDER_RE.finditer(text):
+            if match.group(1) not in TEMPLATE_VARIABLES:
+                continue
+            parts.append(text[pos:match.start()].replace('{', '{{').replace('}', '}}'))
+            parts.append(f'{{{len(self.names)}}}')
+            self.names.append(match.group(1))
+            pos = match.end()
+        parts.append(text[pos:].replace('{', '{{').replace('}', '}}'))
+        self.format_string = ''.join(parts)
+
+    def render(self, contacto, constants=None):
+        """
+        Args:
+            contacto: dict con nombre, telefono, grupo
+            constants: Resultado de template_constants(), compartido por todo un
+                       bloque de mensajes (si no se pasa se calcula ahora)
+        """
+        if not self.names:
+            return self.text
+        if constants is None:
+            constants = template_constants()
+        # Un solo saludo por mensaje aunque {saludo} aparezca varias veces
+        saludo = random.choice(SALUDO_CHOICES) if 'saludo' in self.names else None
+        values = []
+        for name in self.names:
+            if name == 'saludo':
+                values.append(saludo)
+            elif name in constants:
+                values.append(constants[name])
+            else:
+                values.append(str(contacto.get(name, '')))
+        return self.format_string.format(*values)
+
+@lru_cache(maxsize=256)
+def compile_template(template_text):
+    """CompiledTemplate cacheado por contenido de la plantilla"""
+    return CompiledTemplate(template_text)
+
+def template_constants(now=None):
+    """Variables iguales para todos los mensajes de un bloque (fecha y hora)"""
+    now = now or datetime.now()
+    return {
+        'fecha': now.strftime('%d/%m/%Y'),
+        'hora': now.strftime('%H:%M'),
     }
-    out = template_text
-    for k,v in replacements.items():
-        out = out.replace(f'{{{k}}}', str(v))
-    return out
+
+def process_template(template_text, contacto, constants=None):
+    return compile_template(template_text).render(contacto, constants)
@@ -7,12 +7,18 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from .models import (
     Contact, Template, Campaign, OutgoingMessage,
-    Tag, Rule, Workflow, FollowUp, Attachment
+    Tag, Rule, Workflow, FollowUp, Attachment, EnqueueJob, ImportJob, Segment
 )
 from .utils import process_template
-from .send_adapter import check_whatsapp_status, get_qr_code
+from .send_adapter import (
+    check_whatsapp_status, get_qr_code, get_session,
+    WHATSAPP_SERVICE_URL, CONNECT_TIMEOUT, STATUS_TIMEOUT,
+)
+from .wakeup import notify_workers
+from .enqueue import enqueue_campaign
+from .jobs import start_enqueue_job, active_job, active_import_job
+from .audience import estimate_audience, invalidate_audience_cache
 import json
-import requests
 import os
 
 def index(request):
@@ -102,6 +108,8 @@ def contacts_list(request):
                         contact = Contact.objects.get(id=contact_id)
                         contact.tags.add(tag)
                     messages.success(request, f'Etiqueta "{tag.name}" agregada a {len(selected_ids)} contacto(s)')
+            # QuerySet.update() no envía señales
+            invalidate_audience_cache()
         
         return redirect('contacts_list')
     
@@ -154,6 +162,7 @@ def contacts_save_group(request):
         
         # Actualizar todos los contactos con el nuevo nombre de grupo
         count = Contact.objects.all().update(group=group_name)
+        invalidate_audience_cache()
         messages.success(request, f'Se guardaron {count} contactos en el grupo "{group_name}".')
     return redirect('contacts_list')
 
@@ -181,20 +190,11 @@ def campaigns_list(request):
 def campaign_detail(request, pk):
     campaign = get_object_or_404(Campaign, pk=pk)
     if request.method == 'POST' and 'enqueue' in request.POST:
-        contacts = Contact.objects.filter(opt_in=True)
-        created = 0
-        for c in contacts:
-            payload = process_template(campaign.template.content, {'nombre': c.name, 'telefono': c.phone, 'grupo': c.group})
-            OutgoingMessage.objects.create(campaign=campaign, contact=c, payload=payload)
-            created += 1
-        
-        # Actualizar estadísticas de campaña
-        campaign.total_contacts = created
-        campaign.save()
+        result = enqueue_campaign(campaign, campaign.audience_segment().queryset())
         
-        messages.success(request, f'Enqueued {created} messages for campaign "{campaign.name}"')
+        messages.success(request, f'Enqueued {result.messages} messages for campaign "{campaign.name}"')
         return redirect(reverse('campaign_detail', args=[pk]))
-    return render(request, 'campaign_detail.html', {'campaign': campaign})
+    return render(request, 'campaign_detail.html', {'campaign': campaign, 'enqueue_job': active_job(campaign)})
 
 # ========== TAGS ==========
 def tags_list(request):
@@ -314,29 +314,19 @@ def attachments_list(request):
 def _process_file_with_mapping(request):
     """Procesa el archivo usando el mapeo de columnas seleccionado por el usuario."""
     try:
-        import pandas as pd
-        import base64
-        from io import BytesIO
-        from .utils import limpiar_telefono
+        from .importer import ColumnMapping
+        from .jobs import start_import_job
+        from .staging import staged_path
         
-        # Recuperar archivo de sesión
-        file_content = request.session.get('import_file')
+        # Recuperar archivo subido en el paso anterior
+        token = request.session.get('import_token')
         filename = request.session.get('import_filename')
+        path = staged_path(token, filename)
         
-        if not file_content or not filename:
+        if not path or not filename:
             messages.error(request, '❌ Sesión expirada. Por favor, vuelva a seleccionar el archivo.')
             return redirect('contacts_import')
         
-        # Decodificar archivo
-        file_bytes = base64.b64decode(file_content)
-        file_like = BytesIO(file_bytes)
-        
-        # Leer archivo
-        if filename.endswith('.csv'):
-            df = pd.read_csv(file_like)
-        elif filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_like, engine='openpyxl')
-        
         # Obtener mapeo de columnas del formulario
         name_col = request.POST.get('name_column')
         phone_col = request.POST.get('phone_column')
@@ -350,93 +340,19 @@ def _process_file_with_mapping(request):
             messages.error(request, '❌ Debe seleccionar al menos las columnas de Nombre y Teléfono.')
             return redirect('contacts_import')
         
-        # Procesar filas
-        imported = 0
-        updated = 0
-        errors = 0
-        error_details = []
-        
-        for idx, row in df.iterrows():
-            try:
-                # Extraer datos según mapeo
-                name = str(row[name_col]).strip() if name_col in row else ''
-                phone_raw = str(row[phone_col]).strip() if phone_col in row else ''
-                
-                if not name or name == 'nan':
-                    errors += 1
-                    error_details.append(f"Fila {idx+2}: nombre vacío")
-                    continue
-                
-                phone = limpiar_telefono(phone_raw)
-                if not phone or phone == 'nan' or phone == '+593':
-                    errors += 1
-                    error_details.append(f"Fila {idx+2}: teléfono inválido '{phone_raw}'")
-                    continue
-                
-                # Campos opcionales
-                email = ''
-                if email_col and email_col in row:
-                    email = str(row[email_col]).strip()
-                    if email == 'nan':
-                        email = ''
-                
-                group = 'General'
-                if group_col and group_col in row:
-                    group = str(row[group_col]).strip()
-                    if group == 'nan':
-                        group = 'General'
-                
-                # Campos personalizados (guardar en notes o crear campos custom)
-                notes_parts = []
-                if custom_field1_col and custom_field1_col in row:
-                    value = str(row[custom_field1_col]).strip()
-                    if value and value != 'nan':
-                        notes_parts.append(f"{custom_field1_col}: {value}")
-                
-                if custom_field2_col and custom_field2_col in row:
-                    value = str(row[custom_field2_col]).strip()
-                    if value and value != 'nan':
-                        notes_parts.append(f"{custom_field2_col}: {value}")
-                
-                notes = ' | '.join(notes_parts) if notes_parts else ''
-                
-                # Crear o actualizar contacto
-                contact, created = Contact.objects.update_or_create(
-                    phone=phone,
-                    defaults={
-                        'name': name,
-                        'email': email,
-                        'group': group,
-                        'opt_in': True,
-                        'notes': notes  # Aquí guardamos los campos personalizados
-                    }
-                )
-                
-                if created:
-                    imported += 1
-                else:
-                    updated += 1
-                    
-            except Exception as e:
-                errors += 1
-                error_details.append(f"Fila {idx+2}: {str(e)}")
-                continue
+        # Importar en segundo plano (los campos personalizados se guardan en notes)
+        mapping = ColumnMapping(
+            name_col, phone_col, email=email_col or None, group=group_col or None,
+            extra=[custom_field1_col, custom_field2_col],
+        )
+        job = start_import_job(path, filename, mapping)
         
-        # Limpiar sesión
-        del request.session['import_file']
+        # Limpiar sesión (el archivo ahora es del job)
+        del request.session['import_token']
         del request.session['import_filename']
         
-        # Mensaje de resultado
-        if imported > 0 or updated > 0:
-            messages.success(request, f'✅ Importación completada: {imported} nuevos, {updated} actualizados, {errors} errores')
-            if error_details and len(error_details) <= 5:
-                messages.warning(request, f'Detalles de errores: {"; ".join(error_details)}')
-        else:
-            messages.error(request, f'❌ No se pudo importar ningún contacto. Errores: {errors}')
-            if error_details:
-                messages.warning(request, f'Primeros errores: {"; ".join(error_details[:3])}')
-        
-        return redirect('contacts_list')
+        messages.info(request, f'📇 Importando {filename} en segundo plano...')
+        return redirect(f"{reverse('contacts_import')}?job={job.pk}")
         
     except Exception as e:
         messages.error(request, f'❌ Error al procesar archivo: {str(e)}')
@@ -573,136 +489,52 @@ def contacts_import(request):
                 messages.error(request, f'❌ Formato no soportado: {file.name}. Use archivos CSV, XLSX o XLS.')
                 return redirect('contacts_import')
             
+            path = None
             try:
-                # Leer archivo y guardar en sesión para el siguiente paso
-                import pandas as pd
-                import base64
+                from .importer import count_rows, read_preview
+                from .staging import discard_upload, stage_upload, staged_path
                 
-                # Leer archivo
-                if file.name.endswith('.csv'):
-                    df = pd.read_csv(file)
-                elif file.name.endswith(('.xlsx', '.xls')):
-                    df = pd.read_excel(file, engine='openpyxl')
+                # Guardar archivo en disco para el siguiente paso (la sesión solo guarda el token)
+                discard_upload(request.session.get('import_token'), request.session.get('import_filename'))
+                request.session.pop('import_file', None)
+                token = stage_upload(file)
+                path = staged_path(token, file.name)
                 
-                # Guardar archivo en sesión (como base64)
-                file.seek(0)
-                file_content = base64.b64encode(file.read()).decode('utf-8')
-                request.session['import_file'] = file_content
+                # Obtener columnas y preview de datos (solo encabezados y 5 filas)
+                columns, preview_data = read_preview(path, file.name)
+                request.session['import_token'] = token
                 request.session['import_filename'] = file.name
                 
-                # Obtener columnas y preview de datos
-                columns = list(df.columns)
-                preview_data = df.head(5).to_dict('records')
-                
                 # Renderizar vista de mapeo
                 context = {
                     'columns': columns,
                     'preview_data': preview_data,
                     'filename': file.name,
-                    'total_rows': len(df),
+                    'total_rows': count_rows(path, file.name),
                 }
                 return render(request, 'contacts_import_mapping.html', context)
                 
             except Exception as e:
-                import pandas as pd
-                from .utils import limpiar_telefono
-                
-                # Leer archivo
-                if file.name.endswith('.csv'):
-                    df = pd.read_csv(file)
-                elif file.name.endswith(('.xlsx', '.xls')):
-                    df = pd.read_excel(file, engine='openpyxl')
+                from .importer import detect_columns, read_columns
+                from .jobs import start_import_job
+                from .staging import stage_upload, staged_path
                 
                 # Detectar columnas de forma FLEXIBLE
                 # Si el archivo tiene encabezados reconocibles, úsalos
                 # Si no, usa las primeras 2 columnas por defecto
+                file.seek(0)
+                mapping = detect_columns(read_columns(file, file.name))
+                if mapping is None:
+                    messages.error(request, '❌ El archivo debe tener al menos 2 columnas: Nombre y Teléfono.')
+                    return redirect('contacts_import')
                 
-                # Intentar detectar columna de nombre
-                name_col = None
-                for c in df.columns:
-                    if any(x in str(c).lower() for x in ['name', 'nombre', 'contacto', 'persona']):
-                        name_col = c
-                        break
-                if name_col is None:
-                    name_col = df.columns[0]  # Primera columna por defecto
-                
-                # Intentar detectar columna de teléfono
-                phone_col = None
-                for c in df.columns:
-                    if any(x in str(c).lower() for x in ['phone', 'telefono', 'tel', 'cel', 'whatsapp', 'móvil', 'movil', 'celular', 'número', 'numero']):
-                        phone_col = c
-                        break
-                if phone_col is None:
-                    # Si hay al menos 2 columnas, usar la segunda
-                    if len(df.columns) >= 2:
-                        phone_col = df.columns[1]
-                    else:
-                        messages.error(request, '❌ El archivo debe tener al menos 2 columnas: Nombre y Teléfono.')
-                        return redirect('contacts_import')
-                
-                # Detectar columnas opcionales (email, grupo)
-                email_col = None
-                for c in df.columns:
-                    if any(x in str(c).lower() for x in ['email', 'correo', 'mail', 'e-mail']):
-                        email_col = c
-                        break
-                
-                group_col = None
-                for c in df.columns:
-                    if any(x in str(c).lower() for x in ['group', 'grupo', 'categoria', 'categoría', 'tipo']):
-                        group_col = c
-                        break
-                
-                # Procesar filas
-                imported = 0
-                updated = 0
-                errors = 0
-                error_details = []
-                
-                for idx, row in df.iterrows():
-                    try:
-                        name = str(row[name_col]).strip()
-                        phone_raw = str(row[phone_col]).strip()
-                        phone = limpiar_telefono(phone_raw)
-                        
-                        if not phone or phone == 'nan' or phone == '+593':
-                            errors += 1
-                            error_details.append(f"Fila {idx+2}: teléfono inválido '{phone_raw}'")
-                            continue
-                        
-                        email = str(row[email_col]).strip() if email_col and email_col in row else ''
-                        if email == 'nan':
-                            email = ''
-                        
-                        group = str(row[group_col]).strip() if group_col and group_col in row else 'General'
-                        if group == 'nan':
-                            group = 'General'
-                        
-                        contact, created = Contact.objects.update_or_create(
-                            phone=phone,
-                            defaults={'name': name, 'email': email, 'group': group, 'opt_in': True}
-                        )
-                        
-                        if created:
-                            imported += 1
-                        else:
-                            updated += 1
-                    except Exception as e:
-                        errors += 1
-                        error_details.append(f"Fila {idx+2}: {str(e)}")
-                        continue
-                
-                # Mensaje de resultado
-                if imported > 0 or updated > 0:
-                    messages.success(request, f'✅ Importación completada: {imported} nuevos, {updated} actualizados, {errors} errores')
-                    if error_details and len(error_details) <= 5:
-                        messages.warning(request, f'Detalles de errores: {"; ".join(error_details)}')
-                else:
-                    messages.error(request, f'❌ No se pudo importar ningún contacto. Errores: {errors}')
-                    if error_details:
-                        messages.warning(request, f'Primeros errores: {"; ".join(error_details[:3])}')
-                
-                return redirect('contacts_list')
+                # Importar en segundo plano desde la copia en disco
+                if not path:
+                    file.seek(0)
+                    path = staged_path(stage_upload(file), file.name)
+                job = start_import_job(path, file.name, mapping)
+                messages.info(request, f'📇 Importando {file.name} en segundo plano...')
+                return redirect(f"{reverse('contacts_import')}?job={job.pk}")
                 
             except Exception as e:
                 messages.error(request, f'❌ Error al procesar archivo: {str(e)}. Verifique que el archivo tenga el formato correcto.')
@@ -766,7 +598,13 @@ def contacts_import(request):
     # GET: mostrar formulario de importación
     groups = Contact.objects.values_list('group', flat=True).distinct().order_by('group')
     
-    return render(request, 'contacts_import.html', {'groups': groups})
+    # Importación en segundo plano: la indicada (?job=) o la que esté en curso
+    import_job = None
+    if request.GET.get('job', '').isdigit():
+        import_job = ImportJob.objects.filter(pk=request.GET['job']).first()
+    import_job = import_job or active_import_job()
+    
+    return render(request, 'contacts_import.html', {'groups': groups, 'import_job': import_job})
 
 # ========== ANALYTICS ==========
 def analytics(request):
@@ -909,6 +747,10 @@ def campaign_create(request):
             try:
                 template = Template.objects.get(pk=template_id)
                 
+                # Guardar los filtros de contactos como segmento de la campaña
+                segment = Segment.from_filters(filter_type, selected_groups, selected_tags, selected_contacts, name=name)
+                segment.save()
+                
                 # Crear campaña
                 scheduled_for = None
                 if schedule_type == 'scheduled' and scheduled_date and scheduled_time:
@@ -919,23 +761,12 @@ def campaign_create(request):
                     name=name,
                     template=template,
                     scheduled_for=scheduled_for,
+                    segment=segment,
                     created_by=request.user.username if request.user.is_authenticated else 'admin'
                 )
                 
-                # Filtrar contactos según selección
-                if filter_type == 'all':
-                    contacts = Contact.objects.filter(opt_in=True)
-                elif filter_type == 'groups':
-                    contacts = Contact.objects.filter(opt_in=True, group__in=selected_groups)
-                elif filter_type == 'tags':
-                    contacts = Contact.objects.filter(opt_in=True, tags__id__in=selected_tags).distinct()
-                elif filter_type == 'custom':
-                    contacts = Contact.objects.filter(opt_in=True, id__in=selected_contacts)
-                else:
-                    contacts = Contact.objects.filter(opt_in=True)
-                
                 # Actualizar contador de contactos
-                campaign.total_contacts = contacts.count()
+                campaign.total_contacts = segment.queryset().count()
                 campaign.save()
                 
                 messages.success(request, f'✅ Campaña "{campaign.name}" creada con {campaign.total_contacts} contactos. Ahora puedes encolar los mensajes.')
@@ -946,25 +777,15 @@ def campaign_create(request):
             except Exception as e:
                 messages.error(request, f'❌ Error al crear campaña: {str(e)}')
     
-    # GET: mostrar formulario
+    # GET: mostrar formulario (conteos y contactos se piden por API)
     templates = Template.objects.filter(active=True).order_by('name')
     groups = Contact.objects.values_list('group', flat=True).distinct().order_by('group')
     tags = Tag.objects.all().order_by('name')
-    contacts = Contact.objects.filter(opt_in=True).order_by('name')
-    
-    # Estadísticas
-    total_contacts = Contact.objects.filter(opt_in=True).count()
-    contacts_by_group = {}
-    for group in groups:
-        contacts_by_group[group] = Contact.objects.filter(opt_in=True, group=group).count()
     
     context = {
         'templates': templates,
         'groups': groups,
         'tags': tags,
-        'contacts': contacts,
-        'total_contacts': total_contacts,
-        'contacts_by_group': contacts_by_group,
     }
     
     return render(request, 'campaign_create.html', context)
@@ -979,44 +800,14 @@ def campaign_send(request, pk):
             existing_messages = OutgoingMessage.objects.filter(campaign=campaign).count()
             
             if existing_messages > 0:
-                messages.warning(request, f'⚠️ Esta campaña ya tiene {existing_messages} mensajes encolados. ¿Desea agregar más?')
-                # Aquí podrías agregar lógica adicional si es necesario
-            
-            # Obtener contactos según filtros de la campaña
-            # Por ahora, obtenemos todos los contactos opt-in
-            contacts = Contact.objects.filter(opt_in=True)
+                # Los contactos que ya tienen mensaje se saltan: solo se encolan los nuevos
+                messages.info(request, f'ℹ️ Esta campaña ya tiene {existing_messages} mensajes encolados. Solo se agregarán los contactos nuevos.')
             
-            # Si la campaña tiene filtros específicos guardados, aplicarlos aquí
-            # TODO: Guardar filtros en Campaign model para reutilizarlos
+            # Congelar la audiencia del segmento de la campaña y crear los mensajes
+            # pendientes en segundo plano (actualiza total_contacts de la campaña)
+            job = start_enqueue_job(campaign)
             
-            created_count = 0
-            for contact in contacts:
-                # Procesar plantilla con datos del contacto
-                from .utils import process_template
-                payload = process_template(
-                    campaign.template.content,
-                    {
-                        'nombre': contact.name,
-                        'telefono': contact.phone,
-                        'grupo': contact.group,
-                        'email': contact.email,
-                    }
-                )
-                
-                # Crear mensaje pendiente
-                OutgoingMessage.objects.create(
-                    campaign=campaign,
-                    contact=contact,
-                    payload=payload,
-                    status='pending'
-                )
-                created_count += 1
-            
-            # Actualizar estadísticas de campaña
-            campaign.total_contacts = created_count
-            campaign.save()
-            
-            messages.success(request, f'✅ {created_count} mensajes encolados exitosamente. El worker los procesará automáticamente.')
+            messages.success(request, f'✅ Encolando {job.total} mensajes en segundo plano. El worker los procesará automáticamente.')
             return redirect('campaign_detail', pk=campaign.pk)
             
         except Exception as e:
@@ -1026,6 +817,47 @@ def campaign_send(request, pk):
     return redirect('campaign_detail', pk=campaign.pk)
 
 
+def audience_estimate(request):
+    """
+    API endpoint: tamaño de la audiencia para unos filtros.
+    
+    GET ?filter=all|groups|tags|custom&groups=..&tags=..&contacts=..[&mode=estimate]
+    """
+    segment = Segment.from_filters(
+        request.GET.get('filter', 'all'),
+        request.GET.getlist('groups'),
+        request.GET.getlist('tags'),
+        request.GET.getlist('contacts'),
+    )
+    return JsonResponse(estimate_audience(segment, exact=request.GET.get('mode') != 'estimate'))
+
+
+def enqueue_job_progress(request, pk):
+    """API endpoint con el progreso de un encolado en segundo plano"""
+    job = get_object_or_404(EnqueueJob, pk=pk)
+    return JsonResponse(job.progress())
+
+
+def import_job_progress(request, pk):
+    """API endpoint con el progreso de una importación en segundo plano"""
+    job = get_object_or_404(ImportJob, pk=pk)
+    data = job.progress()
+    data['errors_url'] = reverse('import_job_errors', args=[job.pk]) if job.error_count else None
+    return JsonResponse(data)
+
+
+def import_job_errors(request, pk):
+    """Descarga del CSV con los errores por fila de una importación"""
+    from django.http import FileResponse, Http404
+    
+    job = get_object_or_404(ImportJob, pk=pk)
+    if not job.error_file or not os.path.exists(job.error_file):
+        raise Http404('El archivo de errores no está disponible')
+    name = os.path.splitext(job.filename)[0]
+    return FileResponse(open(job.error_file, 'rb'), as_attachment=True, filename=f'{name}_errores.csv',
+                        content_type='text/csv')
+
+
 def quick_send(request):
     """Envío rápido - escribir y enviar mensaje sin guardar plantilla"""
     if request.method == 'POST':
@@ -1039,59 +871,29 @@ def quick_send(request):
             return redirect('quick_send')
         
         # Crear campaña temporal para tracking
+        segment = Segment.from_filters(recipient_filter, selected_groups, contacts=selected_contacts)
+        segment.save()
         temp_campaign = Campaign.objects.create(
             name=f"Envío Rápido {timezone.now().strftime('%d/%m/%Y %H:%M')}",
             template=None,  # Sin plantilla para envíos rápidos
+            segment=segment,
             created_by=request.user.username if request.user.is_authenticated else 'admin'
         )
         
-        # Obtener destinatarios
-        contacts = Contact.objects.filter(opt_in=True)
+        # Crear y encolar mensajes en segundo plano (actualiza total_contacts)
+        job = start_enqueue_job(temp_campaign, text=message_text)
         
-        if recipient_filter == 'groups' and selected_groups:
-            contacts = contacts.filter(group__in=selected_groups)
-        elif recipient_filter == 'custom' and selected_contacts:
-            contacts = contacts.filter(id__in=selected_contacts)
-        
-        # Crear y encolar mensajes
-        created_count = 0
-        for contact in contacts:
-            # Procesar mensaje con variables del contacto
-            processed_message = process_template(
-                message_text,
-                {
-                    'nombre': contact.name,
-                    'telefono': contact.phone,
-                    'grupo': contact.group,
-                    'email': contact.email,
-                }
-            )
-            
-            OutgoingMessage.objects.create(
-                campaign=temp_campaign,
-                contact=contact,
-                payload=processed_message,
-                status='pending'
-            )
-            created_count += 1
-        
-        # Actualizar total de contactos
-        temp_campaign.total_contacts = created_count
-        temp_campaign.save()
-        
-        messages.success(request, f'✅ Envío rápido creado! {created_count} mensajes en cola.')
+        messages.success(request, f'✅ Envío rápido creado! Encolando {job.total} mensajes...')
         return redirect('campaign_detail', pk=temp_campaign.id)
     
-    # GET request - mostrar formulario
-    groups = Contact.objects.values_list('group', flat=True).distinct().exclude(group='')
-    contacts = Contact.objects.filter(opt_in=True).order_by('name')
+    # GET request - mostrar formulario (conteos y contactos se piden por API)
+    groups = Contact.objects.values_list('group', flat=True).exclude(group='').order_by('group').distinct()
     sample_contact = Contact.objects.first()
     
     available_vars = ['nombre', 'telefono', 'grupo', 'email', 'fecha', 'hora', 'saludo']
     
     context = {
         'groups': groups,
-        'contacts': contacts,
         'sample_contact': sample_contact,
         'available_vars': available_vars,
     }
@@ -1112,24 +914,21 @@ def wizard_welcome(request):
 def wizard_step1_contacts(request):
     """Paso 1: Importar/Verificar contactos"""
     contacts = Contact.objects.filter(opt_in=True)
-    groups = contacts.values_list('group', flat=True).distinct()
+    estimate = estimate_audience(Segment(filter_type='all'))
     
     stats = {
-        'total': contacts.count(),
-        'by_group': {},
+        'total': estimate['total'],
+        'by_group': estimate['by_group'],
     }
     
-    for group in groups:
-        stats['by_group'][group] = contacts.filter(group=group).count()
-    
     # Guardar en sesión que completó este paso
-    if contacts.count() > 0:
+    if stats['total'] > 0:
         request.session['wizard_step1_completed'] = True
     
     context = {
         'contacts': contacts[:20],  # Mostrar primeros 20
         'stats': stats,
-        'has_contacts': contacts.count() > 0,
+        'has_contacts': stats['total'] > 0,
     }
     
     return render(request, 'wizard/step1_contacts.html', context)
@@ -1184,7 +983,7 @@ def wizard_step2_message(request):
         return redirect('wizard_step3')
     
     # GET: mostrar formulario
-    groups = Contact.objects.values_list('group', flat=True).distinct().exclude(group='')
+    groups = Contact.objects.values_list('group', flat=True).exclude(group='').order_by('group').distinct()
     contacts = Contact.objects.filter(opt_in=True).order_by('name')
     sample_contact = Contact.objects.first()
     available_vars = ['nombre', 'telefono', 'grupo', 'email', 'fecha', 'hora', 'saludo']
@@ -1277,9 +1076,12 @@ def wizard_step4_preview(request):
             template_obj.save()
         
         # Crear campaña
+        segment = Segment.from_filters(recipient_filter, selected_groups, contacts=selected_contacts)
+        segment.save()
         campaign = Campaign.objects.create(
             name=f"Campaña Wizard {timezone.now().strftime('%d/%m/%Y %H:%M')}",
             template=template_obj,
+            segment=segment,
             created_by=request.user.username if request.user.is_authenticated else 'admin',
             send_speed=send_speed,
             batch_size=batch_size,
@@ -1288,74 +1090,17 @@ def wizard_step4_preview(request):
             status='ready'
         )
         
-        # Obtener contactos
-        contacts = Contact.objects.filter(opt_in=True)
-        
-        if recipient_filter == 'groups' and selected_groups:
-            contacts = contacts.filter(group__in=selected_groups)
-        elif recipient_filter == 'custom' and selected_contacts:
-            contacts = contacts.filter(id__in=selected_contacts)
-        
         # Obtener configuración de envío
         send_mode = request.session.get('wizard_send_mode', 'single')
         attachment_data = request.session.get('wizard_attachment', None)
         
-        # Crear mensajes
-        created_count = 0
-        for contact in contacts:
-            processed_message = process_template(
-                message_text,
-                {
-                    'nombre': contact.name,
-                    'telefono': contact.phone,
-                    'grupo': contact.group,
-                    'email': contact.email,
-                }
-            )
-            
-            if send_mode == 'multiline':
-                # Separar por líneas y crear un mensaje por cada línea
-                lines = [line.strip() for line in processed_message.split('\n') if line.strip()]
-                
-                # Crear mensaje padre
-                parent = OutgoingMessage.objects.create(
-                    campaign=campaign,
-                    contact=contact,
-                    payload=processed_message,  # Mensaje completo
-                    status='pending',
-                    line_number=0,
-                    attachment_path=attachment_data['path'] if attachment_data else None,
-                    attachment_type=attachment_data['type'] if attachment_data else None,
-                )
-                
-                # Crear mensaje por cada línea
-                for i, line in enumerate(lines, start=1):
-                    OutgoingMessage.objects.create(
-                        campaign=campaign,
-                        contact=contact,
-                        payload=line,
-                        status='pending',
-                        line_number=i,
-                        parent_message=parent,
-                        attachment_path=attachment_data['path'] if attachment_data and i == 1 else None,
-                        attachment_type=attachment_data['type'] if attachment_data and i == 1 else None,
-                    )
-                created_count += 1
-            else:
-                # Mensaje único
-                OutgoingMessage.objects.create(
-                    campaign=campaign,
-                    contact=contact,
-                    payload=processed_message,
-                    status='pending',
-                    line_number=0,
-                    attachment_path=attachment_data['path'] if attachment_data else None,
-                    attachment_type=attachment_data['type'] if attachment_data else None,
-                )
-                created_count += 1
-        
-        campaign.total_contacts = created_count
-        campaign.save()
+        # Crear mensajes en segundo plano (actualiza total_contacts de la campaña)
+        job = start_enqueue_job(
+            campaign,
+            text=message_text,
+            send_mode=send_mode,
+            attachment=attachment_data,
+        )
         
         # Limpiar sesión del wizard
         request.session.pop('wizard_message', None)
@@ -1366,13 +1111,12 @@ def wizard_step4_preview(request):
         request.session.pop('wizard_step3_completed', None)
         request.session.pop('wizard_connection_method', None)
         
-        messages.success(request, f'✅ Campaña creada con {created_count} mensajes!')
+        messages.success(request, f'✅ Campaña creada! Preparando mensajes para {job.total} contactos...')
         return redirect('wizard_launch', campaign_id=campaign.id)
     
     # GET: mostrar preview
     message_text = request.session.get('wizard_message', '')
-    groups = Contact.objects.values_list('group', flat=True).distinct().exclude(group='')
-    contacts = Contact.objects.filter(opt_in=True).order_by('name')
+    groups = Contact.objects.values_list('group', flat=True).exclude(group='').order_by('group').distinct()
     sample_contact = Contact.objects.first()
     
     # Preview del mensaje
@@ -1392,9 +1136,8 @@ def wizard_step4_preview(request):
         'message_text': message_text,
         'preview_message': preview_message,
         'groups': groups,
-        'contacts': contacts,
         'sample_contact': sample_contact,
-        'total_contacts': contacts.count(),
+        'total_contacts': estimate_audience(Segment(filter_type='all'))['total'],
     }
     
     return render(request, 'wizard/step4_preview.html', context)
@@ -1409,6 +1152,7 @@ def wizard_launch(request, campaign_id):
         if action == 'start':
             campaign.status = 'sending'
             campaign.save()
+            notify_workers(campaign.pk)
             messages.success(request, '🚀 Campaña iniciada! Los mensajes se están enviando.')
         
         elif action == 'pause':
@@ -1419,6 +1163,7 @@ def wizard_launch(request, campaign_id):
         elif action == 'resume':
             campaign.status = 'sending'
             campaign.save()
+            notify_workers(campaign.pk)
             messages.success(request, '▶️ Campaña reanudada.')
         
         elif action == 'cancel':
@@ -1429,9 +1174,9 @@ def wizard_launch(request, campaign_id):
             messages.warning(request, '🛑 Campaña cancelada. Los mensajes pendientes no se enviarán.')
         
         elif action == 'cleanup':
-            # Eliminar mensajes cancelados y fallidos
+            # Eliminar mensajes cancelados y fallidos (incluye los que agotaron reintentos)
             deleted_cancelled = campaign.messages.filter(status='cancelled').delete()[0]
-            deleted_failed = campaign.messages.filter(status='failed').delete()[0]
+            deleted_failed = campaign.messages.filter(status__in=['failed', 'dead']).delete()[0]
             total_deleted = deleted_cancelled + deleted_failed
             messages.success(request, f'🧹 Limpieza completada: {total_deleted} mensajes eliminados ({deleted_cancelled} cancelados, {deleted_failed} fallidos)')
         
@@ -1442,8 +1187,9 @@ def wizard_launch(request, campaign_id):
         'pending': campaign.messages.filter(status='pending').count(),
         'sending': campaign.messages.filter(status='sending').count(),
         'sent': campaign.messages.filter(status='sent').count(),
-        'failed': campaign.messages.filter(status='failed').count(),
+        'failed': campaign.messages.filter(status__in=['failed', 'dead']).count(),
         'cancelled': campaign.messages.filter(status='cancelled').count(),
+        'retrying': campaign.messages.filter(status='pending', next_attempt_at__isnull=False).count(),
     }
     
     recent_messages = campaign.messages.all().order_by('-created_at')[:10]
@@ -1459,6 +1205,7 @@ def wizard_launch(request, campaign_id):
         'recent_messages': recent_messages,
         'progress_percent': progress_percent,
         'is_active': campaign.status == 'sending',
+        'enqueue_job': active_job(campaign),
     }
     
     return render(request, 'wizard/launch.html', context)
@@ -1479,8 +1226,7 @@ def whatsapp_status(request):
     # Si está conectado, obtener info adicional
     if status['connected'] and status['status'] == 'ready':
         try:
-            service_url = os.getenv('WHATSAPP_SERVICE_URL', 'http://localhost:3000')
-            response = requests.get(f"{service_url}/info", timeout=5)
+            response = get_session().get(f"{WHATSAPP_SERVICE_URL}/info", timeout=STATUS_TIMEOUT)
             if response.status_code == 200:
                 info_data = response.json()
                 status['info'] = info_data.get('info', {})
@@ -1494,8 +1240,7 @@ def whatsapp_logout(request):
     """Cerrar sesión de WhatsApp"""
     if request.method == 'POST':
         try:
-            service_url = os.getenv('WHATSAPP_SERVICE_URL', 'http://localhost:3000')
-            response = requests.post(f"{service_url}/logout", timeout=10)
+            response = get_session().post(f"{WHATSAPP_SERVICE_URL}/logout", timeout=(CONNECT_TIMEOUT, 10))
             if response.status_code == 200:
                 return JsonResponse({'success': True})
             else:
@@ -0,0 +1,123 @@
+"""
+Aviso a los workers cuando hay mensajes nuevos para enviar.
+
+Las vistas que encolan mensajes o inician/reanudan campañas llaman a
+notify_workers(). El worker, cuando no tiene nada que hacer, espera ese
+aviso en lugar de consultar la BD cada 2 segundos:
+
+- PostgreSQL: LISTEN/NOTIFY sobre el canal WAKEUP_CHANNEL (funciona entre
+  servidores, el aviso viaja por la propia BD).
+- Otros motores (SQLite): se actualiza la fecha de modificación de un
+  archivo local (WORKER_WAKEUP_FILE) que el worker vigila. Solo sirve para
+  workers en el mismo servidor, que es el caso de SQLite.
+
+Si un aviso se pierde el worker igualmente revisa la BD cada
+IDLE_MAX_WAIT_SECONDS.
+"""
+import logging
+import os
+import select
+import tempfile
+import time
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+WAKEUP_CHANNEL = 'whatsapp_worker_wakeup'
+WAKEUP_FILE = os.getenv(
+    'WORKER_WAKEUP_FILE', os.path.join(tempfile.gettempdir(), 'whatsapp_worker.wakeup')
+)
+# Cada cuánto se revisa el archivo de aviso (no toca la BD)
+FILE_POLL_SECONDS = 0.25
+
+
+def notify_workers(campaign_id=None):
+    """Despierta a los workers al confirmarse la transacción actual"""
+    transaction.on_commit(lambda: _publish(campaign_id))
+
+
+def _publish(campaign_id):
+    try:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [WAKEUP_CHANNEL, str(campaign_id or '')])
+        else:
+            with open(WAKEUP_FILE, 'a'):
+                os.utime(WAKEUP_FILE, None)
+    except Exception:
+        # Sin aviso el worker lo verá en su próxima revisión periódica
+        logger.warning('No se pudo avisar a los workers', exc_info=True)
+
+
+class WakeupListener:
+    """Espera avisos de notify_workers() (usado por run_worker)"""
+
+    def __init__(self):
+        self.use_pg = connection.vendor == 'postgresql'
+        self._pg = None
+        self._mtime = self._file_mtime()
+
+    def wait(self, timeout):
+        """
+        Bloquea hasta recibir un aviso o hasta `timeout` segundos.
+
+        Returns:
+            True si llegó un aviso
+        """
+        if self.use_pg:
+            return self._wait_pg(timeout)
+        return self._wait_file(timeout)
+
+    def close(self):
+        if self._pg is not None:
+            try:
+                self._pg.close()
+            except Exception:
+                pass
+            self._pg = None
+
+    def _wait_pg(self, timeout):
+        try:
+            conn = self._listen_connection()
+            if not conn.notifies and select.select([conn], [], [], timeout) == ([], [], []):
+                return False
+            conn.poll()
+            woken = bool(conn.notifies)
+            conn.notifies.clear()
+            return woken
+        except Exception:
+            # Conexión caída: se reabre en la próxima espera
+            logger.warning('Conexión LISTEN perdida, se reintentará', exc_info=True)
+            self.close()
+            time.sleep(timeout)
+            return False
+
+    def _listen_connection(self):
+        """Conexión propia (fuera del ORM) en autocommit, suscrita al canal"""
+        if self._pg is None:
+            conn = connection.get_new_connection(connection.get_connection_params())
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {WAKEUP_CHANNEL}')
+            self._pg = conn
+        return self._pg
+
+    def _wait_file(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            mtime = self._file_mtime()
+            if mtime != self._mtime:
+                self._mtime = mtime
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(FILE_POLL_SECONDS, remaining))
+
+    @staticmethod
+    def _file_mtime():
+        try:
+            return os.stat(WAKEUP_FILE).st_mtime_ns
+        except OSError:
+            return None
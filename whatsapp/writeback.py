@@ -0,0 +1,80 @@
+"""
+Escritura diferida (write-behind) de resultados de envío.
+
+El worker ya no guarda cada mensaje al terminar de enviarlo: acumula los
+resultados y los vuelca juntos con bulk_update cuando se alcanza un
+tamaño o un tiempo máximo. En la misma transacción se suman los
+contadores de cada campaña con F(), de modo que varios workers pueden
+actualizar la misma campaña sin pisarse.
+"""
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Campaign, OutgoingMessage
+
+
+class StatusBuffer:
+    """Acumula resultados de OutgoingMessage y los escribe en bloque"""
+
+    # Campos que puede cambiar un resultado de envío
+    # (attempts: un circuito abierto devuelve el intento, ver retry.apply_failure)
+    FIELDS = ['status', 'sent_at', 'last_error', 'next_attempt_at', 'claimed_by', 'attempts']
+
+    def __init__(self, max_size=100, max_age=2.0, clock=time.monotonic):
+        """
+        Args:
+            max_size: Resultados acumulados que fuerzan un volcado
+            max_age: Segundos máximos que un resultado espera en memoria
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self.clock = clock
+        self.messages = {}
+        self.counters = Counter()  # (campaign_id, campo) -> incremento
+        self.oldest = None
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, msg, counter=None):
+        """
+        Registra el nuevo estado de un mensaje.
+
+        Args:
+            msg: OutgoingMessage con los campos de FIELDS ya actualizados
+            counter: Contador de la campaña a incrementar ('sent_count', 'failed_count'
+                     o None si el mensaje vuelve a la cola para reintento)
+        """
+        self.messages[msg.pk] = msg
+        if counter:
+            self.counters[(msg.campaign_id, counter)] += 1
+        if self.oldest is None:
+            self.oldest = self.clock()
+
+    def should_flush(self):
+        if not self.messages:
+            return False
+        return len(self.messages) >= self.max_size or self.clock() - self.oldest >= self.max_age
+
+    def flush(self):
+        """Escribe todo lo acumulado. Devuelve el número de mensajes guardados."""
+        if not self.messages:
+            return 0
+
+        messages = list(self.messages.values())
+        by_campaign = {}
+        for (campaign_id, field), amount in self.counters.items():
+            by_campaign.setdefault(campaign_id, {})[field] = F(field) + amount
+
+        with transaction.atomic():
+            OutgoingMessage.objects.bulk_update(messages, self.FIELDS, batch_size=self.max_size)
+            for campaign_id, increments in by_campaign.items():
+                Campaign.objects.filter(pk=campaign_id).update(**increments)
+
+        self.messages = {}
+        self.counters = Counter()
+        self.oldest = None
+        return len(messages)
@@ -6,7 +6,7 @@ const bodyParser = require('body-parser');
 require('dotenv').config();
 
 const app = express();
-app.use(bodyParser.json());
+app.use(bodyParser.json({ limit: '5mb' }));
 
 const PORT = process.env.PORT || 3000;
 
@@ -32,6 +32,75 @@ const client = new Client({
 let isReady = false;
 let qrCodeData = null;
 
+// Idempotencia: idempotencyKey -> { at, result } de los envíos ya hechos.
+// Si el worker reintenta un mensaje que sí llegó a salir (p. ej. murió antes
+// de guardar el resultado) se devuelve el messageId original sin reenviarlo.
+const IDEMPOTENCY_TTL_MS = (parseInt(process.env.IDEMPOTENCY_TTL_HOURS) || 24) * 3600 * 1000;
+const sentByKey = new Map();
+
+function purgeExpiredKeys() {
+    const cutoff = Date.now() - IDEMPOTENCY_TTL_MS;
+    // Map conserva el orden de inserción: las claves más viejas van primero
+    for (const [key, entry] of sentByKey) {
+        if (entry.at >= cutoff) break;
+        sentByKey.delete(key);
+    }
+}
+
+async function sendOnce(key, doSend) {
+    if (!key) {
+        return { ...(await doSend()), duplicate: false };
+    }
+    purgeExpiredKeys();
+
+    const known = sentByKey.get(key);
+    if (known) {
+        // Ya enviado (o en curso): esperar ese mismo envío
+        return { ...(await known.result), duplicate: true };
+    }
+
+    const entry = { at: Date.now(), result: doSend() };
+    sentByKey.set(key, entry);
+    try {
+        return { ...(await entry.result), duplicate: false };
+    } catch (error) {
+        // Solo se recuerdan los envíos exitosos
+        sentByKey.delete(key);
+        throw error;
+    }
+}
+
+// Clasificación de errores de envío, igual en /send, /send-media y /send-batch:
+// - permanent (422): reintentar no sirve (archivo inexistente, número sin WhatsApp)
+// - transient (500): puede salir bien más tarde (navegador, timeout...)
+// - not_connected (503): la sesión se cayó durante el envío
+const ERROR_STATUS = { permanent: 422, transient: 500, not_connected: 503 };
+
+async function classifySendError(error, chatId) {
+    if (!isReady) {
+        return 'not_connected';
+    }
+    if (error && ['ENOENT', 'EISDIR', 'EACCES'].includes(error.code)) {
+        return 'permanent';
+    }
+    if (/invalid wid|wid error/i.test((error && error.message) || '')) {
+        return 'permanent';
+    }
+    try {
+        if (!(await client.isRegisteredUser(chatId))) {
+            return 'permanent';
+        }
+    } catch (e) {
+        // Sin poder comprobarlo se trata como temporal
+    }
+    return 'transient';
+}
+
+async function sendErrorResponse(res, error, chatId) {
+    const code = await classifySendError(error, chatId);
+    res.status(ERROR_STATUS[code]).json({ success: false, code, error: error.message });
+}
+
 // Evento: Generar QR
 client.on('qr', (qr) => {
     console.log('📱 QR Code generado. Escanéalo con WhatsApp:');
@@ -75,6 +144,7 @@ app.get('/health', (req, res) => {
     res.json({
         status: isReady ? 'ready' : 'initializing',
         qr: qrCodeData,
+        features: ['send-batch', 'idempotency'],
         timestamp: new Date().toISOString()
     });
 });
@@ -106,6 +176,7 @@ app.get('/qr', async (req, res) => {
 
 // Enviar mensaje de texto
 app.post('/send', async (req, res) => {
+    let chatId;
     try {
         if (!isReady) {
             return res.status(503).json({ 
@@ -114,7 +185,7 @@ app.post('/send', async (req, res) => {
             });
         }
 
-        const { phone, message } = req.body;
+        const { phone, message, idempotencyKey } = req.body;
         
         if (!phone || !message) {
             return res.status(400).json({ 
@@ -124,30 +195,31 @@ app.post('/send', async (req, res) => {
         }
 
         // Formatear número (agregar @c.us si no lo tiene)
-        const chatId = phone.includes('@c.us') ? phone : `${phone}@c.us`;
+        chatId = phone.includes('@c.us') ? phone : `${phone}@c.us`;
         
-        // Enviar mensaje
-        const sentMessage = await client.sendMessage(chatId, message);
+        // Enviar mensaje (una sola vez por idempotencyKey)
+        const result = await sendOnce(idempotencyKey, async () => {
+            const sentMessage = await client.sendMessage(chatId, message);
+            return { messageId: sentMessage.id.id, timestamp: sentMessage.timestamp };
+        });
         
-        console.log(`✓ Mensaje enviado a ${phone}: ${message.substring(0, 50)}...`);
+        if (result.duplicate) {
+            console.log(`= Mensaje ${idempotencyKey} ya enviado a ${phone}, no se reenvía`);
+        } else {
+            console.log(`✓ Mensaje enviado a ${phone}: ${message.substring(0, 50)}...`);
+        }
         
-        res.json({ 
-            success: true, 
-            messageId: sentMessage.id.id,
-            timestamp: sentMessage.timestamp 
-        });
+        res.json({ success: true, ...result });
 
     } catch (error) {
         console.error('❌ Error enviando mensaje:', error);
-        res.status(500).json({ 
-            success: false, 
-            error: error.message 
-        });
+        await sendErrorResponse(res, error, chatId);
     }
 });
 
 // Enviar mensaje con adjunto (imagen, video, audio, documento)
 app.post('/send-media', async (req, res) => {
+    let chatId;
     try {
         if (!isReady) {
             return res.status(503).json({ 
@@ -156,7 +228,7 @@ app.post('/send-media', async (req, res) => {
             });
         }
 
-        const { phone, message, mediaPath, mediaType } = req.body;
+        const { phone, message, mediaPath, mediaType, idempotencyKey } = req.body;
         
         if (!phone || !mediaPath) {
             return res.status(400).json({ 
@@ -165,31 +237,95 @@ app.post('/send-media', async (req, res) => {
             });
         }
 
-        const chatId = phone.includes('@c.us') ? phone : `${phone}@c.us`;
+        chatId = phone.includes('@c.us') ? phone : `${phone}@c.us`;
         
-        // Cargar archivo
-        const media = MessageMedia.fromFilePath(mediaPath);
-        
-        // Enviar con caption opcional
-        const sentMessage = await client.sendMessage(chatId, media, { 
-            caption: message || '' 
+        const result = await sendOnce(idempotencyKey, async () => {
+            // Cargar archivo
+            const media = MessageMedia.fromFilePath(mediaPath);
+            
+            // Enviar con caption opcional
+            const sentMessage = await client.sendMessage(chatId, media, { 
+                caption: message || '' 
+            });
+            return { messageId: sentMessage.id.id, timestamp: sentMessage.timestamp };
         });
         
-        console.log(`✓ Media enviado a ${phone}: ${mediaType || 'file'}`);
+        if (result.duplicate) {
+            console.log(`= Media ${idempotencyKey} ya enviado a ${phone}, no se reenvía`);
+        } else {
+            console.log(`✓ Media enviado a ${phone}: ${mediaType || 'file'}`);
+        }
         
-        res.json({ 
-            success: true, 
-            messageId: sentMessage.id.id,
-            timestamp: sentMessage.timestamp 
-        });
+        res.json({ success: true, ...result });
 
     } catch (error) {
         console.error('❌ Error enviando media:', error);
-        res.status(500).json({ 
+        await sendErrorResponse(res, error, chatId);
+    }
+});
+
+// Enviar varios mensajes en una sola petición.
+// Body: { messages: [{ phone, message, mediaPath?, mediaType?, idempotencyKey? }, ...] }
+// Se envían en orden (los de un mismo teléfono llegan en el orden recibido) y
+// se devuelve un resultado por mensaje: { results: [{ success, messageId, ... }] }.
+// Los fallidos llevan code y status como las respuestas de /send: { success: false, code, status, error }
+const MAX_BATCH_SIZE = parseInt(process.env.MAX_BATCH_SIZE) || 100;
+
+app.post('/send-batch', async (req, res) => {
+    const items = req.body.messages;
+
+    if (!Array.isArray(items) || items.length === 0) {
+        return res.status(400).json({ 
             success: false, 
-            error: error.message 
+            error: 'Se requiere "messages" con al menos un mensaje' 
         });
     }
+    if (items.length > MAX_BATCH_SIZE) {
+        return res.status(400).json({ 
+            success: false, 
+            error: `Máximo ${MAX_BATCH_SIZE} mensajes por petición` 
+        });
+    }
+    if (!isReady) {
+        return res.status(503).json({ 
+            success: false, 
+            error: 'WhatsApp no está conectado' 
+        });
+    }
+
+    const results = [];
+    for (const item of items) {
+        const { phone, message, mediaPath, idempotencyKey } = item || {};
+
+        if (!phone || (!message && !mediaPath)) {
+            results.push({ success: false, code: 'invalid', status: 400, error: 'Se requieren "phone" y "message" o "mediaPath"' });
+            continue;
+        }
+        // Si la sesión se cae a mitad del lote, el resto se informa como no conectado
+        if (!isReady) {
+            results.push({ success: false, code: 'not_connected', status: ERROR_STATUS.not_connected, error: 'WhatsApp no está conectado' });
+            continue;
+        }
+
+        const chatId = phone.includes('@c.us') ? phone : `${phone}@c.us`;
+        try {
+            const result = await sendOnce(idempotencyKey, async () => {
+                const sentMessage = mediaPath
+                    ? await client.sendMessage(chatId, MessageMedia.fromFilePath(mediaPath), { caption: message || '' })
+                    : await client.sendMessage(chatId, message);
+                return { messageId: sentMessage.id.id, timestamp: sentMessage.timestamp };
+            });
+            results.push({ success: true, ...result });
+        } catch (error) {
+            console.error(`❌ Error enviando a ${phone}:`, error.message);
+            const code = await classifySendError(error, chatId);
+            results.push({ success: false, code, status: ERROR_STATUS[code], error: error.message });
+        }
+    }
+
+    const sent = results.filter(r => r.success).length;
+    console.log(`✓ Lote enviado: ${sent}/${items.length} mensajes`);
+    res.json({ success: true, results });
 });
 
 // Verificar si un número existe en WhatsApp
@@ -254,6 +390,7 @@ app.listen(PORT, () => {
     console.log(`   GET  /qr            - Obtener QR code`);
     console.log(`   POST /send          - Enviar mensaje`);
     console.log(`   POST /send-media    - Enviar archivo`);
+    console.log(`   POST /send-batch    - Enviar varios mensajes`);
     console.log(`   POST /check-number  - Verificar número`);
     console.log(`   GET  /info          - Info del cliente`);
     console.log(`   POST /logout        - Cerrar sesión`);